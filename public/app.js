@@ -135,11 +135,15 @@ const staggerReveal = () => {
   items.forEach((item) => observer.observe(item));
 };
 
-const buildLeaderboard = (leaderboard) => {
+let leaderboards = {};
+let activeBoard = "all";
+
+const renderLeaderboard = () => {
   const list = document.getElementById("leaderboardList");
   if (!list) return;
   list.innerHTML = "";
-  leaderboard.forEach((entry, index) => {
+  const board = leaderboards[activeBoard] || leaderboards.all;
+  board.entries.forEach((entry, index) => {
     const item = document.createElement("li");
     item.innerHTML = `<span>#${index + 1} ${entry.username}</span><strong>${numberFormat.format(
       entry.max_floor
@@ -148,6 +152,51 @@ const buildLeaderboard = (leaderboard) => {
   });
 };
 
+const buildLeaderboard = (leaderboard, seasonLeaderboard) => {
+  // summary.json built before season boards existed only has the all-time one.
+  leaderboards = { all: { label: "Всё время", entries: leaderboard } };
+  if (seasonLeaderboard) {
+    leaderboards.season = {
+      label: `Сезон ${seasonLeaderboard.season_key}`,
+      entries: seasonLeaderboard.top,
+    };
+    Object.entries(seasonLeaderboard.heroes).forEach(([hero, entries]) => {
+      leaderboards[`hero:${hero}`] = { label: hero, entries };
+    });
+  }
+  if (!leaderboards[activeBoard]) {
+    activeBoard = "all";
+  }
+  const picker = document.getElementById("boardPicker");
+  if (picker) {
+    picker.innerHTML = "";
+    Object.entries(leaderboards).forEach(([key, board]) => {
+      const button = document.createElement("button");
+      button.type = "button";
+      button.dataset.board = key;
+      button.textContent = board.label;
+      button.classList.toggle("is-active", key === activeBoard);
+      picker.appendChild(button);
+    });
+    picker.hidden = Object.keys(leaderboards).length < 2;
+  }
+  renderLeaderboard();
+};
+
+const connectBoardPicker = () => {
+  const picker = document.getElementById("boardPicker");
+  if (!picker) return;
+  picker.addEventListener("click", (event) => {
+    const button = event.target.closest("button[data-board]");
+    if (!button) return;
+    activeBoard = button.dataset.board;
+    picker.querySelectorAll("button").forEach((item) => {
+      item.classList.toggle("is-active", item === button);
+    });
+    renderLeaderboard();
+  });
+};
+
 const buildSeasons = (seasons) => {
   const container = document.getElementById("seasonList");
   if (!container) return;
@@ -227,20 +276,132 @@ const buildActiveRuns = (runs) => {
   });
 };
 
-const buildAllPlayers = (players) => {
-  const list = document.getElementById("allPlayersList");
-  if (!list) return;
-  list.innerHTML = "";
-  const sorted = [...players].sort((a, b) => {
-    if (b.max_floor !== a.max_floor) {
-      return b.max_floor - a.max_floor;
+const liveRuns = new Map();
+let liveConnected = false;
+
+const renderLiveRuns = () => {
+  // Run ids are "shard:id" strings when several databases are merged.
+  const runs = [...liveRuns.values()].sort((a, b) =>
+    String(a.run_id).localeCompare(String(b.run_id), undefined, { numeric: true })
+  );
+  setText("activeRuns", runs.length);
+  buildActiveRuns(runs);
+};
+
+const applyRunChanges = (run, changes) => {
+  Object.entries(changes).forEach(([key, value]) => {
+    if (value && typeof value === "object" && !Array.isArray(value) && run[key]) {
+      run[key] = { ...run[key], ...value };
+    } else {
+      run[key] = value;
     }
-    return b.xp - a.xp;
   });
-  sorted.forEach((player) => {
+};
+
+const connectLiveRuns = () => {
+  if (!window.EventSource) return;
+  const source = new EventSource("events/active-runs");
+  source.addEventListener("snapshot", (event) => {
+    const { active_runs: runs } = JSON.parse(event.data);
+    liveConnected = true;
+    liveRuns.clear();
+    runs.forEach((run) => liveRuns.set(run.run_id, run));
+    renderLiveRuns();
+  });
+  source.addEventListener("diff", (event) => {
+    const { started, updated, ended } = JSON.parse(event.data);
+    started.forEach((run) => liveRuns.set(run.run_id, run));
+    updated.forEach(({ run_id: runId, changes }) => {
+      const run = liveRuns.get(runId);
+      if (run) {
+        applyRunChanges(run, changes);
+      }
+    });
+    ended.forEach((runId) => liveRuns.delete(runId));
+    renderLiveRuns();
+  });
+};
+
+let daysData = null;
+let activeWindow = "30";
+
+const shiftDate = (isoDate, days) => {
+  const parsed = new Date(`${isoDate}T00:00:00Z`);
+  parsed.setUTCDate(parsed.getUTCDate() + days);
+  return parsed.toISOString().slice(0, 10);
+};
+
+// Returns [from, to] as inclusive ISO dates, or null for all time.
+const windowRange = (days, key) => {
+  if (key === "all") return null;
+  if (key === "season") {
+    const season = days.seasons.find((item) => !item.last_day)
+      || days.seasons[days.seasons.length - 1];
+    if (!season) return null;
+    return [season.first_day || days.days[0], season.last_day || days.today];
+  }
+  return [shiftDate(days.today, 1 - Number(key)), days.today];
+};
+
+const renderWindow = () => {
+  if (!daysData) return;
+  const range = windowRange(daysData, activeWindow);
+  let runs = 0;
+  let floorSum = 0;
+  let ended = 0;
+  let durationMs = 0;
+  daysData.days.forEach((day, index) => {
+    if (range && (!day || day < range[0] || day > range[1])) return;
+    runs += daysData.runs[index];
+    floorSum += daysData.floor_sum[index];
+    ended += daysData.ended[index];
+    durationMs += daysData.duration_ms[index];
+  });
+  setText("windowRuns", runs);
+  setText("windowAvgFloor", runs ? floorSum / runs : 0, decimalFormat);
+  setText(
+    "windowAvgMinutes",
+    ended ? durationMs / ended / 60000 : 0,
+    decimalFormat
+  );
+};
+
+const buildWindow = (days) => {
+  daysData = days;
+  const section = document.getElementById("windowSection");
+  if (section) {
+    section.hidden = false;
+  }
+  renderWindow();
+};
+
+const connectWindowPicker = () => {
+  const picker = document.getElementById("windowPicker");
+  if (!picker) return;
+  picker.addEventListener("click", (event) => {
+    const button = event.target.closest("button[data-window]");
+    if (!button) return;
+    activeWindow = button.dataset.window;
+    picker.querySelectorAll("button").forEach((item) => {
+      item.classList.toggle("is-active", item === button);
+    });
+    renderWindow();
+  });
+};
+
+const fetchJson = async (url, cache = "default") => {
+  const response = await fetch(url, { cache });
+  if (!response.ok) {
+    throw new Error(`${url}: ${response.status}`);
+  }
+  return response.json();
+};
+
+const appendPlayers = (list, players) => {
+  players.forEach((player) => {
     const item = document.createElement("li");
     item.innerHTML = `
-      <a href="player.html?id=${player.id}">
+      <a href="player.html?id=${encodeURIComponent(player.id)}">
         <span>${player.username}</span> <strong>Этаж ${numberFormat.format(player.max_floor)}</strong>
       </a>
     `;
@@ -248,15 +409,221 @@ const buildAllPlayers = (players) => {
   });
 };
 
+let playersPageSession = 0;
+const buildAllPlayers = async (index, cache) => {
+  const list = document.getElementById("allPlayersList");
+  if (!list) return;
+  list.innerHTML = "";
+  const moreButton = document.getElementById("playersMoreButton");
+  const session = ++playersPageSession;
+  const pages = index?.pages || 0;
+  let nextPage = 1;
+
+  const loadPage = async () => {
+    const page = await fetchJson(`data/users/${nextPage}.json`, cache);
+    if (session !== playersPageSession) return;
+    appendPlayers(list, page.users || []);
+    nextPage += 1;
+    if (moreButton) {
+      moreButton.hidden = nextPage > pages;
+    }
+  };
+
+  if (moreButton) {
+    moreButton.hidden = true;
+    moreButton.onclick = () => {
+      moreButton.disabled = true;
+      loadPage()
+        .catch((error) => {
+          console.error("Failed to load players", error);
+        })
+        .finally(() => {
+          moreButton.disabled = false;
+        });
+    };
+  }
+  if (pages) {
+    await loadPage();
+  }
+};
+
+const percentileKeys = ["p50", "p90", "p99"];
+const percentilePoints = (values) =>
+  percentileKeys.map((key) => (values ? values[key] : null));
+
+// analytics is null without NumPy and in stream builds; the section stays
+// hidden then.
+const analyticsCharts = (analytics) => [
+  {
+    id: "durationPercentilesChart",
+    build: (canvas) => {
+      const { all, regular } = analytics.percentiles;
+      buildChart(canvas, {
+        type: "bar",
+        data: {
+          labels: percentileKeys,
+          datasets: [
+            {
+              label: "Все забеги",
+              data: percentilePoints(all.duration_minutes),
+              backgroundColor: "rgba(139, 94, 60, 0.55)",
+              borderRadius: 6,
+            },
+            {
+              label: "Без обучения",
+              data: percentilePoints(regular.duration_minutes),
+              backgroundColor: "rgba(61, 91, 74, 0.55)",
+              borderRadius: 6,
+            },
+          ],
+        },
+        options: baseOptions,
+      });
+    },
+  },
+  {
+    id: "floorPercentilesChart",
+    build: (canvas) => {
+      const { all, regular } = analytics.percentiles;
+      buildChart(canvas, {
+        type: "bar",
+        data: {
+          labels: percentileKeys,
+          datasets: [
+            {
+              label: "Все забеги",
+              data: percentilePoints(all.max_floor),
+              backgroundColor: "rgba(139, 94, 60, 0.55)",
+              borderRadius: 6,
+            },
+            {
+              label: "Без обучения",
+              data: percentilePoints(regular.max_floor),
+              backgroundColor: "rgba(61, 91, 74, 0.55)",
+              borderRadius: 6,
+            },
+          ],
+        },
+        options: {
+          ...baseOptions,
+          scales: { y: { ticks: { precision: 0 } } },
+        },
+      });
+    },
+  },
+  {
+    id: "survivalChart",
+    build: (canvas) => {
+      const survival = analytics.survival || {
+        floors: [],
+        survival: [],
+        hazard: [],
+      };
+      buildChart(canvas, {
+        type: "line",
+        data: {
+          labels: survival.floors,
+          datasets: [
+            {
+              label: "Доживают, %",
+              data: survival.survival.map((value) => value * 100),
+              borderColor: palette.moss,
+              backgroundColor: "rgba(61, 91, 74, 0.25)",
+              tension: 0.25,
+              fill: true,
+              yAxisID: "y",
+            },
+            {
+              label: "Риск смерти, %",
+              data: survival.hazard.map((value) => value * 100),
+              borderColor: palette.ember,
+              tension: 0.25,
+              yAxisID: "hazard",
+            },
+          ],
+        },
+        options: {
+          ...baseOptions,
+          scales: {
+            y: { min: 0, max: 100 },
+            hazard: {
+              position: "right",
+              min: 0,
+              grid: { drawOnChartArea: false },
+            },
+            x: { ticks: { maxRotation: 0 } },
+          },
+        },
+      });
+    },
+  },
+  {
+    id: "heroFloorsChart",
+    build: (canvas) => {
+      const heroes = Object.entries(analytics.hero_floors);
+      const colors = [
+        "rgba(127, 103, 70, 0.55)",
+        "rgba(61, 91, 74, 0.55)",
+        "rgba(139, 94, 60, 0.55)",
+      ];
+      buildChart(canvas, {
+        type: "bar",
+        data: {
+          labels: heroes.map(([hero]) => hero),
+          datasets: percentileKeys.map((key, index) => ({
+            label: key,
+            data: heroes.map(([, values]) => values[key]),
+            backgroundColor: colors[index],
+            borderRadius: 6,
+          })),
+        },
+        options: {
+          ...baseOptions,
+          scales: { y: { ticks: { precision: 0 } } },
+        },
+      });
+    },
+  },
+  {
+    id: "retentionChart",
+    build: (canvas) => {
+      const retention = analytics.retention || {
+        days: [],
+        cohorts: [],
+        rates: [],
+      };
+      const colors = [palette.sun, palette.moss, palette.ember];
+      buildChart(canvas, {
+        type: "line",
+        data: {
+          labels: retention.cohorts.map(formatDateOnly),
+          datasets: retention.days.map((days, index) => ({
+            label: `День ${days}`,
+            data: retention.rates[index],
+            borderColor: colors[index % colors.length],
+            tension: 0.3,
+            spanGaps: false,
+          })),
+        },
+        options: {
+          ...baseOptions,
+          scales: {
+            y: { min: 0, max: 100 },
+            x: { ticks: { maxRotation: 0 } },
+          },
+        },
+      });
+    },
+  },
+];
+
 const loadData = async (forceReload = false) => {
-  const suffix = forceReload ? `?ts=${Date.now()}` : "";
-  const response = await fetch(`data/stats.json${suffix}`);
-  const data = await response.json();
+  const cache = forceReload ? "no-cache" : "default";
+  const data = await fetchJson("data/summary.json", cache);
 
   destroyCharts();
 
   setRaw("generatedAt", formatUtcPlus3(data.generated_at));
-  setText("activeRuns", data.summary.active_runs);
   setText("avgRunMinutes", data.summary.avg_run_minutes, decimalFormat);
   setText("totalUsersAll", data.summary.total_users_all);
   setText("totalUsersSeason", data.summary.total_users_season);
@@ -274,10 +641,27 @@ const loadData = async (forceReload = false) => {
   setText("runsWeek", data.summary.runs_last_7_days);
   setText("avgFloorWeek", data.summary.avg_floor_last_7_days, decimalFormat);
 
-  buildLeaderboard(data.leaderboard);
-  buildSeasons(data.seasons);
-  buildActiveRuns(data.active_runs);
-  buildAllPlayers(data.users_list || []);
+  buildLeaderboard(data.leaderboard, data.season_leaderboard);
+  fetchJson("data/seasons.json", cache)
+    .then(buildSeasons)
+    .catch((error) => {
+      console.error("Failed to load seasons", error);
+    });
+  // days.json is missing from data built before it existed; the section
+  // simply stays hidden then.
+  fetchJson("data/days.json", cache)
+    .then(buildWindow)
+    .catch((error) => {
+      console.error("Failed to load daily totals", error);
+    });
+  // Once the live feed is up it is fresher than the snapshot in summary.json.
+  if (!liveConnected) {
+    setText("activeRuns", data.summary.active_runs);
+    buildActiveRuns(data.active_runs);
+  }
+  buildAllPlayers(data.users_list, cache).catch((error) => {
+    console.error("Failed to load players", error);
+  });
 
   const chartBuilders = [
     {
@@ -510,6 +894,13 @@ const loadData = async (forceReload = false) => {
       },
     },
   ];
+  const analyticsSection = document.getElementById("analyticsSection");
+  if (analyticsSection) {
+    analyticsSection.hidden = !data.analytics;
+  }
+  if (data.analytics) {
+    chartBuilders.push(...analyticsCharts(data.analytics));
+  }
 
   observeCharts(chartBuilders);
 
@@ -520,6 +911,9 @@ const init = () => {
   loadData(false).catch((error) => {
     console.error("Failed to load stats", error);
   });
+  connectLiveRuns();
+  connectWindowPicker();
+  connectBoardPicker();
 
   const refreshButton = document.getElementById("refreshButton");
   if (refreshButton) {
@@ -19,6 +19,132 @@ const formatDate = (value) => {
   return `${day}.${month}.${year} ${hours}:${minutes}`;
 };
 
+const formatRank = (rank) =>
+  rank
+    ? `Место ${numberFormat.format(rank.rank)} из ${numberFormat.format(
+        rank.total
+      )} · лучше ${decimalFormat.format(rank.percentile)}% игроков`
+    : "-";
+
+const formatSeconds = (seconds) =>
+  seconds === null || seconds === undefined ? "-" : formatDate(seconds * 1000);
+
+const PAGE_SIZE = 50;
+
+// The builder reads timestamps without an offset as UTC.
+const naiveTimestamp = /^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$/;
+
+const toSeconds = (value) => {
+  if (!value) return null;
+  const parsed = parseDate(
+    naiveTimestamp.test(value) ? `${value.replace(" ", "T")}Z` : value
+  );
+  return parsed ? Math.floor(parsed.getTime() / 1000) : null;
+};
+
+// Cards built before the column format list one object per entry; they
+// are turned into the same columns once.
+const legacyColumns = (rows, fields) => {
+  const document = { count: rows.length, base: {} };
+  Object.entries(fields).forEach(([name, read]) => {
+    document[name] = rows.map(read);
+  });
+  return document;
+};
+
+const legacyRuns = (rows) =>
+  legacyColumns(rows, {
+    id: (run) => run.id,
+    started_at: (run) => toSeconds(run.started_at),
+    duration: (run) => {
+      const started = toSeconds(run.started_at);
+      const ended = toSeconds(run.ended_at);
+      return started === null || ended === null ? null : ended - started;
+    },
+    max_floor: (run) => run.max_floor,
+    flags: (run) => (run.is_active ? 1 : 0) | (run.is_tutorial ? 2 : 0),
+  });
+
+const legacyPurchases = (rows) =>
+  legacyColumns(rows, {
+    created_at: (purchase) => toSeconds(purchase.created_at),
+    stars: (purchase) => purchase.stars,
+    levels: (purchase) => purchase.levels,
+    xp_added: (purchase) => purchase.xp_added,
+  });
+
+const legacyActions = (rows) =>
+  legacyColumns(rows, {
+    created_at: (action) => toSeconds(action.created_at),
+    action: (action) => action.action,
+    stars: (action) => action.stars,
+  });
+
+const undelta = (base, deltas) => {
+  let previous = base;
+  return deltas.map((delta) => (delta === null ? null : (previous += delta)));
+};
+
+// Runs, purchases and actions come as one array per field: fields under
+// `base` are delta-encoded, fields under `dictionary` are codes. A column
+// is decoded the first time it is read.
+const columnTable = (document, legacy) => {
+  const source = Array.isArray(document)
+    ? legacy(document)
+    : document || { count: 0, base: {} };
+  const decoded = new Map();
+  const column = (name) => {
+    if (!decoded.has(name)) {
+      let values = source[name] || [];
+      if (name in source.base) {
+        values = undelta(source.base[name], values);
+      }
+      const dictionary = source.dictionary && source.dictionary[name];
+      if (dictionary) {
+        values = values.map((code) => dictionary[code]);
+      }
+      decoded.set(name, values);
+    }
+    return decoded.get(name);
+  };
+  const row = (index, fields) =>
+    Object.fromEntries(fields.map((name) => [name, column(name)[index]]));
+  return { count: source.count, column, row };
+};
+
+const sumColumn = (table, name) =>
+  table.column(name).reduce((total, value) => total + (Number(value) || 0), 0);
+
+const renderPagedList = (id, buttonId, table, fields, render, emptyLabel) => {
+  const list = document.getElementById(id);
+  const button = document.getElementById(buttonId);
+  if (!list) return;
+  list.innerHTML = "";
+  if (!table.count) {
+    renderList(id, [], emptyLabel);
+    return;
+  }
+  let shown = 0;
+  const showPage = () => {
+    const end = Math.min(shown + PAGE_SIZE, table.count);
+    for (; shown < end; shown += 1) {
+      const item = document.createElement("li");
+      item.innerHTML = render(table.row(shown, fields));
+      list.appendChild(item);
+    }
+    if (button) {
+      button.hidden = shown >= table.count;
+      button.textContent = `Показать ещё (${numberFormat.format(
+        table.count - shown
+      )})`;
+    }
+  };
+  if (button) {
+    button.onclick = showPage;
+  }
+  showPage();
+};
+
 const getParam = (key) => {
   const params = new URLSearchParams(window.location.search);
   return params.get(key);
@@ -83,24 +209,36 @@ const revealSections = () => {
   items.forEach((item) => observer.observe(item));
 };
 
-const sumBy = (items, key) =>
-  items.reduce((total, item) => total + (Number(item[key]) || 0), 0);
+const fetchJson = async (url) => {
+  const response = await fetch(url);
+  if (response.status === 404) {
+    return null;
+  }
+  if (!response.ok) {
+    throw new Error(`${url}: ${response.status}`);
+  }
+  return response.json();
+};
 
 const init = async () => {
   let playerId = getParam("id");
-  let data;
+  let details = null;
   try {
-    const response = await fetch("data/stats.json");
-    data = await response.json();
+    if (!playerId) {
+      const page = await fetchJson("data/users/1.json");
+      playerId = page?.users?.[0]?.id?.toString() || null;
+    }
+    // Player ids are "shard:id" strings when several databases are merged.
+    if (playerId && /^([\w.-]+:)?\d+$/.test(playerId)) {
+      details = await fetchJson(
+        `data/players/${encodeURIComponent(playerId)}.json`
+      );
+    }
   } catch (error) {
     setText("playerName", "Данные недоступны");
     setText("playerMeta", "Не удалось загрузить статистику.");
     return;
   }
-  if (!playerId) {
-    playerId = data.users_list?.[0]?.id?.toString() || null;
-  }
-  const details = playerId ? data.user_details?.[playerId] : null;
   if (!details) {
     setText("playerName", "Игрок не найден");
     setText(
@@ -117,28 +255,28 @@ const init = async () => {
     "playerMeta",
     `ID ${details.id} · XP ${numberFormat.format(
       details.xp
-    )} · Максимальный этаж ${numberFormat.format(details.max_floor)}`
+    )} · Максимальный этаж ${numberFormat.format(details.max_floor)}${
+      details.rank ? ` · ${formatRank(details.rank)}` : ""
+    }`
   );
 
   const summary = document.getElementById("playerSummary");
-  const purchases = details.purchases || [];
-  const actions = details.actions || [];
+  const purchases = columnTable(details.purchases, legacyPurchases);
+  const actions = columnTable(details.actions, legacyActions);
   const broadcasts = details.broadcasts || [];
-  const runs = details.runs || [];
-  const endedRuns = runs.filter((run) => run.ended_at);
-  const runDurations = endedRuns
-    .map((run) => {
-      const started = parseDate(run.started_at);
-      const ended = parseDate(run.ended_at);
-      if (!started || !ended) return null;
-      const minutes = (ended - started) / 60000;
-      return minutes >= 0 ? minutes : null;
-    })
-    .filter((value) => value !== null);
-  const totalStarsBought = sumBy(purchases, "stars");
-  const totalLevelsBought = sumBy(purchases, "levels");
-  const totalXpBought = sumBy(purchases, "xp_added");
-  const totalStarsSpent = sumBy(actions, "stars");
+  const runs = columnTable(details.runs, legacyRuns);
+  const runFloors = runs.column("max_floor");
+  const activeRunCount = runs
+    .column("flags")
+    .filter((flags) => flags & 1).length;
+  const runDurations = runs
+    .column("duration")
+    .filter((seconds) => seconds !== null && seconds >= 0)
+    .map((seconds) => seconds / 60);
+  const totalStarsBought = sumColumn(purchases, "stars");
+  const totalLevelsBought = sumColumn(purchases, "levels");
+  const totalXpBought = sumColumn(purchases, "xp_added");
+  const totalStarsSpent = sumColumn(actions, "stars");
 
   buildSummary(summary, [
     {
@@ -167,7 +305,7 @@ const init = async () => {
     },
     {
       label: "Покупок звёзд",
-      value: numberFormat.format(purchases.length),
+      value: numberFormat.format(purchases.count),
     },
     {
       label: "Потрачено звёзд",
@@ -183,6 +321,7 @@ const init = async () => {
       `<span>Обучение</span> <strong>${details.tutorial_done ? "пройдено" : "нет"}</strong>`,
       `<span>Макс этаж</span> <strong>${numberFormat.format(details.max_floor)}</strong>`,
       `<span>XP</span> <strong>${numberFormat.format(details.xp)}</strong>`,
+      `<span>Рейтинг</span> <strong>${formatRank(details.rank)}</strong>`,
     ],
     "Нет данных."
   );
@@ -272,6 +411,8 @@ const init = async () => {
             <li><span>Сокровищ</span> <strong>${numberFormat.format(season.treasures_found)}</strong></li>
             <li><span>Сундуков</span> <strong>${numberFormat.format(season.chests_opened)}</strong></li>
             <li><span>Герой вершины</span> <strong>${season.max_floor_character || "неизвестно"}</strong></li>
+            <li><span>Место в сезоне</span> <strong>${formatRank(season.rank)}</strong></li>
+            <li><span>Место среди героя</span> <strong>${formatRank(season.hero_rank)}</strong></li>
           </ul>
         </div>
       </div>
@@ -307,36 +448,39 @@ const init = async () => {
     "Нет данных."
   );
 
-  renderList(
+  renderPagedList(
     "playerRuns",
-    runs.map(
-      (run) =>
-        `<span>#${run.id} · Этаж ${run.max_floor} · ${
-          run.is_active ? "активен" : "завершен"
-        }</span> <strong>${formatDate(run.started_at)}</strong>`
-    ),
+    "playerRunsMore",
+    runs,
+    ["id", "max_floor", "flags", "started_at"],
+    (run) =>
+      `<span>#${run.id} · Этаж ${run.max_floor} · ${
+        run.flags & 1 ? "активен" : "завершен"
+      }</span> <strong>${formatSeconds(run.started_at)}</strong>`,
     "Нет забегов."
   );
 
-  renderList(
+  renderPagedList(
     "playerPurchases",
-    purchases.map(
-      (purchase) =>
-        `<span>${formatDate(purchase.created_at)}</span> <strong>${numberFormat.format(
-          purchase.stars
-        )}★ / ${numberFormat.format(purchase.levels)} lvl</strong>`
-    ),
+    "playerPurchasesMore",
+    purchases,
+    ["created_at", "stars", "levels"],
+    (purchase) =>
+      `<span>${formatSeconds(purchase.created_at)}</span> <strong>${numberFormat.format(
+        purchase.stars
+      )}★ / ${numberFormat.format(purchase.levels)} lvl</strong>`,
     "Нет покупок."
   );
 
-  renderList(
+  renderPagedList(
     "playerActions",
-    actions.map(
-      (action) =>
-        `<span>${action.action || "действие"} · ${
-          formatDate(action.created_at)
-        }</span> <strong>${numberFormat.format(action.stars)}★</strong>`
-    ),
+    "playerActionsMore",
+    actions,
+    ["action", "created_at", "stars"],
+    (action) =>
+      `<span>${action.action || "действие"} · ${formatSeconds(
+        action.created_at
+      )}</span> <strong>${numberFormat.format(action.stars)}★</strong>`,
     "Нет действий."
   );
 
@@ -352,13 +496,13 @@ const init = async () => {
   );
 
   const runSummary = document.getElementById("playerRunSummary");
-  const maxRunFloor = runs.reduce(
-    (max, run) => Math.max(max, run.max_floor),
+  const maxRunFloor = runFloors.reduce(
+    (max, floor) => Math.max(max, floor),
     0
   );
   const avgRunFloor =
-    runs.length > 0
-      ? runs.reduce((sum, run) => sum + run.max_floor, 0) / runs.length
+    runs.count > 0
+      ? runFloors.reduce((sum, floor) => sum + floor, 0) / runs.count
       : 0;
   const avgRunDuration =
     runDurations.length > 0
@@ -366,18 +510,22 @@ const init = async () => {
         runDurations.length
       : 0;
   const maxRunDuration =
-    runDurations.length > 0 ? Math.max(...runDurations) : 0;
+    runDurations.length > 0
+      ? runDurations.reduce((max, value) => Math.max(max, value))
+      : 0;
   const minRunDuration =
-    runDurations.length > 0 ? Math.min(...runDurations) : 0;
+    runDurations.length > 0
+      ? runDurations.reduce((min, value) => Math.min(min, value))
+      : 0;
 
   buildSummary(runSummary, [
     {
       label: "Активных забегов",
-      value: numberFormat.format(runs.filter((run) => run.is_active).length),
+      value: numberFormat.format(activeRunCount),
     },
     {
       label: "Завершённых забегов",
-      value: numberFormat.format(runs.filter((run) => !run.is_active).length),
+      value: numberFormat.format(runs.count - activeRunCount),
     },
     {
       label: "Средний этаж",
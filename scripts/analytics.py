@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+import time
+
+import build_stats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+PERCENTILES = (50, 90, 99)
+RETENTION_DAYS = (1, 7, 30)
+BATCH = 65536
+# Day 0 is 1970-01-01, a Thursday; cohorts are weeks starting on Monday.
+FIRST_MONDAY = 4
+UNIX_EPOCH_JD = 2440587.5
+
+RUN_COLUMNS = """
+select
+    user_id,
+    julianday(started_at),
+    julianday(ended_at),
+    cast(coalesce(max_floor, 0) as integer),
+    case when is_tutorial then 1 else 0 end
+from runs
+"""
+USER_COLUMNS = f"select id, julianday(created_at) - {UNIX_EPOCH_JD} from users"
+SEASON_COLUMNS = """
+select max_floor_character, cast(coalesce(max_floor, 0) as integer)
+from user_season_stats
+where max_floor_character is not null and max_floor_character <> ''
+    and season_id in (select id from seasons)
+"""
+
+
+def read_matrix(conn, table, sql, width):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(BATCH)
+        if not rows:
+            break
+        build_stats.table_rows[table] += len(rows)
+        # None becomes NaN in a float array.
+        parts.append(np.array(rows, dtype=np.float64).reshape(-1, width))
+    return np.concatenate(parts) if parts else np.empty((0, width))
+
+
+def last_starts(user_ids, run_users, run_starts):
+    """Latest run start per user, NaN for users without a dated run."""
+    last = np.full(user_ids.size, -np.inf)
+    if user_ids.size:
+        order = np.argsort(user_ids)
+        found = np.searchsorted(user_ids, run_users, sorter=order)
+        found = order[found.clip(max=user_ids.size - 1)]
+        known = (user_ids[found] == run_users) & ~np.isnan(run_starts)
+        np.maximum.at(last, found[known], run_starts[known])
+    last[np.isinf(last)] = np.nan
+    return last
+
+
+def read_columns(conn, hero_name_map):
+    """Column arrays behind the analytics section, or None without NumPy.
+
+    Rows carry no ids, so the columns of several databases are simply
+    concatenated by merge_columns.
+    """
+    if np is None:
+        return None
+    runs = read_matrix(conn, "runs", RUN_COLUMNS, 5)
+    users = read_matrix(conn, "users", USER_COLUMNS, 2)
+    started = runs[:, 1] - UNIX_EPOCH_JD
+    ended = runs[:, 2] - UNIX_EPOCH_JD
+    # Same rule as the duration buckets: unparsable or negative is not ended.
+    with np.errstate(invalid="ignore"):
+        minutes = np.where(ended >= started, (ended - started) * 1440.0, np.nan)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(SEASON_COLUMNS).fetchall()
+    build_stats.table_rows["user_season_stats"] += len(rows)
+    return {
+        "run_minutes": minutes,
+        "run_floor": runs[:, 3].astype(np.int64),
+        "run_tutorial": runs[:, 4].astype(bool),
+        "user_created": users[:, 1],
+        "user_last_start": last_starts(users[:, 0], runs[:, 0], started),
+        "season_hero": np.array(
+            [hero_name_map.get(hero, hero) for hero, _ in rows], dtype=object
+        ),
+        "season_floor": np.array([floor for _, floor in rows], dtype=np.int64),
+    }
+
+
+def merge_columns(parts):
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def percentiles(values):
+    values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    if not values.size:
+        return None
+    points = np.percentile(values, PERCENTILES)
+    return {
+        f"p{rank}": build_stats.safe_round(float(point), 2)
+        for rank, point in zip(PERCENTILES, points)
+    }
+
+
+def run_percentiles(minutes, floors):
+    return {
+        "runs": int(floors.size),
+        "ended": int(np.count_nonzero(~np.isnan(minutes))),
+        "duration_minutes": percentiles(minutes),
+        "max_floor": percentiles(floors),
+    }
+
+
+def survival_curve(run_floor, deaths_by_floor):
+    """Per-floor death hazard and survival, Kaplan-Meier style.
+
+    A run is at risk on every floor up to its max_floor, so unfinished runs
+    only count as censored; the hazard on a floor is its deaths over the
+    runs at risk there.
+    """
+    death_floors = []
+    death_counts = []
+    for key, count in deaths_by_floor.items():
+        try:
+            death_floors.append(int(key))
+        except ValueError:
+            continue
+        death_counts.append(count)
+    death_floors = np.array(death_floors, dtype=np.int64)
+    death_counts = np.array(death_counts, dtype=np.int64)
+    keep = death_floors >= 0
+    death_floors, death_counts = death_floors[keep], death_counts[keep]
+    run_floor = run_floor[run_floor >= 0]
+    if not run_floor.size and not death_floors.size:
+        return None
+    top = int(max(run_floor.max(initial=0), death_floors.max(initial=0)))
+    bottom = int(min(run_floor.min(initial=top), death_floors.min(initial=top)))
+    at_risk = np.bincount(run_floor, minlength=top + 1)[::-1].cumsum()[::-1]
+    deaths = np.bincount(death_floors, weights=death_counts, minlength=top + 1)
+    hazard = np.divide(
+        deaths, at_risk, out=np.zeros(top + 1), where=at_risk > 0
+    ).clip(0, 1)
+    survival = np.cumprod(1 - hazard[bottom:])
+    return {
+        "floors": list(range(bottom, top + 1)),
+        "at_risk": at_risk[bottom:].tolist(),
+        "deaths": deaths[bottom:].astype(np.int64).tolist(),
+        "hazard": [
+            build_stats.safe_round(value, 4) for value in hazard[bottom:].tolist()
+        ],
+        "survival": [
+            build_stats.safe_round(value, 4) for value in survival.tolist()
+        ],
+    }
+
+
+def hero_floors(heroes, floors):
+    """Season-best floor percentiles per hero (max_floor_character)."""
+    if not heroes.size:
+        return {}
+    names, codes = np.unique(heroes.astype(str), return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(floors[order], np.flatnonzero(np.diff(codes[order])) + 1)
+    return {
+        str(name): dict(
+            percentiles(group), seasons=int(group.size), max=int(group.max())
+        )
+        for name, group in zip(names, groups)
+    }
+
+
+def retention(created, last_start, now):
+    """Weekly signup cohorts and the share that started a run N days later.
+
+    A user counts for day N once N days have passed since signup.
+    """
+    valid = ~np.isnan(created)
+    created, last_start = created[valid], last_start[valid]
+    if not created.size:
+        return None
+    day = np.floor(created).astype(np.int64)
+    week = day - (day - FIRST_MONDAY) % 7
+    cohorts, inverse, sizes = np.unique(
+        week, return_inverse=True, return_counts=True
+    )
+    rates = []
+    with np.errstate(invalid="ignore"):
+        for days in RETENTION_DAYS:
+            eligible = created + days <= now
+            kept = eligible & (last_start >= created + days)
+            eligible = np.bincount(inverse, weights=eligible, minlength=cohorts.size)
+            kept = np.bincount(inverse, weights=kept, minlength=cohorts.size)
+            rates.append(
+                [
+                    build_stats.safe_round(100 * k / e, 2) if e else None
+                    for k, e in zip(kept.tolist(), eligible.tolist())
+                ]
+            )
+    return {
+        "days": list(RETENTION_DAYS),
+        "cohorts": np.datetime_as_string(cohorts.astype("datetime64[D]")).tolist(),
+        "users": sizes.tolist(),
+        "rates": rates,
+    }
+
+
+def analyze(columns, deaths_by_floor, now=None):
+    if columns is None:
+        return None
+    now = (time.time() if now is None else now) / 86400
+    minutes = columns["run_minutes"]
+    floors = columns["run_floor"]
+    regular = ~columns["run_tutorial"]
+    return {
+        "percentiles": {
+            "all": run_percentiles(minutes, floors),
+            "regular": run_percentiles(minutes[regular], floors[regular]),
+        },
+        "survival": survival_curve(floors, deaths_by_floor),
+        "hero_floors": hero_floors(columns["season_hero"], columns["season_floor"]),
+        "retention": retention(
+            columns["user_created"], columns["user_last_start"], now
+        ),
+    }
+
+
+def read_analytics(conn, deaths_by_floor, hero_name_map):
+    return analyze(read_columns(conn, hero_name_map), deaths_by_floor)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import build_stats
+import ranks
+import streaming
+from build_stats import (
+    badge_entry,
+    broadcast_entry,
+    parse_json,
+    parse_user_stats,
+    run_entry,
+    user_active_run,
+    user_season_entry,
+)
+
+
+API_PREFIX = "/api/"
+API_TTL = float(os.environ.get("STATS_API_TTL", "5"))
+API_CACHE_SIZE = 1024
+API_POOL_SIZE = int(os.environ.get("STATS_API_POOL_SIZE", "8"))
+RUNS_PAGE_SIZE = 50
+LEADERBOARD_LIMIT = 10
+MAX_LIMIT = 500
+MIN_ROWID = -(1 << 63)
+MAX_ROWID = (1 << 63) - 1
+
+# Per-player history tables; without an index on user_id every player
+# lookup scans the whole table.
+USER_INDEXED_TABLES = ("runs", "star_purchases", "star_actions")
+
+PLAYER_ROUTE = re.compile(r"^/api/players/(-?\d+)$")
+RUNS_ROUTE = re.compile(r"^/api/players/(-?\d+)/runs$")
+
+RANK_ORDER = (
+    "cast(coalesce(max_floor, 0) as integer) desc, "
+    "cast(coalesce(xp, 0) as integer) desc, rowid"
+)
+PLAYER_SORTS = {
+    "floor": RANK_ORDER,
+    "xp": "cast(coalesce(xp, 0) as integer) desc, "
+    "cast(coalesce(max_floor, 0) as integer) desc, rowid",
+    "created": "created_at desc, rowid desc",
+    "name": "coalesce(username, '') collate nocase, rowid",
+}
+
+# Fixed statements with bound parameters, so sqlite3's per-connection
+# statement cache keeps them prepared between requests.
+USER_BY_ID = "select * from users where id = ?"
+STATS_BY_USER = "select * from user_stats where user_id = ? order by rowid"
+RUNS_BY_USER = (
+    f"select {build_stats.RUN_COLUMNS} from runs where user_id = ? order by id"
+)
+RUNS_PAGE = (
+    "select id, started_at, ended_at, max_floor, is_active, is_tutorial "
+    "from runs where user_id = ? and id < ? order by id desc limit ?"
+)
+SEASONS_BY_USER = "select * from user_season_stats where user_id = ? order by rowid"
+PURCHASES_BY_USER = "select * from star_purchases where user_id = ? order by rowid"
+ACTIONS_BY_USER = "select * from star_actions where user_id = ? order by rowid"
+BADGES_BY_USER = "select * from user_badges where user_id = ? order by rowid"
+BROADCASTS_BY_USER = "select * from user_broadcasts where user_id = ? order by rowid"
+PLAYERS_PAGE = """
+select users.*, exists(
+    select 1 from user_season_stats as s
+    where s.user_id = users.id and s.season_id is ?
+) as in_current_season
+from users
+order by {order}
+limit ? offset ?
+"""
+LEADERBOARD = f"select * from users order by {RANK_ORDER} limit ?"
+SEASON_LEADERBOARD = """
+select s.user_id as id, users.username as username, s.max_floor, s.xp_gained,
+    s.max_floor_character
+from user_season_stats as s
+left join users on users.id = s.user_id
+where s.season_id = ?
+order by
+    cast(coalesce(s.max_floor, 0) as integer) desc,
+    cast(coalesce(s.xp_gained, 0) as integer) desc,
+    s.rowid
+limit ?
+"""
+
+
+def missing_indexes(conn):
+    missing = []
+    for table in USER_INDEXED_TABLES:
+        plan = conn.execute(
+            f"explain query plan select 1 from {table} where user_id = ?", (0,)
+        ).fetchall()
+        if any(row[-1].startswith("SCAN") for row in plan):
+            missing.append(table)
+    return missing
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """Read-only connections handed to one request thread at a time.
+
+    ThreadingHTTPServer starts a thread per request, so connections are
+    checked out for the request rather than pinned to a thread that is
+    about to exit.
+    """
+
+    def __init__(self, size=API_POOL_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._db_path = None
+        self._checked = False
+
+    def acquire(self, db_path):
+        with self._lock:
+            if db_path != self._db_path:
+                for conn in self._idle:
+                    conn.close()
+                self._idle = []
+                self._db_path = db_path
+                self._checked = False
+            if self._idle:
+                return self._idle.pop()
+        conn = build_stats.connect_readonly(db_path, check_same_thread=False)
+        if not self._checked:
+            self._checked = True
+            for table in missing_indexes(conn):
+                logging.warning(
+                    "api: %s has no index on user_id, player lookups scan it; "
+                    "create index %s_user_id on %s (user_id)",
+                    table,
+                    table,
+                    table,
+                )
+            for statement in ranks.missing_rank_indexes(conn):
+                logging.warning(
+                    "api: player ranks scan the whole board without an index; %s",
+                    statement,
+                )
+        return conn
+
+    def release(self, db_path, conn):
+        with self._lock:
+            if db_path == self._db_path and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+class TtlCache:
+    def __init__(self, ttl=API_TTL, size=API_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.size:
+                self._entries = {
+                    k: entry for k, entry in self._entries.items() if entry[0] > now
+                }
+            if len(self._entries) >= self.size:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (now + self.ttl, value)
+
+
+POOL = ConnectionPool()
+CACHE = TtlCache()
+
+
+def parse_int(text, name):
+    # SQLite binds 64-bit integers; a larger Python int would overflow there.
+    try:
+        value = int(text)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if not MIN_ROWID <= value <= MAX_ROWID:
+        raise ApiError(400, f"{name} is out of range")
+    return value
+
+
+def int_param(query, name, default, minimum=None, maximum=None):
+    values = query.get(name)
+    if not values or values[-1] == "":
+        return default
+    value = parse_int(values[-1], name)
+    if minimum is not None and value < minimum:
+        raise ApiError(400, f"{name} must be at least {minimum}")
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def current_season_id(conn):
+    season = build_stats.pick_current_season(
+        conn.execute("select * from seasons").fetchall()
+    )
+    return season["id"] if season else None
+
+
+def player_card(conn, data_dir, user_id):
+    user = conn.execute(USER_BY_ID, (user_id,)).fetchone()
+    if user is None:
+        raise ApiError(404, "player not found")
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    season_map = {row["id"]: row for row in conn.execute("select * from seasons")}
+    stats_rows = conn.execute(STATS_BY_USER, (user_id,)).fetchall()
+    run_rows = conn.execute(RUNS_BY_USER, (user_id,)).fetchall()
+    active = list(
+        streaming.read_active_runs(conn, "and user_id = ?", (user_id,)).values()
+    )
+    active_run = user_active_run(active[0]) if active else None
+    season_rows = [
+        row
+        for row in conn.execute(SEASONS_BY_USER, (user_id,))
+        if row["season_id"] in season_map
+    ]
+    details = build_stats.user_detail(
+        user,
+        parse_json(user["unlocked_heroes_json"], []),
+        parse_user_stats(stats_rows[-1]) if stats_rows else None,
+        run_rows,
+        [
+            user_season_entry(row, season_map[row["season_id"]], hero_name_map)
+            for row in season_rows
+        ],
+        conn.execute(PURCHASES_BY_USER, (user_id,)).fetchall(),
+        conn.execute(ACTIONS_BY_USER, (user_id,)).fetchall(),
+        [badge_entry(row) for row in conn.execute(BADGES_BY_USER, (user_id,))],
+        [
+            broadcast_entry(row)
+            for row in conn.execute(BROADCASTS_BY_USER, (user_id,))
+        ],
+        active_run,
+        enemy_name_map,
+        hero_name_map,
+    )
+    # Counts over the boards' rank indexes instead of a RankIndex: this is a
+    # single card.
+    return ranks.query_annotate(conn, details, season_rows, season_map)
+
+
+def player_runs(conn, user_id, query):
+    if conn.execute(USER_BY_ID, (user_id,)).fetchone() is None:
+        raise ApiError(404, "player not found")
+    before = int_param(query, "before", None)
+    limit = int_param(query, "limit", RUNS_PAGE_SIZE, minimum=1, maximum=MAX_LIMIT)
+    rows = conn.execute(
+        RUNS_PAGE,
+        (user_id, before if before is not None else MAX_ROWID, limit + 1),
+    ).fetchall()
+    runs = [run_entry(row) for row in rows[:limit]]
+    return {
+        "id": user_id,
+        "runs": runs,
+        "next_before": runs[-1]["id"] if len(rows) > limit else None,
+    }
+
+
+def players_page(conn, query):
+    sort = (query.get("sort") or ["floor"])[-1]
+    if sort not in PLAYER_SORTS:
+        raise ApiError(400, "sort must be one of " + ", ".join(PLAYER_SORTS))
+    # Past this page the offset itself would overflow; it is empty anyway.
+    page = int_param(query, "page", 1, minimum=1, maximum=MAX_ROWID // MAX_LIMIT)
+    limit = int_param(
+        query, "limit", build_stats.USERS_PAGE_SIZE, minimum=1, maximum=MAX_LIMIT
+    )
+    total = conn.execute("select count(*) from users").fetchone()[0]
+    index = build_stats.users_index(total, limit)
+    rows = conn.execute(
+        PLAYERS_PAGE.format(order=PLAYER_SORTS[sort]),
+        (current_season_id(conn), limit, (page - 1) * limit),
+    )
+    document = build_stats.users_page(
+        page,
+        index,
+        [build_stats.users_list_entry(row, row["in_current_season"]) for row in rows],
+    )
+    document["sort"] = sort
+    return document
+
+
+def leaderboard(conn, data_dir, query):
+    limit = int_param(query, "limit", LEADERBOARD_LIMIT, minimum=1, maximum=MAX_LIMIT)
+    season_key = (query.get("season") or [""])[-1]
+    if not season_key:
+        return {
+            "season": None,
+            "leaderboard": [
+                {
+                    "id": row["id"],
+                    "username": build_stats.display_name(row),
+                    "max_floor": int(row["max_floor"] or 0),
+                    "xp": int(row["xp"] or 0),
+                }
+                for row in conn.execute(LEADERBOARD, (limit,))
+            ],
+        }
+    seasons = conn.execute("select * from seasons").fetchall()
+    if season_key == "current":
+        season = build_stats.pick_current_season(seasons)
+    else:
+        season = next((s for s in seasons if s["season_key"] == season_key), None)
+    if season is None:
+        raise ApiError(404, "season not found")
+    _, hero_name_map = build_stats.load_name_maps(data_dir)
+    return {
+        "season": season["season_key"],
+        "leaderboard": [
+            {
+                "id": row["id"],
+                "username": build_stats.display_name(row),
+                "max_floor": int(row["max_floor"] or 0),
+                "xp_gained": int(row["xp_gained"] or 0),
+                "max_floor_character": hero_name_map.get(
+                    row["max_floor_character"], row["max_floor_character"]
+                ),
+            }
+            for row in conn.execute(SEASON_LEADERBOARD, (season["id"], limit))
+        ],
+    }
+
+
+def active_runs(conn):
+    return {"active_runs": list(streaming.read_active_runs(conn).values())}
+
+
+def dispatch(conn, data_dir, path, query):
+    match = PLAYER_ROUTE.match(path)
+    if match:
+        return player_card(conn, data_dir, parse_int(match.group(1), "player id"))
+    match = RUNS_ROUTE.match(path)
+    if match:
+        return player_runs(conn, parse_int(match.group(1), "player id"), query)
+    if path == API_PREFIX + "players":
+        return players_page(conn, query)
+    if path == API_PREFIX + "leaderboard":
+        return leaderboard(conn, data_dir, query)
+    if path == API_PREFIX + "active-runs":
+        return active_runs(conn)
+    raise ApiError(404, "unknown endpoint")
+
+
+def make_document(value):
+    payload = build_stats.encode_stats(value)
+    variants = {None: payload}
+    if len(payload) >= build_stats.COMPRESS_MIN_SIZE:
+        variants["gzip"] = gzip.compress(payload, compresslevel=6)
+    return {
+        "variants": variants,
+        "digest": hashlib.blake2b(payload, digest_size=16).hexdigest(),
+        "modified": time.time(),
+    }
+
+
+def respond(path, query_string):
+    query = urllib.parse.parse_qs(query_string)
+    key = (path, tuple(sorted((name, tuple(v)) for name, v in query.items())))
+    document = CACHE.get(key)
+    if document is not None:
+        return document
+    db_path, data_dir = build_stats.resolve_paths()
+    paths = build_stats.db_paths(db_path)
+    if len(paths) > 1:
+        raise ApiError(501, "the API reads a single database, DB_PATH lists several")
+    db_path = paths[0]
+    conn = POOL.acquire(db_path)
+    try:
+        value = dispatch(conn, data_dir, path, query)
+    finally:
+        POOL.release(db_path, conn)
+    document = make_document(value)
+    CACHE.put(key, document)
+    return document
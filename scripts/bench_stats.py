@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import build_stats
+import synthetic_db
+
+
+DEFAULT_WORKDIR = os.path.join(build_stats.BASE_DIR, ".cache", "bench")
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+PHASES = ("snapshot", "load", "aggregate", "details", "serialize")
+SERVER_START_TIMEOUT = 600
+# Share of summary / player / users-page / static asset requests in the load test.
+REQUEST_MIX = (("summary", 0.2), ("player", 0.6), ("page", 0.1), ("asset", 0.1))
+ASSETS = ("/", "/app.js", "/styles.css", "/player.html", "/player.js")
+
+
+def ensure_db(workdir, users, runs_per_user):
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, f"ruins_{users}x{runs_per_user}.db")
+    if not os.path.exists(db_path):
+        started = time.perf_counter()
+        synthetic_db.generate(db_path, users, runs_per_user)
+        print(f"generated {db_path} in {time.perf_counter() - started:.1f}s")
+    return db_path
+
+
+def count_rows(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"select count(*) from {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def walk_output(out_dir):
+    for root, dirs, files in os.walk(out_dir, followlinks=True):
+        # Older generations sit next to the live symlinks; skip them.
+        dirs[:] = [name for name in dirs if "." not in name]
+        for name in files:
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, out_dir), path
+
+
+def output_stats(out_dir):
+    digest = hashlib.sha256()
+    sizes = {"files": 0, "json_bytes": 0, "gzip_bytes": 0, "brotli_bytes": 0}
+    for relative, path in sorted(walk_output(out_dir)):
+        size = os.path.getsize(path)
+        if relative.endswith(".gz"):
+            sizes["gzip_bytes"] += size
+            continue
+        if relative.endswith(".br"):
+            sizes["brotli_bytes"] += size
+            continue
+        sizes["files"] += 1
+        sizes["json_bytes"] += size
+        with open(path, "rb") as handle:
+            payload = handle.read()
+        if relative == build_stats.SUMMARY_NAME:
+            summary = json.loads(payload)
+            summary.pop("generated_at", None)
+            payload = json.dumps(summary, sort_keys=True).encode("utf-8")
+        digest.update(relative.encode("utf-8") + b"\0" + payload + b"\0")
+    sizes["digest"] = digest.hexdigest()
+    return sizes
+
+
+def run_build(db_path, mode, engine, repeat, out_dir):
+    build_stats.BUILD_MODE = mode
+    build_stats.AGGREGATE_ENGINE = engine
+    os.environ["STATS_CHECKPOINT_PATH"] = out_dir + ".checkpoint"
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build_stats.write_stats(db_path, None, out_dir)
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best["seconds"]:
+            best = {
+                "seconds": seconds,
+                "phases": dict(build_stats.phase_timings),
+                "rows": dict(build_stats.table_rows),
+                "counters": dict(build_stats.build_counters),
+            }
+    # Parallel builds do their per-user work in child processes.
+    best["peak_rss_mb"] = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) / 1024
+    best.update(output_stats(out_dir))
+    return best
+
+
+def bench_build(workdir, db_path, users, mode, engine, repeat):
+    out_dir = os.path.join(workdir, f"out_{users}_{mode}_{engine}")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    # A fresh interpreter per measurement keeps peak RSS comparable.
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        result = pool.apply(run_build, (db_path, mode, engine, repeat, out_dir))
+    result.update(users=users, runs=count_rows(db_path, "runs"), mode=mode, engine=engine)
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fetch(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+        response = conn.getresponse()
+        return response.status, len(response.read())
+    finally:
+        conn.close()
+
+
+def wait_for_server(port, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited before the first build finished")
+        try:
+            status, _ = fetch(port, "/data/summary.json")
+        except OSError:
+            status = None
+        if status == 200:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("server did not finish the first build in time")
+
+
+def start_server(workdir, db_path, users, server_mode):
+    out_dir = os.path.join(workdir, f"serve_{users}")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    port = free_port()
+    env = dict(
+        os.environ,
+        DB_PATH=db_path,
+        STATS_OUT_DIR=out_dir,
+        STATS_PORT=str(port),
+        STATS_SERVER=server_mode,
+        STATS_CHECKPOINT_PATH=out_dir + ".checkpoint",
+    )
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(port, process)
+    except Exception:
+        process.terminate()
+        process.wait()
+        raise
+    return process, port
+
+
+def pick_path(rnd, users, pages):
+    roll = rnd.random()
+    for kind, share in REQUEST_MIX:
+        roll -= share
+        if roll < 0:
+            break
+    if kind == "player":
+        return f"/data/players/{rnd.randint(1, users)}.json"
+    if kind == "page":
+        return f"/data/users/{rnd.randint(1, max(pages, 1))}.json"
+    if kind == "asset":
+        return rnd.choice(ASSETS)
+    return "/data/summary.json"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def load_test(port, users, server_mode, clients, requests, seed=1):
+    pages = (users + build_stats.USERS_PAGE_SIZE - 1) // build_stats.USERS_PAGE_SIZE
+    latencies = []
+    counters = {"errors": 0, "bytes": 0}
+    lock = threading.Lock()
+    per_client = max(requests // clients, 1)
+
+    def client(index):
+        rnd = random.Random(seed * 1000 + index)
+        local = []
+        errors = 0
+        received = 0
+        # One connection per client, reused for as long as the server keeps
+        # it open; http.client reconnects after a "Connection: close".
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        for _ in range(per_client):
+            path = pick_path(rnd, users, pages)
+            started = time.perf_counter()
+            try:
+                conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+                response = conn.getresponse()
+                status, size = response.status, len(response.read())
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status, size = None, 0
+            local.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            received += size
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            counters["errors"] += errors
+            counters["bytes"] += received
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "users": users,
+        "server": server_mode,
+        "clients": clients,
+        "requests": len(latencies),
+        "seconds": seconds,
+        "rps": len(latencies) / seconds if seconds else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        "errors": counters["errors"],
+        "bytes": counters["bytes"],
+    }
+
+
+def bench_server(workdir, db_path, users, server_mode, client_levels, requests):
+    process, port = start_server(workdir, db_path, users, server_mode)
+    try:
+        return [
+            load_test(port, users, server_mode, clients, requests)
+            for clients in client_levels
+        ]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=build_stats.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_build(result, previous):
+    per_run = result["seconds"] / max(result["runs"], 1) * 1e6
+    growth = ""
+    if previous:
+        growth = "{:.2f}x".format(
+            (result["seconds"] / previous["seconds"])
+            / (result["runs"] / max(previous["runs"], 1))
+        )
+    phases = " ".join(
+        f"{result['phases'].get(name, 0.0):>8.2f}" for name in PHASES
+    )
+    print(
+        f"{result['users']:>9} {result['runs']:>9} {result['mode']:>11} "
+        f"{result['engine']:>6} {result['seconds']:>8.2f} {phases} "
+        f"{per_run:>7.1f} {result['peak_rss_mb']:>7.0f} "
+        f"{result['json_bytes'] / 1e6:>8.1f} {growth:>7}"
+    )
+
+
+def print_server(result):
+    latency = result["latency_ms"]
+    print(
+        f"{result['users']:>9} {result['server']:>9} {result['clients']:>7} "
+        f"{result['requests']:>8} {result['rps']:>8.0f} {latency['p50']:>8.1f} "
+        f"{latency['p95']:>8.1f} {latency['p99']:>8.1f} {result['errors']:>6}"
+    )
+
+
+def split_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark build_stats and server.py on synthetic DBs"
+    )
+    parser.add_argument("--scales", default="1000,10000,100000")
+    parser.add_argument("--runs-per-user", type=int, default=50)
+    parser.add_argument(
+        "--modes",
+        default="full",
+        help="comma separated build modes: full, stream, incremental, parallel",
+    )
+    parser.add_argument(
+        "--engines",
+        default="sql",
+        help="comma separated aggregation engines to compare in full builds: sql, python",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--clients",
+        default="1,8,32",
+        help="comma separated concurrent client counts for the server load test",
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument(
+        "--servers",
+        default="threading,asyncio",
+        help="comma separated server modes to load test: threading, asyncio",
+    )
+    parser.add_argument("--skip-server", action="store_true")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument(
+        "--output", help="write machine-readable results to this JSON file"
+    )
+    args = parser.parse_args()
+    scales = split_list(args.scales, int)
+    modes = split_list(args.modes)
+    engines = split_list(args.engines)
+    client_levels = split_list(args.clients, int)
+    server_modes = split_list(args.servers)
+    # Only full builds read STATS_AGGREGATE_ENGINE: stream and parallel
+    # always aggregate in SQL and incremental folds its own totals.
+    if engines != ["sql"] and modes != ["full"]:
+        parser.error("--engines other than sql can only be combined with --modes full")
+
+    report = {
+        "revision": git_revision(),
+        "generated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "builds": [],
+        "server": [],
+    }
+
+    print(
+        f"{'users':>9} {'runs':>9} {'mode':>11} {'engine':>6} {'seconds':>8} "
+        + " ".join(f"{name[:8]:>8}" for name in PHASES)
+        + f" {'us/run':>7} {'rss MB':>7} {'out MB':>8} {'vs lin':>7}"
+    )
+    previous = {}
+    databases = {}
+    for users in scales:
+        db_path = databases[users] = ensure_db(
+            args.workdir, users, args.runs_per_user
+        )
+        digests = set()
+        for mode in modes:
+            for engine in engines:
+                result = bench_build(
+                    args.workdir, db_path, users, mode, engine, args.repeat
+                )
+                print_build(result, previous.get((mode, engine)))
+                previous[(mode, engine)] = result
+                digests.add(result["digest"])
+                report["builds"].append(result)
+        if len(digests) > 1:
+            print(f"{'':>9} builds produced different output at {users} users")
+
+    if not args.skip_server:
+        print(
+            f"\n{'users':>9} {'server':>9} {'clients':>7} {'requests':>8} "
+            f"{'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+        )
+        for users in scales:
+            for server_mode in server_modes:
+                for result in bench_server(
+                    args.workdir,
+                    databases[users],
+                    users,
+                    server_mode,
+                    client_levels,
+                    args.requests,
+                ):
+                    print_server(result)
+                    report["server"].append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+            handle.write("\n")
+
+
+if __name__ == "__main__":
+    main()
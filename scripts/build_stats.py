@@ -1,25 +1,123 @@
 #!/usr/bin/env python3
+import contextlib
+import glob
+import heapq
 import json
+import operator
 import os
+import shutil
 import sqlite3
+import sys
+import tempfile
+import time
+import urllib.parse
+import zlib
 from collections import Counter, defaultdict
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone, date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DEFAULT_DB_PATH = os.path.join(BASE_DIR, "ruins.db")
 DEFAULT_GAME_DATA_DIR = "/Users/mixkage/files/ruins_secret_of_death/data"
-OUT_DIR = os.path.join(BASE_DIR, "public", "data")
-OUT_PATH = os.path.join(OUT_DIR, "stats.json")
+OUT_DIR = os.environ.get("STATS_OUT_DIR", os.path.join(BASE_DIR, "public", "data"))
+SUMMARY_NAME = "summary.json"
+SEASONS_NAME = "seasons.json"
+DAYS_NAME = "days.json"
+PLAYERS_DIR = "players"
+USERS_DIR = "users"
+USERS_PAGE_SIZE = int(os.environ.get("STATS_USERS_PAGE_SIZE", "500"))
+OUTPUT_FORMAT = os.environ.get("STATS_OUTPUT_FORMAT", "compact")
+PRECOMPRESS = os.environ.get("STATS_PRECOMPRESS", "gzip,br")
+COMPRESS_MIN_SIZE = 256
+COMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+KEEP_GENERATIONS = 2
+BUILD_MODE = os.environ.get("STATS_BUILD_MODE", "full")
+AGGREGATE_ENGINE = os.environ.get("STATS_AGGREGATE_ENGINE", "sql")
+PROFILE_PATH = os.environ.get("STATS_PROFILE", "")
+ROLLUP_PATH = os.environ.get(
+    "STATS_ROLLUP_PATH", os.path.join(BASE_DIR, ".cache", "rollups.db")
+)
+SNAPSHOT_DIR = os.environ.get(
+    "STATS_SNAPSHOT_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else ""
+)
+MMAP_SIZE = int(os.environ.get("STATS_MMAP_SIZE", "0"))
+CACHE_SIZE_KB = os.environ.get("STATS_CACHE_SIZE_KB")
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = EPOCH.replace(tzinfo=timezone.utc)
+SECOND = timedelta(seconds=1)
+
+RUN_COLUMNS = "id, user_id, started_at, ended_at, max_floor, is_active, is_tutorial"
+
+ENEMY_FIELDS = ("name", "hp", "max_hp", "attack", "armor", "danger")
+PLAYER_FIELDS = (
+    "hp", "hp_max", "ap", "ap_max", "armor", "accuracy", "evasion", "power", "luck"
+)
+
+
+def json_fields(source, prefix, fields):
+    return ", ".join(f"'{name}', {source} -> '{prefix}.{name}'" for name in fields)
+
+
+# Active runs are projected in SQLite: only the fields shown on the dashboard
+# leave the database, as one small JSON object per run, and the full game
+# state is never decoded in Python. A state that is not a JSON object is
+# treated as empty, like parse_json does for broken text.
+ACTIVE_RUNS = f"""
+select
+    id,
+    user_id,
+    started_at,
+    username,
+    json_object(
+        'floor', state -> '$.floor',
+        'phase', state -> '$.phase',
+        'tutorial', state -> '$.tutorial',
+        'player', json_object(
+            {json_fields("state", "$.player", PLAYER_FIELDS)},
+            'weapon', state -> '$.player.weapon.name',
+            'potions', coalesce(json_array_length(state, '$.player.potions'), 0),
+            'scrolls', coalesce(json_array_length(state, '$.player.scrolls'), 0)
+        ),
+        'enemies', (
+            select json_group_array(json_object({json_fields("value", "$", ENEMY_FIELDS)}))
+            from json_each(state, '$.enemies')
+            where type = 'object' and json_type(state, '$.enemies') = 'array'
+        )
+    ) as projection
+from (
+    select
+        id,
+        user_id,
+        started_at,
+        (select username from users where users.id = runs.user_id) as username,
+        case
+            when not json_valid(state_json) then json_object()
+            when json_type(state_json) = 'object' then state_json
+            else json_object()
+        end as state
+    from runs
+    where is_active {{where}}
+)
+order by id
+"""
 
 
 def parse_json(text, default):
     if not text:
         return default
     try:
-        return json.loads(text)
+        value = json.loads(text)
     except json.JSONDecodeError:
+        build_counters["json_errors"] += 1
         return default
+    build_counters["json_parsed"] += 1
+    return value
 
 
 def load_json_file(path):
@@ -46,6 +144,9 @@ def safe_round(value, digits=2):
 
 
 def add_counter_from_json(counter, payload):
+    # Only JSON objects are counters, as in the SQL engine's json_each.
+    if not isinstance(payload, dict):
+        return
     for key, value in payload.items():
         try:
             counter[str(key)] += int(value)
@@ -53,28 +154,134 @@ def add_counter_from_json(counter, payload):
             continue
 
 
+def unlocked_hero_keys(unlocked):
+    # Heroes are scalars; objects and arrays in the list are skipped, the
+    # same as the SQL engine does.
+    if not isinstance(unlocked, list):
+        return []
+    return [str(hero) for hero in unlocked if not isinstance(hero, (dict, list))]
+
+
+class DisplayNames(dict):
+    """Memo of name_map.get(key, key): each distinct key is resolved once."""
+
+    def __init__(self, name_map):
+        super().__init__()
+        self.name_map = name_map
+
+    def __missing__(self, key):
+        text = key if type(key) is str else str(key)
+        name = self[key] = self.name_map.get(text, text)
+        return name
+
+
+class NameMap(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.display = DisplayNames(self)
+
+    def name(self, key):
+        return self.display[key if type(key) is str else str(key)]
+
+
 def remap_counter(counter, name_map):
     remapped = Counter()
     for key, value in counter.items():
-        remapped[name_map.get(str(key), str(key))] += value
+        remapped[name_map.name(key)] += value
     return remapped
 
 
 def remap_dict_keys(payload, name_map):
-    remapped = {}
-    for key, value in payload.items():
-        remapped[name_map.get(str(key), str(key))] = value
-    return remapped
+    # JSON object keys are always strings, so the memo can be indexed directly.
+    display = name_map.display
+    return {display[key]: value for key, value in payload.items()}
 
 
-def main():
+
+phase_timings = {}
+# Rows handed to Python per table, and parse/write counters, for the last build.
+table_rows = Counter()
+build_counters = Counter()
+
+
+@contextlib.contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_timings[name] = (
+            phase_timings.get(name, 0.0) + time.perf_counter() - started
+        )
+
+
+def read_table(cur, table, columns="*"):
+    rows = cur.execute(f"select {columns} from {table}").fetchall()
+    table_rows[table] += len(rows)
+    return rows
+
+
+def counted(table, rows):
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        table_rows[table] += count
+
+
+def build_report():
+    lines = [f"{name}: {seconds:.3f}s" for name, seconds in phase_timings.items()]
+    lines.extend(f"rows {table}: {count}" for table, count in sorted(table_rows.items()))
+    lines.extend(f"{name}: {value}" for name, value in sorted(build_counters.items()))
+    return lines
+
+
+def db_paths(db_path):
+    """DB_PATH as a list of databases: comma-separated paths or globs."""
+    paths = []
+    for entry in db_path.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        matches = sorted(glob.glob(entry)) if glob.has_magic(entry) else [entry]
+        paths.extend(match for match in matches if match not in paths)
+    return paths or [db_path]
+
+
+def shard_names(paths):
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    if len(set(names)) < len(names):
+        names = [f"{name}{number}" for number, name in enumerate(names, 1)]
+    return names
+
+
+def shard_key(shard, value):
+    # Ids from several databases collide, so with shards they are prefixed
+    # with the shard name; a single database keeps its plain ids.
+    return value if shard is None else f"{shard}:{value}"
+
+
+def resolve_paths():
     db_path = os.environ.get("DB_PATH", DEFAULT_DB_PATH)
     data_dir = os.environ.get("GAME_DATA_DIR", DEFAULT_GAME_DATA_DIR)
     if not os.path.isdir(data_dir):
         data_dir = None
+    return db_path, data_dir
+
 
-    enemy_name_map = {}
-    hero_name_map = {
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_name_maps(data_dir):
+    enemy_name_map = NameMap()
+    hero_name_map = NameMap({
         "wanderer": "Рыцарь",
         "rune_guard": "Страж рун",
         "berserk": "Берсерк",
@@ -82,7 +289,7 @@ def main():
         "hunter": "Охотник",
         "executioner": "Палач",
         "duelist": "Дуэлянт",
-    }
+    })
 
     if data_dir:
         enemies_data = load_json_file(os.path.join(data_dir, "enemies.json")) or []
@@ -99,153 +306,371 @@ def main():
             if hero_id and hero_name:
                 hero_name_map[str(hero_id)] = hero_name
 
-    conn = sqlite3.connect(db_path)
+    return enemy_name_map, hero_name_map
+
+
+_name_maps = {}
+
+
+def load_name_maps(data_dir):
+    stamp = tuple(
+        file_stamp(os.path.join(data_dir, name)) if data_dir else None
+        for name in ("enemies.json", "heroes.json")
+    )
+    cached = _name_maps.get(data_dir)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    maps = read_name_maps(data_dir)
+    _name_maps.clear()
+    _name_maps[data_dir] = (stamp, maps)
+    return maps
+
+
+def cache_size_kb():
+    # Stream mode is meant for small containers, so it keeps SQLite's own
+    # default of about 2 MB of page cache per connection.
+    if CACHE_SIZE_KB:
+        return int(CACHE_SIZE_KB)
+    return 2000 if BUILD_MODE == "stream" else 65536
+
+
+def connect(db_path, **options):
+    conn = sqlite3.connect(db_path, **options)
     conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{cache_size_kb()}")
+    # Sorts behind GROUP BY and ORDER BY spill to temporary files; in memory
+    # they hold every runs row at once.
+    temp_store = "FILE" if BUILD_MODE == "stream" else "MEMORY"
+    conn.execute(f"PRAGMA temp_store = {temp_store}")
     conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    return conn
 
-    users = cur.execute("select * from users").fetchall()
-    runs = cur.execute("select * from runs").fetchall()
-    user_stats = cur.execute("select * from user_stats").fetchall()
-    user_badges = cur.execute("select * from user_badges").fetchall()
-    user_broadcasts = cur.execute("select * from user_broadcasts").fetchall()
-    seasons = cur.execute("select * from seasons").fetchall()
-    user_season_stats = cur.execute("select * from user_season_stats").fetchall()
-    season_history = cur.execute("select * from season_history").fetchall()
-    star_purchases = cur.execute("select * from star_purchases").fetchall()
-    star_actions = cur.execute("select * from star_actions").fetchall()
-
-    total_users = len(users)
-    total_runs = len(runs)
-    active_runs = sum(1 for r in runs if r["is_active"])
-    total_xp = sum(int(u["xp"] or 0) for u in users)
-    total_max_floor = sum(int(u["max_floor"] or 0) for u in users) or 0
-    avg_max_floor = round(total_max_floor / total_users, 2) if total_users else 0
-    tutorial_done = sum(1 for u in users if u["tutorial_done"])
-
-    deaths_by_floor = Counter()
-    kills_by_type = Counter()
-    hero_runs = Counter()
-    unlocked_heroes = Counter()
-    total_deaths = 0
-    total_treasures = 0
-    total_chests = 0
-
-    for row in user_stats:
-        total_deaths += int(row["deaths"] or 0)
-        total_treasures += int(row["treasures_found"] or 0)
-        total_chests += int(row["chests_opened"] or 0)
-        add_counter_from_json(
-            deaths_by_floor, parse_json(row["deaths_by_floor"], {})
-        )
-        add_counter_from_json(
-            kills_by_type, parse_json(row["kills_json"], {})
-        )
-        add_counter_from_json(
-            hero_runs, parse_json(row["hero_runs_json"], {})
-        )
 
-    for row in users:
-        unlocked = parse_json(row["unlocked_heroes_json"], [])
-        if isinstance(unlocked, list):
-            for hero in unlocked:
-                unlocked_heroes[str(hero)] += 1
-
-    kills_by_type = remap_counter(kills_by_type, enemy_name_map)
-    hero_runs = remap_counter(hero_runs, hero_name_map)
-    unlocked_heroes = remap_counter(unlocked_heroes, hero_name_map)
-
-    run_max_floor = Counter()
-    runs_per_day = Counter()
-    run_durations = []
-    today = date.today()
-    week_start = today - timedelta(days=6)
-    runs_today = 0
-    runs_last_7_days = 0
-    today_floor_sum = 0
-    week_floor_sum = 0
+def connect_build(db_path):
+    # A build reads every table inside one transaction, so it never sees a
+    # run without the user_stats update that came with it.
+    conn = connect(db_path)
+    conn.execute("begin")
+    return conn
 
-    for row in runs:
-        floor = row["max_floor"] or 0
-        run_max_floor[str(floor)] += 1
-        started = parse_dt(row["started_at"])
-        if started:
-            runs_per_day[started.date().isoformat()] += 1
-            if started.date() == today:
-                runs_today += 1
-                today_floor_sum += floor
-            if week_start <= started.date() <= today:
-                runs_last_7_days += 1
-                week_floor_sum += floor
-        ended = parse_dt(row["ended_at"])
-        if started and ended:
-            duration = (ended - started).total_seconds() / 60.0
-            if duration >= 0:
-                run_durations.append(duration)
 
-    avg_run_minutes = safe_round(
-        sum(run_durations) / len(run_durations), 2
-    ) if run_durations else 0
+def connect_readonly(db_path, **options):
+    # mode=ro fails instead of creating an empty database at a bad path.
+    return connect(
+        f"file:{urllib.parse.quote(db_path)}?mode=ro", uri=True, **options
+    )
 
-    purchase_count = len(star_purchases)
-    stars_bought = sum(int(p["stars"] or 0) for p in star_purchases)
-    levels_bought = sum(int(p["levels"] or 0) for p in star_purchases)
-    xp_from_purchases = sum(int(p["xp_added"] or 0) for p in star_purchases)
 
-    actions_by_type = Counter()
-    stars_spent = 0
-    for row in star_actions:
-        action = row["action"] or "unknown"
-        actions_by_type[action] += 1
-        stars_spent += int(row["stars"] or 0)
+def display_name(user):
+    return user["username"] or f"user_{user['id']}"
+
+
+def parse_user_stats(row):
+    return {
+        "total_runs": int(row["total_runs"] or 0),
+        "deaths": int(row["deaths"] or 0),
+        "treasures_found": int(row["treasures_found"] or 0),
+        "chests_opened": int(row["chests_opened"] or 0),
+        "deaths_by_floor": parse_json(row["deaths_by_floor"], {}),
+        "kills": parse_json(row["kills_json"], {}),
+        "hero_runs": parse_json(row["hero_runs_json"], {}),
+    }
+
+
+def run_entry(row):
+    return {
+        "id": row["id"],
+        "started_at": row["started_at"],
+        "ended_at": row["ended_at"],
+        "max_floor": int(row["max_floor"] or 0),
+        "is_active": int(row["is_active"] or 0),
+        "is_tutorial": int(row["is_tutorial"] or 0),
+    }
+
+
+def sort_runs(entries):
+    entries.sort(key=lambda item: item["started_at"] or "", reverse=True)
+    return entries
+
+
+def epoch_seconds(values):
+    """Timestamps as integer seconds since 1970, None where parse_dt fails.
+
+    Naive timestamps are UTC, like everywhere else in the database. This
+    runs for every timestamp of every history, so it takes a whole column.
+    """
+    seconds = []
+    append = seconds.append
+    for value in values:
+        if not value:
+            append(None)
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            append(None)
+            continue
+        append((parsed - (EPOCH if parsed.tzinfo is None else EPOCH_UTC)) // SECOND)
+    return seconds
+
+
+def delta_column(values):
+    """(base, deltas): the first value becomes the base and every value is
+    stored as the difference from the previous one; None is kept as is."""
+    if values and None not in values:
+        return values[0], [0, *map(operator.sub, values[1:], values)]
+    base = previous = None
+    deltas = []
+    for value in values:
+        if value is None:
+            deltas.append(None)
+            continue
+        if previous is None:
+            base = previous = value
+        deltas.append(value - previous)
+        previous = value
+    return base, deltas
+
+
+def columnar(count, columns, deltas=(), dictionary=()):
+    """A history as one array per field instead of one object per entry.
+
+    Fields in deltas are delta-encoded with their base under "base"; fields
+    in dictionary are stored as indexes into "dictionary"[field].
+    """
+    document = {"count": count, "base": {}}
+    if dictionary:
+        document["dictionary"] = {}
+    for name, values in columns.items():
+        if name in deltas:
+            document["base"][name], values = delta_column(values)
+        elif name in dictionary:
+            names = list(dict.fromkeys(values))
+            codes = {value: code for code, value in enumerate(names)}
+            document["dictionary"][name] = names
+            values = [codes[value] for value in values]
+        document[name] = values
+    return document
+
+
+def run_columns(runs):
+    """Newest first; started_at in epoch seconds, duration in seconds since
+    the start (None while the run is open), flags bit 0 is_active and bit 1
+    is_tutorial."""
+    runs = sorted(runs, key=lambda row: row["started_at"] or "", reverse=True)
+    started = epoch_seconds([row["started_at"] for row in runs])
+    ended = epoch_seconds([row["ended_at"] for row in runs])
+    return columnar(
+        len(runs),
+        {
+            "id": [row["id"] for row in runs],
+            "started_at": started,
+            "duration": [
+                end - start if start is not None and end is not None else None
+                for start, end in zip(started, ended)
+            ],
+            "max_floor": [int(row["max_floor"] or 0) for row in runs],
+            "flags": [
+                (1 if row["is_active"] else 0) | (2 if row["is_tutorial"] else 0)
+                for row in runs
+            ],
+        },
+        deltas=("id", "started_at"),
+    )
+
+
+def purchase_columns(purchases):
+    return columnar(
+        len(purchases),
+        {
+            "created_at": epoch_seconds([row["created_at"] for row in purchases]),
+            "stars": [int(row["stars"] or 0) for row in purchases],
+            "levels": [int(row["levels"] or 0) for row in purchases],
+            "xp_added": [int(row["xp_added"] or 0) for row in purchases],
+        },
+        deltas=("created_at",),
+    )
+
+
+def action_columns(actions):
+    return columnar(
+        len(actions),
+        {
+            "created_at": epoch_seconds([row["created_at"] for row in actions]),
+            "action": [row["action"] for row in actions],
+            "stars": [int(row["stars"] or 0) for row in actions],
+        },
+        deltas=("created_at",),
+        dictionary=("action",),
+    )
+
+
+def purchase_entry(row):
+    return {
+        "created_at": row["created_at"],
+        "stars": int(row["stars"] or 0),
+        "levels": int(row["levels"] or 0),
+        "xp_added": int(row["xp_added"] or 0),
+    }
+
+
+def action_entry(row):
+    return {
+        "created_at": row["created_at"],
+        "action": row["action"],
+        "stars": int(row["stars"] or 0),
+    }
+
+
+def badge_entry(row):
+    return {
+        "badge_id": row["badge_id"],
+        "count": int(row["count"] or 0),
+        "last_awarded_season": row["last_awarded_season"],
+        "last_awarded_at": row["last_awarded_at"],
+    }
+
+
+def broadcast_entry(row):
+    return {
+        "broadcast_key": row["broadcast_key"],
+        "sent_at": row["sent_at"],
+    }
+
+
+def read_active_runs(conn, where="", params=()):
+    """Active run rows with their ACTIVE_RUNS projection, in id order."""
+    return counted("runs", conn.execute(ACTIVE_RUNS.format(where=where), params))
+
+
+def active_run_details(row):
+    run = parse_json(row["projection"], {})
+    return {
+        "run_id": row["id"],
+        "user_id": row["user_id"],
+        "username": row["username"],
+        "started_at": row["started_at"],
+        "floor": run["floor"],
+        "phase": run["phase"],
+        "tutorial": run["tutorial"],
+        "player": run["player"],
+        "enemies": run["enemies"],
+    }
+
 
+def user_active_run(details):
+    return {
+        "run_id": details["run_id"],
+        "started_at": details["started_at"],
+        "floor": details["floor"],
+        "phase": details["phase"],
+        "player": {
+            key: value
+            for key, value in details["player"].items()
+            if key not in ("potions", "scrolls")
+        },
+        "enemies": details["enemies"],
+    }
+
+
+def pick_current_season(seasons):
+    if not seasons:
+        return None
+    active_seasons = [s for s in seasons if not s["ended_at"]]
+    candidates = active_seasons or seasons
+    return max(
+        candidates,
+        key=lambda s: parse_dt(s["started_at"]) or datetime.min,
+    )
+
+
+def season_summary(row, season, hero_name_map):
+    return {
+        "season_key": season["season_key"],
+        "started_at": season["started_at"],
+        "ended_at": season["ended_at"],
+        "user_id": row["user_id"],
+        "max_floor": int(row["max_floor"] or 0),
+        "total_runs": int(row["total_runs"] or 0),
+        "deaths": int(row["deaths"] or 0),
+        "treasures_found": int(row["treasures_found"] or 0),
+        "chests_opened": int(row["chests_opened"] or 0),
+        "xp_gained": int(row["xp_gained"] or 0),
+        "max_floor_character": hero_name_map.get(
+            row["max_floor_character"], row["max_floor_character"]
+        ),
+    }
+
+
+def user_season_entry(row, season, hero_name_map):
+    return {
+        "season_key": season["season_key"],
+        "max_floor": int(row["max_floor"] or 0),
+        "total_runs": int(row["total_runs"] or 0),
+        "deaths": int(row["deaths"] or 0),
+        "treasures_found": int(row["treasures_found"] or 0),
+        "chests_opened": int(row["chests_opened"] or 0),
+        "xp_gained": int(row["xp_gained"] or 0),
+        "max_floor_character": hero_name_map.get(
+            row["max_floor_character"], row["max_floor_character"]
+        ),
+    }
+
+
+def season_overview(seasons, user_season_stats, hero_name_map):
     season_map = {s["id"]: s for s in seasons}
-    current_season = None
-    if seasons:
-        active_seasons = [s for s in seasons if not s["ended_at"]]
-        candidates = active_seasons or seasons
-        current_season = max(
-            candidates,
-            key=lambda s: parse_dt(s["started_at"]) or datetime.min,
-        )
+    current_season = pick_current_season(seasons)
     current_season_id = current_season["id"] if current_season else None
-    current_season_key = current_season["season_key"] if current_season else None
     current_stats_rows = [
         row
         for row in user_season_stats
         if row["season_id"] == current_season_id
     ] if current_season_id is not None else []
     total_users_season = len(current_stats_rows)
-    total_runs_season = sum(int(row["total_runs"] or 0) for row in current_stats_rows)
-    total_xp_season = sum(int(row["xp_gained"] or 0) for row in current_stats_rows)
-    avg_max_floor_season = safe_round(
-        sum(int(row["max_floor"] or 0) for row in current_stats_rows) / total_users_season,
-        2,
-    ) if total_users_season else 0
     season_summaries = []
     for row in user_season_stats:
-        season_id = row["season_id"]
-        season = season_map.get(season_id)
+        season = season_map.get(row["season_id"])
         if not season:
             continue
-        season_summaries.append(
-            {
-                "season_key": season["season_key"],
-                "started_at": season["started_at"],
-                "ended_at": season["ended_at"],
-                "user_id": row["user_id"],
-                "max_floor": int(row["max_floor"] or 0),
-                "total_runs": int(row["total_runs"] or 0),
-                "deaths": int(row["deaths"] or 0),
-                "treasures_found": int(row["treasures_found"] or 0),
-                "chests_opened": int(row["chests_opened"] or 0),
-                "xp_gained": int(row["xp_gained"] or 0),
-                "max_floor_character": hero_name_map.get(
-                    row["max_floor_character"], row["max_floor_character"]
-                ),
-            }
-        )
+        season_summaries.append(season_summary(row, season, hero_name_map))
+    return {
+        "season_map": season_map,
+        "current_season_id": current_season_id,
+        "current_season_key": current_season["season_key"] if current_season else None,
+        "total_users_season": total_users_season,
+        "total_runs_season": sum(
+            int(row["total_runs"] or 0) for row in current_stats_rows
+        ),
+        "total_xp_season": sum(
+            int(row["xp_gained"] or 0) for row in current_stats_rows
+        ),
+        "avg_max_floor_season": safe_round(
+            sum(int(row["max_floor"] or 0) for row in current_stats_rows)
+            / total_users_season,
+            2,
+        ) if total_users_season else 0,
+        "summaries": season_summaries,
+    }
+
 
+def group_user_seasons(user_season_stats, season_info, hero_name_map):
+    season_map = season_info["season_map"]
+    current_season_id = season_info["current_season_id"]
+    seasons_by_user = defaultdict(list)
+    current_members = set()
+    for row in user_season_stats:
+        if row["season_id"] == current_season_id:
+            current_members.add(row["user_id"])
+        season = season_map.get(row["season_id"])
+        if season:
+            seasons_by_user[row["user_id"]].append(
+                user_season_entry(row, season, hero_name_map)
+            )
+    return seasons_by_user, current_members
+
+
+def season_history_section(season_history):
     season_history_map = {}
     for row in season_history:
         season_history_map[row["season_key"]] = {
@@ -253,156 +678,193 @@ def main():
             "winners": parse_json(row["winners_json"], {}),
             "summary": parse_json(row["summary_json"], {}),
         }
+    return season_history_map
 
-    user_map = {u["id"]: u for u in users}
-    user_stats_map = {row["user_id"]: row for row in user_stats}
-    badge_map = defaultdict(list)
-    for row in user_badges:
-        badge_map[row["user_id"]].append(
-            {
-                "badge_id": row["badge_id"],
-                "count": int(row["count"] or 0),
-                "last_awarded_season": row["last_awarded_season"],
-                "last_awarded_at": row["last_awarded_at"],
-            }
-        )
-
-    broadcasts_map = defaultdict(list)
-    for row in user_broadcasts:
-        broadcasts_map[row["user_id"]].append(
-            {
-                "broadcast_key": row["broadcast_key"],
-                "sent_at": row["sent_at"],
-            }
-        )
-
-    runs_by_user = defaultdict(list)
-    for row in runs:
-        runs_by_user[row["user_id"]].append(
-            {
-                "id": row["id"],
-                "started_at": row["started_at"],
-                "ended_at": row["ended_at"],
-                "max_floor": int(row["max_floor"] or 0),
-                "is_active": int(row["is_active"] or 0),
-                "is_tutorial": int(row["is_tutorial"] or 0),
-            }
-        )
-    for user_id in runs_by_user:
-        runs_by_user[user_id].sort(
-            key=lambda item: item["started_at"] or "", reverse=True
-        )
-
-    purchases_by_user = defaultdict(list)
-    for row in star_purchases:
-        purchases_by_user[row["user_id"]].append(
-            {
-                "created_at": row["created_at"],
-                "stars": int(row["stars"] or 0),
-                "levels": int(row["levels"] or 0),
-                "xp_added": int(row["xp_added"] or 0),
-            }
-        )
-
-    actions_by_user = defaultdict(list)
-    for row in star_actions:
-        actions_by_user[row["user_id"]].append(
-            {
-                "created_at": row["created_at"],
-                "action": row["action"],
-                "stars": int(row["stars"] or 0),
-            }
-        )
-    active_runs_details = []
-    for row in runs:
-        if not row["is_active"]:
-            continue
-        state = parse_json(row["state_json"], {})
-        player = state.get("player", {}) if isinstance(state, dict) else {}
-        weapon = player.get("weapon", {}) if isinstance(player, dict) else {}
-        enemies = state.get("enemies", []) if isinstance(state, dict) else []
-        user = user_map.get(row["user_id"])
-        active_runs_details.append(
-            {
-                "run_id": row["id"],
-                "user_id": row["user_id"],
-                "username": user["username"] if user else None,
-                "started_at": row["started_at"],
-                "floor": state.get("floor"),
-                "phase": state.get("phase"),
-                "tutorial": state.get("tutorial"),
-                "player": {
-                    "hp": player.get("hp"),
-                    "hp_max": player.get("hp_max"),
-                    "ap": player.get("ap"),
-                    "ap_max": player.get("ap_max"),
-                    "armor": player.get("armor"),
-                    "accuracy": player.get("accuracy"),
-                    "evasion": player.get("evasion"),
-                    "power": player.get("power"),
-                    "luck": player.get("luck"),
-                    "weapon": weapon.get("name"),
-                    "potions": len(player.get("potions", []) or []),
-                    "scrolls": len(player.get("scrolls", []) or []),
-                },
-                "enemies": [
-                    {
-                        "name": enemy.get("name"),
-                        "hp": enemy.get("hp"),
-                        "max_hp": enemy.get("max_hp"),
-                        "attack": enemy.get("attack"),
-                        "armor": enemy.get("armor"),
-                        "danger": enemy.get("danger"),
-                    }
-                    for enemy in enemies
-                    if isinstance(enemy, dict)
-                ],
-            }
-        )
 
-    leaderboard = sorted(
-        [
+def leaderboard_section(users):
+    # A bounded heap: only the ten best entries are ever kept and ordered.
+    return heapq.nsmallest(
+        10,
+        (
             {
                 "id": u["id"],
-                "username": u["username"] or f"user_{u['id']}",
+                "username": display_name(u),
                 "max_floor": int(u["max_floor"] or 0),
                 "xp": int(u["xp"] or 0),
             }
             for u in users
-        ],
-        key=lambda item: (item["max_floor"], item["xp"]),
-        reverse=True,
-    )[:10]
+        ),
+        key=lambda item: (-item["max_floor"], -item["xp"]),
+    )
 
-    stats = {
-        "generated_at": datetime.utcnow().isoformat(timespec="minutes") + "Z",
-        "summary": {
-            "total_users_all": total_users,
-            "total_users_season": total_users_season,
-            "total_runs_season": total_runs_season,
-            "active_runs": active_runs,
-            "avg_max_floor_season": avg_max_floor_season,
-            "total_xp_season": total_xp_season,
-            "current_season_key": current_season_key,
-            "tutorial_completion_rate": round(
-                (tutorial_done / total_users) * 100, 2
-            ) if total_users else 0,
-            "total_deaths": total_deaths,
-            "total_kills": sum(kills_by_type.values()),
-            "total_treasures": total_treasures,
-            "total_chests": total_chests,
-            "avg_run_minutes": avg_run_minutes,
-            "runs_today": runs_today,
-            "runs_last_7_days": runs_last_7_days,
-            "avg_floor_today": safe_round(
-                (today_floor_sum / runs_today), 2
-            ) if runs_today else 0,
-            "avg_floor_last_7_days": safe_round(
-                (week_floor_sum / runs_last_7_days), 2
-            ) if runs_last_7_days else 0,
+
+def users_list_entry(user, in_current_season):
+    return {
+        "id": user["id"],
+        "username": display_name(user),
+        "max_floor": int(user["max_floor"] or 0),
+        "xp": int(user["xp"] or 0),
+        "created_at": user["created_at"],
+        "in_current_season": bool(in_current_season),
+    }
+
+
+def user_detail(
+    user,
+    unlocked,
+    stats,
+    runs,
+    seasons,
+    purchases,
+    actions,
+    badges,
+    broadcasts,
+    active_run,
+    enemy_name_map,
+    hero_name_map,
+):
+    deaths_by_floor_user = stats["deaths_by_floor"] if stats else {}
+    kills_by_type_user = stats["kills"] if stats else {}
+    hero_runs_user = stats["hero_runs"] if stats else {}
+    unlocked_mapped = (
+        [hero_name_map.name(hero) for hero in unlocked]
+        if isinstance(unlocked, list)
+        else []
+    )
+    return {
+        "id": user["id"],
+        "username": display_name(user),
+        "created_at": user["created_at"],
+        "max_floor": int(user["max_floor"] or 0),
+        "xp": int(user["xp"] or 0),
+        "tutorial_done": int(user["tutorial_done"] or 0),
+        "unlocked_heroes": unlocked_mapped,
+        "stats": {
+            "total_runs": stats["total_runs"] if stats else 0,
+            "deaths": stats["deaths"] if stats else 0,
+            "treasures_found": stats["treasures_found"] if stats else 0,
+            "chests_opened": stats["chests_opened"] if stats else 0,
+            "deaths_by_floor": deaths_by_floor_user,
+            "kills_by_type": remap_dict_keys(kills_by_type_user, enemy_name_map),
+            "hero_runs": remap_dict_keys(hero_runs_user, hero_name_map),
+            "total_kills": sum(
+                int(value or 0) for value in kills_by_type_user.values()
+            ),
         },
+        "runs": run_columns(runs),
+        "seasons": seasons,
+        "purchases": purchase_columns(purchases),
+        "actions": action_columns(actions),
+        "badges": badges,
+        "broadcasts": broadcasts,
+        "active_run": active_run,
+    }
+
+
+def new_totals():
+    return {
+        "total_users": 0,
+        "active_runs": 0,
+        "tutorial_done": 0,
+        "total_deaths": 0,
+        "total_treasures": 0,
+        "total_chests": 0,
+        "deaths_by_floor": Counter(),
+        "kills_by_type": Counter(),
+        "hero_runs": Counter(),
+        "unlocked_heroes": Counter(),
+        "run_max_floor": Counter(),
+        "runs_per_day": Counter(),
+        "floor_per_day": Counter(),
+        "ended_per_day": Counter(),
+        "duration_ms_per_day": Counter(),
+        "duration_sum": 0.0,
+        "duration_count": 0,
+        "purchase_count": 0,
+        "stars_bought": 0,
+        "levels_bought": 0,
+        "xp_from_purchases": 0,
+        "stars_spent": 0,
+        "actions_by_type": Counter(),
+    }
+
+
+def add_run_totals(totals, row):
+    floor = row["max_floor"] or 0
+    totals["run_max_floor"][str(floor)] += 1
+    started = parse_dt(row["started_at"])
+    if started:
+        day = started.date().isoformat()
+        totals["runs_per_day"][day] += 1
+        totals["floor_per_day"][day] += floor
+    ended = parse_dt(row["ended_at"])
+    if started and ended:
+        seconds = (ended - started).total_seconds()
+        if seconds >= 0:
+            totals["duration_sum"] += seconds / 60.0
+            totals["duration_count"] += 1
+            totals["ended_per_day"][day] += 1
+            totals["duration_ms_per_day"][day] += round(seconds * 1000)
+
+
+def window_totals(runs_per_day, floor_per_day, today):
+    today_key = today.isoformat()
+    week_keys = [
+        (today - timedelta(days=offset)).isoformat() for offset in range(7)
+    ]
+    runs_today = runs_per_day.get(today_key, 0)
+    runs_last_7_days = sum(runs_per_day.get(key, 0) for key in week_keys)
+    today_floor_sum = floor_per_day.get(today_key, 0)
+    week_floor_sum = sum(floor_per_day.get(key, 0) for key in week_keys)
+    return {
+        "runs_today": runs_today,
+        "runs_last_7_days": runs_last_7_days,
+        "avg_floor_today": safe_round(
+            (today_floor_sum / runs_today), 2
+        ) if runs_today else 0,
+        "avg_floor_last_7_days": safe_round(
+            (week_floor_sum / runs_last_7_days), 2
+        ) if runs_last_7_days else 0,
+    }
+
+
+def compose_header(totals, season_info, analytics, enemy_name_map, hero_name_map):
+    total_users = totals["total_users"]
+    kills_by_type = remap_counter(totals["kills_by_type"], enemy_name_map)
+    hero_runs = remap_counter(totals["hero_runs"], hero_name_map)
+    unlocked_heroes = remap_counter(totals["unlocked_heroes"], hero_name_map)
+    runs_per_day = totals["runs_per_day"]
+    run_max_floor = totals["run_max_floor"]
+    avg_run_minutes = safe_round(
+        totals["duration_sum"] / totals["duration_count"], 2
+    ) if totals["duration_count"] else 0
+
+    summary = {
+        "total_users_all": total_users,
+        "total_users_season": season_info["total_users_season"],
+        "total_runs_season": season_info["total_runs_season"],
+        "active_runs": totals["active_runs"],
+        "avg_max_floor_season": season_info["avg_max_floor_season"],
+        "total_xp_season": season_info["total_xp_season"],
+        "current_season_key": season_info["current_season_key"],
+        "tutorial_completion_rate": round(
+            (totals["tutorial_done"] / total_users) * 100, 2
+        ) if total_users else 0,
+        "total_deaths": totals["total_deaths"],
+        "total_kills": sum(kills_by_type.values()),
+        "total_treasures": totals["total_treasures"],
+        "total_chests": totals["total_chests"],
+        "avg_run_minutes": avg_run_minutes,
+    }
+    summary.update(
+        window_totals(runs_per_day, totals["floor_per_day"], date.today())
+    )
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(timespec="minutes") + "Z",
+        "summary": summary,
         "distributions": {
-            "deaths_by_floor": deaths_by_floor.most_common(),
+            "deaths_by_floor": totals["deaths_by_floor"].most_common(),
             "kills_by_type": kills_by_type.most_common(),
             "hero_runs": hero_runs.most_common(),
             "unlocked_heroes": unlocked_heroes.most_common(),
@@ -413,150 +875,503 @@ def main():
         },
         "timeseries": {
             "runs_per_day": [
-                {"date": date, "count": count}
-                for date, count in sorted(runs_per_day.items())
+                {"date": day, "count": count}
+                for day, count in sorted(runs_per_day.items())
             ],
         },
         "monetization": {
-            "purchase_count": purchase_count,
-            "stars_bought": stars_bought,
-            "levels_bought": levels_bought,
-            "xp_from_purchases": xp_from_purchases,
-            "stars_spent": stars_spent,
-            "actions_by_type": actions_by_type.most_common(),
+            "purchase_count": totals["purchase_count"],
+            "stars_bought": totals["stars_bought"],
+            "levels_bought": totals["levels_bought"],
+            "xp_from_purchases": totals["xp_from_purchases"],
+            "stars_spent": totals["stars_spent"],
+            "actions_by_type": totals["actions_by_type"].most_common(),
         },
-        "seasons": season_summaries,
-        "season_history": season_history_map,
-        "leaderboard": leaderboard,
-        "active_runs": active_runs_details,
-        "users_list": [
-            {
-                "id": u["id"],
-                "username": u["username"] or f"user_{u['id']}",
-                "max_floor": int(u["max_floor"] or 0),
-                "xp": int(u["xp"] or 0),
-                "created_at": u["created_at"],
-                "in_current_season": bool(
-                    any(
-                    row["user_id"] == u["id"]
-                    and row["season_id"] == current_season_id
-                    for row in user_season_stats
-                )
-            ),
-            }
-            for u in users
+        "analytics": analytics,
+    }
+
+
+def season_days(season):
+    """A season as inclusive ISO days, comparable with the day buckets.
+
+    The season ends at ended_at's day, which already belongs to the next one.
+    """
+    started = parse_dt(season["started_at"])
+    ended = parse_dt(season["ended_at"])
+    return {
+        "season_key": season["season_key"],
+        "first_day": started.date().isoformat() if started else None,
+        "last_day": (ended.date() - timedelta(days=1)).isoformat() if ended else None,
+    }
+
+
+def days_document(totals, season_map):
+    """Daily run buckets, column-wise, for arbitrary windows on the dashboard."""
+    days = sorted(totals["runs_per_day"])
+    return {
+        "today": date.today().isoformat(),
+        "days": days,
+        "runs": [totals["runs_per_day"][day] for day in days],
+        "floor_sum": [totals["floor_per_day"][day] for day in days],
+        "ended": [totals["ended_per_day"][day] for day in days],
+        "duration_ms": [totals["duration_ms_per_day"][day] for day in days],
+        "seasons": [
+            season_days(season)
+            for season in season_map.values()
         ],
-        "user_details": {},
     }
 
-    user_details = {}
-    for u in users:
-        stats_row = user_stats_map.get(u["id"])
-        deaths_by_floor_user = parse_json(
-            stats_row["deaths_by_floor"], {}
-        ) if stats_row else {}
-        kills_by_type_user = parse_json(
-            stats_row["kills_json"], {}
-        ) if stats_row else {}
-        hero_runs_user = parse_json(
-            stats_row["hero_runs_json"], {}
-        ) if stats_row else {}
-        unlocked = parse_json(u["unlocked_heroes_json"], [])
-        active_run_state = None
+
+def compose_stats(
+    totals,
+    season_info,
+    analytics,
+    season_history_map,
+    leaderboard,
+    season_leaderboard,
+    active_runs_details,
+    users_list,
+    user_details,
+    enemy_name_map,
+    hero_name_map,
+):
+    stats = compose_header(
+        totals, season_info, analytics, enemy_name_map, hero_name_map
+    )
+    stats.update(
+        {
+            "seasons": season_info["summaries"],
+            "days": days_document(totals, season_info["season_map"]),
+            "season_history": season_history_map,
+            "leaderboard": leaderboard,
+            "season_leaderboard": season_leaderboard,
+            "active_runs": active_runs_details,
+            "users_list": users_list,
+            "user_details": user_details,
+        }
+    )
+    return stats
+
+
+def python_totals(users, runs, parsed_stats, star_purchases, star_actions):
+    totals = new_totals()
+    totals["total_users"] = len(users)
+    totals["active_runs"] = sum(1 for r in runs if r["is_active"])
+    totals["tutorial_done"] = sum(1 for u in users if u["tutorial_done"])
+
+    for parsed in parsed_stats:
+        totals["total_deaths"] += parsed["deaths"]
+        totals["total_treasures"] += parsed["treasures_found"]
+        totals["total_chests"] += parsed["chests_opened"]
+        add_counter_from_json(totals["deaths_by_floor"], parsed["deaths_by_floor"])
+        add_counter_from_json(totals["kills_by_type"], parsed["kills"])
+        add_counter_from_json(totals["hero_runs"], parsed["hero_runs"])
+
+    for row in users:
+        unlocked = parse_json(row["unlocked_heroes_json"], [])
+        totals["unlocked_heroes"].update(unlocked_hero_keys(unlocked))
+
+    for row in runs:
+        add_run_totals(totals, row)
+
+    for row in star_purchases:
+        totals["purchase_count"] += 1
+        totals["stars_bought"] += int(row["stars"] or 0)
+        totals["levels_bought"] += int(row["levels"] or 0)
+        totals["xp_from_purchases"] += int(row["xp_added"] or 0)
+
+    for row in star_actions:
+        totals["actions_by_type"][row["action"] or "unknown"] += 1
+        totals["stars_spent"] += int(row["stars"] or 0)
+    return totals
+
+
+def build_full(db_path, data_dir):
+    import analytics
+    import ranks
+
+    enemy_name_map, hero_name_map = load_name_maps(data_dir)
+
+    conn = connect_build(db_path)
+    cur = conn.cursor()
+
+    if AGGREGATE_ENGINE == "sql":
+        import sql_aggregates
+
+        with phase("aggregate"):
+            totals = sql_aggregates.aggregate_totals(conn, db_path)
+    with phase("load"):
+        users = read_table(cur, "users")
+        runs = read_table(cur, "runs", RUN_COLUMNS)
+        active_runs_details = [
+            active_run_details(row) for row in read_active_runs(conn)
+        ]
+        user_stats = read_table(cur, "user_stats")
+        user_badges = read_table(cur, "user_badges")
+        user_broadcasts = read_table(cur, "user_broadcasts")
+        seasons = read_table(cur, "seasons")
+        user_season_stats = read_table(cur, "user_season_stats")
+        season_history = read_table(cur, "season_history")
+        star_purchases = read_table(cur, "star_purchases")
+        star_actions = read_table(cur, "star_actions")
+        analytics_columns = analytics.read_columns(conn, hero_name_map)
+        conn.close()
+
+    with phase("aggregate"):
+        user_stats_map = {}
+        for row in user_stats:
+            user_stats_map[row["user_id"]] = parse_user_stats(row)
+        if AGGREGATE_ENGINE != "sql":
+            totals = python_totals(
+                users, runs, user_stats_map.values(), star_purchases, star_actions
+            )
+        season_info = season_overview(seasons, user_season_stats, hero_name_map)
+        analytics_section = analytics.analyze(
+            analytics_columns, totals["deaths_by_floor"]
+        )
+        rank_index = ranks.build_index(
+            users, user_season_stats, season_info["season_map"], hero_name_map
+        )
+
+    with phase("details"):
+        runs_by_user = defaultdict(list)
         for row in runs:
-            if row["user_id"] == u["id"] and row["is_active"]:
-                state = parse_json(row["state_json"], {})
-                if isinstance(state, dict):
-                    player = state.get("player", {}) or {}
-                    weapon = player.get("weapon", {}) or {}
-                    enemies = state.get("enemies", []) or []
-                    active_run_state = {
-                        "run_id": row["id"],
-                        "started_at": row["started_at"],
-                        "floor": state.get("floor"),
-                        "phase": state.get("phase"),
-                        "player": {
-                            "hp": player.get("hp"),
-                            "hp_max": player.get("hp_max"),
-                            "ap": player.get("ap"),
-                            "ap_max": player.get("ap_max"),
-                            "armor": player.get("armor"),
-                            "accuracy": player.get("accuracy"),
-                            "evasion": player.get("evasion"),
-                            "power": player.get("power"),
-                            "luck": player.get("luck"),
-                            "weapon": weapon.get("name"),
-                        },
-                        "enemies": [
-                            {
-                                "name": enemy.get("name"),
-                                "hp": enemy.get("hp"),
-                                "max_hp": enemy.get("max_hp"),
-                                "attack": enemy.get("attack"),
-                                "armor": enemy.get("armor"),
-                                "danger": enemy.get("danger"),
-                            }
-                            for enemy in enemies
-                            if isinstance(enemy, dict)
-                        ],
-                    }
-                break
-
-        unlocked_mapped = (
-            [hero_name_map.get(str(hero), str(hero)) for hero in unlocked]
-            if isinstance(unlocked, list)
-            else []
+            runs_by_user[row["user_id"]].append(row)
+        active_by_user = {}
+        for details in active_runs_details:
+            if details["user_id"] not in active_by_user:
+                active_by_user[details["user_id"]] = user_active_run(details)
+        purchases_by_user = defaultdict(list)
+        for row in star_purchases:
+            purchases_by_user[row["user_id"]].append(row)
+
+        actions_by_user = defaultdict(list)
+        for row in star_actions:
+            actions_by_user[row["user_id"]].append(row)
+
+        seasons_by_user, current_members = group_user_seasons(
+            user_season_stats, season_info, hero_name_map
         )
-        user_details[str(u["id"])] = {
-            "id": u["id"],
-            "username": u["username"] or f"user_{u['id']}",
-            "created_at": u["created_at"],
-            "max_floor": int(u["max_floor"] or 0),
-            "xp": int(u["xp"] or 0),
-            "tutorial_done": int(u["tutorial_done"] or 0),
-            "unlocked_heroes": unlocked_mapped,
-            "stats": {
-                "total_runs": int(stats_row["total_runs"] or 0) if stats_row else 0,
-                "deaths": int(stats_row["deaths"] or 0) if stats_row else 0,
-                "treasures_found": int(stats_row["treasures_found"] or 0) if stats_row else 0,
-                "chests_opened": int(stats_row["chests_opened"] or 0) if stats_row else 0,
-                "deaths_by_floor": deaths_by_floor_user,
-                "kills_by_type": remap_dict_keys(kills_by_type_user, enemy_name_map),
-                "hero_runs": remap_dict_keys(hero_runs_user, hero_name_map),
-                "total_kills": sum(
-                    int(value or 0) for value in kills_by_type_user.values()
-                ),
-            },
-            "runs": runs_by_user.get(u["id"], []),
-            "seasons": [
-                {
-                    "season_key": season_map[row["season_id"]]["season_key"],
-                    "max_floor": int(row["max_floor"] or 0),
-                    "total_runs": int(row["total_runs"] or 0),
-                    "deaths": int(row["deaths"] or 0),
-                    "treasures_found": int(row["treasures_found"] or 0),
-                    "chests_opened": int(row["chests_opened"] or 0),
-                    "xp_gained": int(row["xp_gained"] or 0),
-                    "max_floor_character": hero_name_map.get(
-                        row["max_floor_character"], row["max_floor_character"]
-                    ),
-                }
-                for row in user_season_stats
-                if row["user_id"] == u["id"] and row["season_id"] in season_map
-            ],
-            "purchases": purchases_by_user.get(u["id"], []),
-            "actions": actions_by_user.get(u["id"], []),
-            "badges": badge_map.get(u["id"], []),
-            "broadcasts": broadcasts_map.get(u["id"], []),
-            "active_run": active_run_state,
-        }
 
-    stats["user_details"] = user_details
+        badge_map = defaultdict(list)
+        for row in user_badges:
+            badge_map[row["user_id"]].append(badge_entry(row))
+
+        broadcasts_map = defaultdict(list)
+        for row in user_broadcasts:
+            broadcasts_map[row["user_id"]].append(broadcast_entry(row))
+
+        users_list = []
+        user_details = {}
+        for u in users:
+            users_list.append(users_list_entry(u, u["id"] in current_members))
+            details = user_detail(
+                u,
+                parse_json(u["unlocked_heroes_json"], []),
+                user_stats_map.get(u["id"]),
+                runs_by_user.get(u["id"], []),
+                seasons_by_user.get(u["id"], []),
+                purchases_by_user.get(u["id"], []),
+                actions_by_user.get(u["id"], []),
+                badge_map.get(u["id"], []),
+                broadcasts_map.get(u["id"], []),
+                active_by_user.get(u["id"]),
+                enemy_name_map,
+                hero_name_map,
+            )
+            user_details[str(u["id"])] = ranks.annotate(details, rank_index)
+
+        return compose_stats(
+            totals,
+            season_info,
+            analytics_section,
+            season_history_section(season_history),
+            leaderboard_section(users),
+            ranks.season_leaderboard(
+                user_season_stats,
+                season_info["season_map"].get(season_info["current_season_id"]),
+                hero_name_map,
+                ranks.users_from(users),
+            ),
+            active_runs_details,
+            users_list,
+            user_details,
+            enemy_name_map,
+            hero_name_map,
+        )
+
+
+def build(db_path, data_dir):
+    if BUILD_MODE == "incremental":
+        import incremental
+
+        return incremental.build(db_path, data_dir)
+    return build_full(db_path, data_dir)
+
+
+def json_options():
+    if OUTPUT_FORMAT == "pretty":
+        return {"ensure_ascii": True, "indent": 2}
+    return {"ensure_ascii": False, "separators": (",", ":")}
+
+
+def encode_stats(stats):
+    return json.dumps(stats, **json_options()).encode("utf-8")
+
+
+def open_compressors():
+    enabled = [name for name in PRECOMPRESS.split(",") if name]
+    streams = []
+    if "br" in enabled and brotli is not None:
+        compressor = brotli.Compressor(quality=11)
+        streams.append((".br", compressor.process, compressor.finish))
+    if "gzip" in enabled:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        streams.append((".gz", compressor.compress, compressor.flush))
+    return streams
+
+
+def write_compressed(path, chunks):
+    streams = open_compressors()
+    handles = [open(path + suffix, "wb") for suffix, _, _ in streams]
+    try:
+        for chunk in chunks:
+            for handle, (_, compress, _) in zip(handles, streams):
+                build_counters["compressed_bytes_written"] += handle.write(
+                    compress(chunk)
+                )
+        for handle, (_, _, finish) in zip(handles, streams):
+            build_counters["compressed_bytes_written"] += handle.write(finish())
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def write_payload(path, payload):
+    with open(path, "wb") as handle:
+        handle.write(payload)
+    build_counters["files_written"] += 1
+    build_counters["bytes_written"] += len(payload)
+    if len(payload) >= COMPRESS_MIN_SIZE:
+        write_compressed(path, [payload])
+
+
+def compress_file(path, chunk_size=1 << 16):
+    # Streamed files are written piecewise, so they are accounted for here.
+    size = os.path.getsize(path)
+    build_counters["files_written"] += 1
+    build_counters["bytes_written"] += size
+    if size < COMPRESS_MIN_SIZE:
+        return
+    with open(path, "rb") as handle:
+        write_compressed(path, iter(lambda: handle.read(chunk_size), b""))
+
+
+def write_json(path, value):
+    write_payload(path, encode_stats(value))
+
+
+def rank_users(users_list):
+    return sorted(users_list, key=lambda item: (-item["max_floor"], -item["xp"]))
+
+
+def users_index(total, page_size=USERS_PAGE_SIZE):
+    return {
+        "total": total,
+        "page_size": page_size,
+        "pages": (total + page_size - 1) // page_size,
+    }
+
+
+def users_page(number, index, entries):
+    return {
+        "page": number,
+        "pages": index["pages"],
+        "total": index["total"],
+        "users": entries,
+    }
+
+
+def summary_document(stats, index):
+    summary = {
+        key: value
+        for key, value in stats.items()
+        if key not in ("seasons", "days", "users_list", "user_details")
+    }
+    summary["users_list"] = index
+    return summary
+
+
+def player_path(staging_dir, user_id):
+    return os.path.join(staging_dir, PLAYERS_DIR, f"{user_id}.json")
+
+
+def page_path(staging_dir, number):
+    return os.path.join(staging_dir, USERS_DIR, f"{number}.json")
+
+
+def start_layout(out_dir):
+    parent = os.path.dirname(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(
+        prefix=os.path.basename(out_dir) + ".tmp-", dir=parent
+    )
+    os.makedirs(os.path.join(staging_dir, PLAYERS_DIR))
+    os.makedirs(os.path.join(staging_dir, USERS_DIR))
+    return staging_dir
+
+
+def swap_link(source, target):
+    link = target + ".link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(source), link)
+    if os.path.isdir(target) and not os.path.islink(target):
+        # Layouts written before generations existed hold a real directory,
+        # which a symlink cannot replace in one rename.
+        shutil.rmtree(target + ".legacy", ignore_errors=True)
+        os.rename(target, target + ".legacy")
+    os.replace(link, target)
+
+
+def prune_generations(out_dir, name):
+    prefix = name + "."
+    generations = sorted(
+        entry
+        for entry in os.listdir(out_dir)
+        if entry.startswith(prefix) and entry[len(prefix):].isdigit()
+    )
+    # The previous generation stays for readers that resolved the old link
+    # just before the swap.
+    stale = generations[:-KEEP_GENERATIONS]
+    if len(generations) >= KEEP_GENERATIONS:
+        stale.append(prefix + "legacy")
+    for entry in stale:
+        shutil.rmtree(os.path.join(out_dir, entry), ignore_errors=True)
+
+
+def publish_layout(staging_dir, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    generation = str(time.time_ns())
+    for name in (PLAYERS_DIR, USERS_DIR):
+        target = os.path.join(out_dir, name)
+        versioned = f"{target}.{generation}"
+        os.rename(os.path.join(staging_dir, name), versioned)
+        swap_link(versioned, target)
+        prune_generations(out_dir, name)
+    for name in (SEASONS_NAME, DAYS_NAME, SUMMARY_NAME):
+        target = os.path.join(out_dir, name)
+        for suffix in COMPRESSED_SUFFIXES.values():
+            source = os.path.join(staging_dir, name + suffix)
+            if os.path.exists(source):
+                os.replace(source, target + suffix)
+            elif os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(os.path.join(staging_dir, name), target)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def write_layout(stats, out_dir=OUT_DIR):
+    staging_dir = start_layout(out_dir)
+    try:
+        ranked = rank_users(stats["users_list"])
+        index = users_index(len(ranked))
+        for number in range(1, index["pages"] + 1):
+            start = (number - 1) * index["page_size"]
+            write_json(
+                page_path(staging_dir, number),
+                users_page(number, index, ranked[start:start + index["page_size"]]),
+            )
+        for user_id, details in stats["user_details"].items():
+            write_json(player_path(staging_dir, user_id), details)
+        write_json(os.path.join(staging_dir, SEASONS_NAME), stats["seasons"])
+        write_json(os.path.join(staging_dir, DAYS_NAME), stats["days"])
+        write_json(
+            os.path.join(staging_dir, SUMMARY_NAME), summary_document(stats, index)
+        )
+        publish_layout(staging_dir, out_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def build_layout(db_path, data_dir, out_dir):
+    if BUILD_MODE == "stream":
+        import streaming
+
+        streaming.build(db_path, data_dir, out_dir)
+        return
+    if BUILD_MODE == "parallel":
+        import parallel
 
-    os.makedirs(OUT_DIR, exist_ok=True)
-    with open(OUT_PATH, "w", encoding="utf-8") as handle:
-        json.dump(stats, handle, ensure_ascii=True, indent=2)
+        parallel.build(db_path, data_dir, out_dir)
+        return
+    stats = build(db_path, data_dir)
+    with phase("serialize"):
+        write_layout(stats, out_dir)
+
+
+@contextlib.contextmanager
+def build_source(db_path):
+    """The path a build reads: a snapshot of db_path unless disabled."""
+    source = take_source(db_path)
+    try:
+        yield source
+    finally:
+        release_source(source, db_path)
+
+
+def take_source(db_path):
+    if not SNAPSHOT_DIR:
+        return db_path
+    import snapshot
+
+    with phase("snapshot"):
+        return snapshot.take(db_path, SNAPSHOT_DIR)
+
+
+def release_source(source, db_path):
+    if source != db_path:
+        import snapshot
+
+        snapshot.release(source, db_path)
+
+
+def write_build(db_path, data_dir, out_dir):
+    paths = db_paths(db_path)
+    if len(paths) > 1:
+        import shards
+
+        shards.build(paths, data_dir, out_dir)
+        return
+    with build_source(paths[0]) as source:
+        build_layout(source, data_dir, out_dir)
+
+
+def write_stats(db_path, data_dir, out_dir=OUT_DIR):
+    phase_timings.clear()
+    table_rows.clear()
+    build_counters.clear()
+    if not PROFILE_PATH:
+        write_build(db_path, data_dir, out_dir)
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(write_build, db_path, data_dir, out_dir)
+    finally:
+        profiler.dump_stats(PROFILE_PATH)
+
+
+def main():
+    db_path, data_dir = resolve_paths()
+    write_stats(db_path, data_dir)
+    for line in build_report():
+        print(line, file=sys.stderr)
 
 
 if __name__ == "__main__":
+    # streaming and incremental import build_stats by name; share this module
+    # with them so their phase timings and counters land in the same place.
+    sys.modules.setdefault("build_stats", sys.modules[__name__])
     main()
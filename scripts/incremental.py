@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+import copy
+import hashlib
+import os
+import pickle
+import time
+from collections import defaultdict
+
+import analytics
+import build_stats
+import ranks
+from build_stats import (
+    RUN_COLUMNS,
+    action_entry,
+    active_run_details,
+    add_run_totals,
+    badge_entry,
+    broadcast_entry,
+    parse_json,
+    parse_user_stats,
+    purchase_entry,
+    run_entry,
+    sort_runs,
+    unlocked_hero_keys,
+    user_active_run,
+)
+
+
+CHECKPOINT_VERSION = 4
+CHECKPOINT_PATH = os.environ.get(
+    "STATS_CHECKPOINT_PATH",
+    os.path.join(build_stats.BASE_DIR, ".cache", "stats_checkpoint.pickle"),
+)
+FULL_REBUILD_INTERVAL = float(os.environ.get("STATS_FULL_REBUILD_INTERVAL", "3600"))
+ID_CHUNK = 500
+
+USER_FIELDS = ("id", "username", "created_at", "max_floor", "xp", "tutorial_done")
+
+_loaded = {}
+
+
+def new_state(db_path):
+    return {
+        "version": CHECKPOINT_VERSION,
+        "db_path": db_path,
+        "full_built_at": time.time(),
+        "runs_hwm": 0,
+        "purchases_hwm": 0,
+        "actions_hwm": 0,
+        "open_runs": {},
+        "totals": build_stats.new_totals(),
+        "users": {},
+        "user_stats": {},
+        "user_digests": {},
+        "stats_digests": {},
+        "runs_by_user": {},
+        "purchases_by_user": defaultdict(list),
+        "actions_by_user": defaultdict(list),
+    }
+
+
+def load_checkpoint(path):
+    state = _loaded.get(path)
+    if state is not None:
+        return state
+    try:
+        with open(path, "rb") as handle:
+            return pickle.load(handle)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+
+def save_checkpoint(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as handle:
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    _loaded[path] = state
+
+
+def fetch_by_ids(conn, sql, key, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        rows = {row[key]: row for row in conn.execute(sql.format(marks=marks), chunk)}
+        for item in chunk:
+            if item in rows:
+                yield rows[item]
+
+
+def max_rowid(conn, table):
+    return conn.execute(f"select coalesce(max(rowid), 0) from {table}").fetchone()[0]
+
+
+def is_reusable(state, conn, db_path):
+    if not state or state.get("version") != CHECKPOINT_VERSION:
+        return False
+    if state["db_path"] != db_path:
+        return False
+    if time.time() - state["full_built_at"] > FULL_REBUILD_INTERVAL:
+        return False
+    return (
+        max_rowid(conn, "runs") >= state["runs_hwm"]
+        and max_rowid(conn, "star_purchases") >= state["purchases_hwm"]
+        and max_rowid(conn, "star_actions") >= state["actions_hwm"]
+    )
+
+
+def fold_counter(counter, payload, sign):
+    if not isinstance(payload, dict):
+        return
+    for key, value in payload.items():
+        try:
+            counter[str(key)] += sign * int(value)
+        except (TypeError, ValueError):
+            continue
+        if sign < 0 and not counter[str(key)]:
+            del counter[str(key)]
+
+
+def apply_user(totals, record, sign):
+    if record["row"]["tutorial_done"]:
+        totals["tutorial_done"] += sign
+    counter = totals["unlocked_heroes"]
+    for hero in unlocked_hero_keys(record["unlocked"]):
+        counter[hero] += sign
+        if not counter[hero]:
+            del counter[hero]
+
+
+def apply_user_stats(totals, parsed, sign):
+    totals["total_deaths"] += sign * parsed["deaths"]
+    totals["total_treasures"] += sign * parsed["treasures_found"]
+    totals["total_chests"] += sign * parsed["chests_opened"]
+    fold_counter(totals["deaths_by_floor"], parsed["deaths_by_floor"], sign)
+    fold_counter(totals["kills_by_type"], parsed["kills"], sign)
+    fold_counter(totals["hero_runs"], parsed["hero_runs"], sign)
+
+
+def drop_run(state, run_id, user_id):
+    entries = state["runs_by_user"].get(user_id, [])
+    entries[:] = [entry for entry in entries if entry["id"] != run_id]
+
+
+def store_run(state, row, active_rows, dirty):
+    run_id = row["id"]
+    user_id = row["user_id"]
+    state["runs_by_user"].setdefault(user_id, []).append(run_entry(row))
+    dirty.add(user_id)
+    if row["is_active"]:
+        state["open_runs"][run_id] = user_id
+        active_rows[run_id] = row
+    else:
+        state["open_runs"].pop(run_id, None)
+        add_run_totals(state["totals"], row)
+
+
+def fold_runs(conn, state, dirty):
+    active_rows = {}
+    open_runs = dict(state["open_runs"])
+    for run_id, user_id in open_runs.items():
+        drop_run(state, run_id, user_id)
+        state["open_runs"].pop(run_id)
+        dirty.add(user_id)
+    for row in build_stats.counted("runs", fetch_by_ids(
+        conn,
+        f"select {RUN_COLUMNS} from runs where id in ({{marks}})",
+        "id",
+        sorted(open_runs),
+    )):
+        store_run(state, row, active_rows, dirty)
+
+    for row in build_stats.counted("runs", conn.execute(
+        f"select {RUN_COLUMNS} from runs where id > ? order by id",
+        (state["runs_hwm"],),
+    )):
+        store_run(state, row, active_rows, dirty)
+        state["runs_hwm"] = row["id"]
+
+    for user_id in dirty:
+        entries = state["runs_by_user"].get(user_id)
+        if entries:
+            entries.sort(key=lambda entry: entry["id"])
+            sort_runs(entries)
+    return active_rows
+
+
+def fold_monetization(conn, state, dirty):
+    totals = state["totals"]
+    for row in build_stats.counted("star_purchases", conn.execute(
+        "select rowid as row_id, user_id, created_at, stars, levels, xp_added "
+        "from star_purchases where rowid > ? order by rowid",
+        (state["purchases_hwm"],),
+    )):
+        totals["purchase_count"] += 1
+        totals["stars_bought"] += int(row["stars"] or 0)
+        totals["levels_bought"] += int(row["levels"] or 0)
+        totals["xp_from_purchases"] += int(row["xp_added"] or 0)
+        state["purchases_by_user"][row["user_id"]].append(purchase_entry(row))
+        state["purchases_hwm"] = row["row_id"]
+        dirty.add(row["user_id"])
+
+    for row in build_stats.counted("star_actions", conn.execute(
+        "select rowid as row_id, user_id, created_at, action, stars "
+        "from star_actions where rowid > ? order by rowid",
+        (state["actions_hwm"],),
+    )):
+        totals["actions_by_type"][row["action"] or "unknown"] += 1
+        totals["stars_spent"] += int(row["stars"] or 0)
+        state["actions_by_user"][row["user_id"]].append(action_entry(row))
+        state["actions_hwm"] = row["row_id"]
+        dirty.add(row["user_id"])
+
+
+def row_digest(row):
+    return hashlib.blake2b(repr(tuple(row)).encode("utf-8"), digest_size=8).digest()
+
+
+def refresh_users(conn, state):
+    """Fold users and user_stats rows that changed since the last build.
+
+    Both tables are read whole every time, since a rename or a stats fix
+    needs no new run; only rows whose digest moved are parsed again.
+    """
+    totals = state["totals"]
+    users = state["users"]
+    digests = state["user_digests"]
+    user_ids = []
+    for row in build_stats.counted("users", conn.execute(
+        "select * from users order by rowid"
+    )):
+        user_id = row["id"]
+        user_ids.append(user_id)
+        digest = row_digest(row)
+        if digests.get(user_id) == digest:
+            continue
+        previous = users.get(user_id)
+        if previous is not None:
+            apply_user(totals, previous, -1)
+        record = {
+            "row": {field: row[field] for field in USER_FIELDS},
+            "unlocked": parse_json(row["unlocked_heroes_json"], []),
+        }
+        users[user_id] = record
+        digests[user_id] = digest
+        apply_user(totals, record, 1)
+    present = set(user_ids)
+    for user_id in [uid for uid in users if uid not in present]:
+        apply_user(totals, users.pop(user_id), -1)
+        digests.pop(user_id, None)
+    totals["total_users"] = len(user_ids)
+
+    stats = state["user_stats"]
+    digests = state["stats_digests"]
+    present = set()
+    for row in build_stats.counted("user_stats", conn.execute(
+        "select * from user_stats order by rowid"
+    )):
+        user_id = row["user_id"]
+        present.add(user_id)
+        digest = row_digest(row)
+        if digests.get(user_id) == digest:
+            continue
+        previous = stats.get(user_id)
+        if previous is not None:
+            apply_user_stats(totals, previous, -1)
+        parsed = parse_user_stats(row)
+        stats[user_id] = parsed
+        digests[user_id] = digest
+        apply_user_stats(totals, parsed, 1)
+    for user_id in [uid for uid in stats if uid not in present]:
+        apply_user_stats(totals, stats.pop(user_id), -1)
+        digests.pop(user_id, None)
+    return user_ids
+
+
+def assemble(conn, state, user_ids, active_rows, enemy_name_map, hero_name_map):
+    seasons = build_stats.read_table(conn, "seasons")
+    user_season_stats = build_stats.read_table(conn, "user_season_stats")
+    season_history = build_stats.read_table(conn, "season_history")
+    season_info = build_stats.season_overview(
+        seasons, user_season_stats, hero_name_map
+    )
+    seasons_by_user, current_members = build_stats.group_user_seasons(
+        user_season_stats, season_info, hero_name_map
+    )
+
+    badge_map = defaultdict(list)
+    for row in build_stats.counted("user_badges", conn.execute(
+        "select * from user_badges"
+    )):
+        badge_map[row["user_id"]].append(badge_entry(row))
+    broadcasts_map = defaultdict(list)
+    for row in build_stats.counted("user_broadcasts", conn.execute(
+        "select * from user_broadcasts"
+    )):
+        broadcasts_map[row["user_id"]].append(broadcast_entry(row))
+
+    totals = copy.deepcopy(state["totals"])
+    totals["active_runs"] = len(active_rows)
+    users = state["users"]
+    projected = {
+        row["id"]: active_run_details(row)
+        for row in build_stats.read_active_runs(conn)
+    }
+    active_runs_details = []
+    active_by_user = {}
+    for run_id in sorted(active_rows):
+        add_run_totals(totals, active_rows[run_id])
+        details = projected.get(run_id)
+        # A run that ended after fold_runs read it is left for the next build.
+        if details is None:
+            continue
+        active_runs_details.append(details)
+        if details["user_id"] not in active_by_user:
+            active_by_user[details["user_id"]] = user_active_run(details)
+
+    user_rows = [users[uid]["row"] for uid in user_ids]
+    season_map = season_info["season_map"]
+    rank_index = ranks.build_index(
+        user_rows, user_season_stats, season_map, hero_name_map
+    )
+    users_list = []
+    user_details = {}
+    for user in user_rows:
+        user_id = user["id"]
+        users_list.append(
+            build_stats.users_list_entry(user, user_id in current_members)
+        )
+        details = build_stats.user_detail(
+            user,
+            users[user_id]["unlocked"],
+            state["user_stats"].get(user_id),
+            state["runs_by_user"].get(user_id, []),
+            seasons_by_user.get(user_id, []),
+            state["purchases_by_user"].get(user_id, []),
+            state["actions_by_user"].get(user_id, []),
+            badge_map.get(user_id, []),
+            broadcasts_map.get(user_id, []),
+            active_by_user.get(user_id),
+            enemy_name_map,
+            hero_name_map,
+        )
+        user_details[str(user_id)] = ranks.annotate(details, rank_index)
+
+    return build_stats.compose_stats(
+        totals,
+        season_info,
+        analytics.read_analytics(conn, totals["deaths_by_floor"], hero_name_map),
+        build_stats.season_history_section(season_history),
+        build_stats.leaderboard_section(user_rows),
+        ranks.season_leaderboard(
+            user_season_stats,
+            season_map.get(season_info["current_season_id"]),
+            hero_name_map,
+            ranks.users_from(user_rows),
+        ),
+        active_runs_details,
+        users_list,
+        user_details,
+        enemy_name_map,
+        hero_name_map,
+    )
+
+
+def build(db_path, data_dir, checkpoint_path=CHECKPOINT_PATH):
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    conn = build_stats.connect_build(db_path)
+    try:
+        state = load_checkpoint(checkpoint_path)
+        if not is_reusable(state, conn, db_path):
+            state = new_state(db_path)
+        _loaded.pop(checkpoint_path, None)
+        dirty = set()
+        with build_stats.phase("load"):
+            active_rows = fold_runs(conn, state, dirty)
+            fold_monetization(conn, state, dirty)
+            user_ids = refresh_users(conn, state)
+        with build_stats.phase("details"):
+            stats = assemble(
+                conn, state, user_ids, active_rows, enemy_name_map, hero_name_map
+            )
+    finally:
+        conn.close()
+    with build_stats.phase("checkpoint"):
+        save_checkpoint(state, checkpoint_path)
+    return stats
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import build_stats
+from build_stats import active_run_details
+
+
+LIVE_INTERVAL = float(os.environ.get("STATS_LIVE_INTERVAL", "1"))
+LIVE_QUEUE_SIZE = 256
+KEEPALIVE_INTERVAL = 15
+RETRY_MS = 3000
+
+ID_CHUNK = 500
+
+# The game's schema has no index that finds active runs, so without this one
+# every poll reads the whole runs table; the feed warns when it is missing.
+ACTIVE_IDS = "select id from runs where is_active"
+ACTIVE_INDEX = "create index runs_active_ids on runs (id) where is_active"
+
+# runs has no last-update column, so a run's key is its small columns plus a
+# digest of state_json taken inside SQLite, without parsing the JSON. Going
+# through the ids keeps the full rows out of the search when an index on
+# is_active exists.
+ACTIVE_KEYS = f"""
+select
+    id,
+    user_id,
+    started_at,
+    (select username from users where users.id = runs.user_id) as username,
+    state_hash(cast(state_json as blob)) as digest
+from runs
+where id in ({ACTIVE_IDS})
+order by id
+"""
+ACTIVE_RUNS = build_stats.ACTIVE_RUNS.format(where="and id in ({marks})")
+
+
+def state_hash(data):
+    return hashlib.blake2b(data or b"", digest_size=8).digest()
+
+
+def scans_all_runs(conn):
+    # A plain index on is_active is still read end to end; only a partial
+    # index such as ACTIVE_INDEX is searched.
+    plan = conn.execute("explain query plan " + ACTIVE_IDS).fetchall()
+    return not any("USING INDEX" in row[-1] for row in plan)
+
+
+def project_runs(conn, ids):
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        yield from conn.execute(ACTIVE_RUNS.format(marks=marks), chunk)
+
+
+def diff_run(previous, current):
+    changes = {}
+    for key, value in current.items():
+        before = previous.get(key)
+        if value == before:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            changes[key] = {
+                name: item for name, item in value.items() if before.get(name) != item
+            }
+        else:
+            changes[key] = value
+    return changes
+
+
+def format_event(event, payload):
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+class ActiveRunFeed:
+    """Watches active runs and fans out per-run diffs to SSE subscribers.
+
+    A poll is skipped outright while PRAGMA data_version is unchanged.
+    Otherwise it reads only the active runs' keys, and the ACTIVE_RUNS
+    projection is run for the runs whose key moved since the last poll.
+    """
+
+    def __init__(self, interval=LIVE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._subscribers = set()
+        self._runs = {}
+        self._keys = {}
+        self._conns = {}
+        self._version = None
+        self._thread = None
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _connections(self, paths):
+        for stale in set(self._conns) - set(paths):
+            self._conns.pop(stale).close()
+        for path in paths:
+            if path not in self._conns:
+                conn = build_stats.connect_readonly(path, check_same_thread=False)
+                conn.create_function("state_hash", 1, state_hash, deterministic=True)
+                if scans_all_runs(conn):
+                    logging.warning(
+                        "live: %s has no index for active runs, every poll scans "
+                        "runs; %s",
+                        path,
+                        ACTIVE_INDEX,
+                    )
+                self._conns[path] = conn
+        return [self._conns[path] for path in paths]
+
+    def poll(self):
+        with self._poll_lock:
+            db_path, _ = build_stats.resolve_paths()
+            paths = build_stats.db_paths(db_path)
+            shards = build_stats.shard_names(paths) if len(paths) > 1 else [None]
+            try:
+                conns = self._connections(paths)
+                version = tuple(paths) + tuple(
+                    conn.execute("PRAGMA data_version").fetchone()[0]
+                    for conn in conns
+                )
+                if version == self._version:
+                    return
+                keys = {}
+                projected = {}
+                for shard, conn in zip(shards, conns):
+                    # Keys and projections come from one read transaction, so
+                    # a run cannot end between the two queries.
+                    with conn:
+                        conn.execute("begin")
+                        changed = []
+                        for row in conn.execute(ACTIVE_KEYS):
+                            run_id = build_stats.shard_key(shard, row["id"])
+                            keys[run_id] = tuple(row)
+                            if self._keys.get(run_id) != keys[run_id]:
+                                changed.append(row["id"])
+                        for row in project_runs(conn, changed):
+                            projected[build_stats.shard_key(shard, row["id"])] = (
+                                shard,
+                                row,
+                            )
+            except sqlite3.Error:
+                for conn in self._conns.values():
+                    conn.close()
+                self._conns.clear()
+                raise
+            self._version = version
+            self._apply(keys, projected)
+
+    def _apply(self, keys, projected):
+        runs = {}
+        started = []
+        updated = []
+        for run_id in keys:
+            previous = self._runs.get(run_id)
+            if run_id not in projected:
+                runs[run_id] = previous
+                continue
+            shard, row = projected[run_id]
+            details = active_run_details(row)
+            details["run_id"] = run_id
+            details["user_id"] = build_stats.shard_key(shard, details["user_id"])
+            runs[run_id] = details
+            if previous is None:
+                started.append(details)
+                continue
+            changes = diff_run(previous, details)
+            if changes:
+                updated.append({"run_id": run_id, "changes": changes})
+        ended = [run_id for run_id in self._runs if run_id not in runs]
+        with self._lock:
+            self._runs = runs
+            self._keys = keys
+            if started or updated or ended:
+                self._broadcast(
+                    format_event(
+                        "diff",
+                        {"started": started, "updated": updated, "ended": ended},
+                    )
+                )
+
+    def _broadcast(self, message):
+        for subscription in list(self._subscribers):
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                # A client that stopped reading is cut off; EventSource
+                # reconnects and starts again from a fresh snapshot.
+                self._subscribers.discard(subscription)
+                with subscription.mutex:
+                    subscription.queue.clear()
+                subscription.put_nowait(None)
+
+    def subscribe(self):
+        self.poll()
+        subscription = queue.Queue(LIVE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscription)
+            snapshot = list(self._runs.values())
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="live-runs", daemon=True
+                )
+                self._thread.start()
+        return subscription, snapshot
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.subscriber_count():
+                continue
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("live run poll failed")
+
+
+FEED = ActiveRunFeed()
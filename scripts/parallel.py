@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+
+import analytics
+import build_stats
+import ranks
+import sql_aggregates
+import streaming
+
+
+WORKERS = int(os.environ.get("STATS_WORKERS", "0")) or os.cpu_count() or 1
+# More shards than workers keeps the pool busy when some id ranges hold
+# far more history than others.
+SHARDS_PER_WORKER = 4
+
+# Set in each pool process by init_worker.
+_rank_index = None
+
+SHARD_RANGES = """
+select min(id), max(id)
+from (select id, ntile(?) over (order by id) as shard from users)
+group by shard
+order by shard
+"""
+
+
+def shard_ranges(conn, shards):
+    return [tuple(row) for row in conn.execute(SHARD_RANGES, (shards,))]
+
+
+def write_shard(db_path, data_dir, staging_dir, user_range, rank_index):
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    conn = build_stats.connect_build(db_path)
+    try:
+        season_map = {
+            row["id"]: row for row in build_stats.read_table(conn, "seasons")
+        }
+        streaming.write_user_details(
+            conn,
+            staging_dir,
+            season_map,
+            streaming.read_active_runs(
+                conn, "and user_id between ? and ?", user_range
+            ),
+            enemy_name_map,
+            hero_name_map,
+            rank_index,
+            user_range,
+        )
+    finally:
+        conn.close()
+
+
+def init_worker(rank_index):
+    # The index is sent once per process instead of once per shard.
+    global _rank_index
+    _rank_index = rank_index
+
+
+def run_shard(db_path, data_dir, staging_dir, user_range):
+    # Pool processes are reused across shards, so counters are reported per
+    # shard and summed by the parent.
+    build_stats.table_rows.clear()
+    build_stats.build_counters.clear()
+    write_shard(db_path, data_dir, staging_dir, user_range, _rank_index)
+    return build_stats.table_rows, build_stats.build_counters
+
+
+def write_shards(conn, db_path, data_dir, staging_dir, current_season_id, rank_index):
+    ranges = shard_ranges(conn, WORKERS * SHARDS_PER_WORKER)
+    if WORKERS <= 1 or len(ranges) <= 1:
+        index = streaming.write_users_pages(conn, staging_dir, current_season_id)
+        for user_range in ranges:
+            write_shard(db_path, data_dir, staging_dir, user_range, rank_index)
+        return index
+    # spawn rather than fork: the server builds from a background thread.
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(rank_index,),
+    ) as pool:
+        futures = [
+            pool.submit(run_shard, db_path, data_dir, staging_dir, user_range)
+            for user_range in ranges
+        ]
+        # The parent pages the users list while the workers write cards.
+        index = streaming.write_users_pages(conn, staging_dir, current_season_id)
+        for future in concurrent.futures.as_completed(futures):
+            rows, counters = future.result()
+            build_stats.table_rows.update(rows)
+            build_stats.build_counters.update(counters)
+    return index
+
+
+def build(db_path, data_dir, out_dir):
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    conn = build_stats.connect_build(db_path)
+    staging_dir = build_stats.start_layout(out_dir)
+    try:
+        with build_stats.phase("aggregate"):
+            totals = sql_aggregates.aggregate_totals(conn, db_path)
+            seasons = build_stats.read_table(conn, "seasons")
+            season_info = streaming.season_info_for(conn, seasons)
+            season_map = season_info["season_map"]
+            active_runs = streaming.read_active_runs(conn)
+            rank_index = ranks.read_index(conn, season_map, hero_name_map)
+
+        with build_stats.phase("analytics"):
+            analytics_section = analytics.read_analytics(
+                conn, totals["deaths_by_floor"], hero_name_map
+            )
+
+        with build_stats.phase("details"):
+            index = write_shards(
+                conn,
+                db_path,
+                data_dir,
+                staging_dir,
+                season_info["current_season_id"],
+                rank_index,
+            )
+
+        with build_stats.phase("serialize"):
+            streaming.write_seasons(
+                conn, staging_dir, season_info["season_map"], hero_name_map
+            )
+            streaming.write_days(staging_dir, totals, season_info["season_map"])
+            header = build_stats.compose_header(
+                totals, season_info, analytics_section, enemy_name_map, hero_name_map
+            )
+            season_leaderboard = ranks.read_season_leaderboard(
+                conn, season_map.get(season_info["current_season_id"]), hero_name_map
+            )
+            streaming.write_summary(
+                conn,
+                staging_dir,
+                header,
+                season_leaderboard,
+                list(active_runs.values()),
+                index,
+            )
+        build_stats.publish_layout(staging_dir, out_dir)
+    finally:
+        conn.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
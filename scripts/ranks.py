@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+import bisect
+import heapq
+import json
+import os
+import sqlite3
+import tempfile
+from array import array
+from collections import defaultdict
+
+import build_stats
+
+
+TOP_K = 10
+ALL_TIME = "all"
+# A score packs (max_floor, xp) into one int64 that sorts the same way.
+XP_BITS = 32
+XP_LIMIT = (1 << XP_BITS) - 1
+FLOOR_LIMIT = (1 << 31) - 1
+ID_CHUNK = 500
+
+USER_SCORES = "select max_floor, xp from users"
+SEASON_ROWS = """
+select user_id, season_id, max_floor, xp_gained, max_floor_character
+from user_season_stats
+order by rowid
+"""
+SEASON_ROWS_OF = """
+select user_id, season_id, max_floor, xp_gained, max_floor_character
+from user_season_stats
+where season_id = ?
+order by rowid
+"""
+SCORE_SQL = (
+    f"((max(min(cast(coalesce({{floor}}, 0) as integer), {FLOOR_LIMIT}), "
+    f"{-FLOOR_LIMIT - 1}) << {XP_BITS}) "
+    f"| max(min(cast(coalesce({{xp}}, 0) as integer), {XP_LIMIT}), 0))"
+)
+USERS_SCORE = SCORE_SQL.format(floor="max_floor", xp="xp")
+SEASON_SCORE = SCORE_SQL.format(floor="max_floor", xp="xp_gained")
+SEASON_WHERE = "season_id in (select id from seasons where season_key = :season_key)"
+HERO_WHERE = SEASON_WHERE + " and max_floor_character = :hero"
+COUNT = "select count(*) from {table} where {where}"
+# Boards a live card is ranked on, with the expression index that turns its
+# counts into range searches: (table, where, score, index statement).
+RANK_INDEXES = (
+    ("users", "true", USERS_SCORE, f"create index users_rank on users ({USERS_SCORE})"),
+    (
+        "user_season_stats",
+        SEASON_WHERE,
+        SEASON_SCORE,
+        "create index user_season_stats_rank on user_season_stats "
+        f"(season_id, {SEASON_SCORE})",
+    ),
+    (
+        "user_season_stats",
+        HERO_WHERE,
+        SEASON_SCORE,
+        "create index user_season_stats_hero_rank on user_season_stats "
+        f"(season_id, max_floor_character, {SEASON_SCORE})",
+    ),
+)
+
+
+def score(max_floor, xp):
+    floor = min(max(int(max_floor or 0), -FLOOR_LIMIT - 1), FLOOR_LIMIT)
+    return (floor << XP_BITS) | min(max(int(xp or 0), 0), XP_LIMIT)
+
+
+def season_board(season_key):
+    return ("season", season_key)
+
+
+def hero_board(season_key, hero):
+    return ("hero", season_key, hero)
+
+
+def position(total, ahead, behind):
+    if not total:
+        return None
+    return {
+        "rank": ahead + 1,
+        "total": total,
+        "percentile": build_stats.safe_round(100 * behind / total, 1),
+    }
+
+
+class RankIndex:
+    """Sorted scores per board: all time, each season and each season's heroes.
+
+    A player's rank is one plus the number of strictly higher scores and the
+    percentile is the share of strictly lower ones; both are two bisects, so
+    players with equal scores share a rank.
+    """
+
+    def __init__(self, boards=None):
+        self._boards = boards or defaultdict(list)
+
+    def add(self, board, max_floor, xp):
+        self._boards[board].append(score(max_floor, xp))
+
+    def extend(self, board, scores):
+        self._boards[board].extend(scores)
+
+    def freeze(self):
+        self._boards = {
+            board: array("q", sorted(scores))
+            for board, scores in self._boards.items()
+        }
+        return self
+
+    @classmethod
+    def merged(cls, indexes):
+        boards = defaultdict(list)
+        for index in indexes:
+            for board, scores in index._boards.items():
+                boards[board].append(scores)
+        return cls(
+            {
+                board: array("q", heapq.merge(*parts))
+                for board, parts in boards.items()
+            }
+        )
+
+    def position(self, board, max_floor, xp):
+        scores = self._boards.get(board)
+        if not scores:
+            return None
+        value = score(max_floor, xp)
+        return position(
+            len(scores),
+            len(scores) - bisect.bisect_right(scores, value),
+            bisect.bisect_left(scores, value),
+        )
+
+
+def board_key(board):
+    return json.dumps(board, ensure_ascii=False)
+
+
+class RankTable:
+    """RankIndex kept in a scratch SQLite file instead of in memory.
+
+    Stream builds use it so that memory does not grow with the number of
+    players: scores are written out, SQLite sorts them on disk and keeps for
+    every distinct score how many are lower, and a lookup is one indexed
+    query. close() removes the file.
+    """
+
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(prefix="ruins-ranks-", suffix=".db")
+        os.close(handle)
+        self._conn = sqlite3.connect(self.path)
+        # The file is private: holding its lock saves a lock round trip on
+        # every lookup.
+        self._conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute(f"PRAGMA cache_size = -{build_stats.cache_size_kb()}")
+        self._boards = {}
+
+    def fill(self, board_scores):
+        conn = self._conn
+        conn.execute("create table scores (board text, score integer)")
+        conn.executemany(
+            "insert into scores values (?, ?)",
+            ((board_key(board), value) for board, value in board_scores),
+        )
+        conn.execute(
+            """
+            create table positions (
+                board text, score integer, count integer, behind integer,
+                primary key (board, score)
+            ) without rowid
+            """
+        )
+        conn.execute(
+            """
+            insert into positions
+            select board, score, count(*), coalesce(sum(count(*)) over (
+                partition by board order by score
+                rows between unbounded preceding and 1 preceding
+            ), 0)
+            from scores
+            group by board, score
+            """
+        )
+        conn.execute("drop table scores")
+        conn.commit()
+        return self
+
+    def close(self):
+        self._conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _board(self, board):
+        found = self._boards.get(board)
+        if found is None:
+            key = board_key(board)
+            row = self._conn.execute(
+                "select behind + count from positions where board = ? "
+                "order by score desc limit 1",
+                (key,),
+            ).fetchone()
+            found = self._boards[board] = (key, row[0] if row else 0)
+        return found
+
+    def position(self, board, max_floor, xp):
+        key, total = self._board(board)
+        if not total:
+            return None
+        value = score(max_floor, xp)
+        row = self._conn.execute(
+            "select score, count, behind from positions "
+            "where board = ? and score >= ? order by score limit 1",
+            (key, value),
+        ).fetchone()
+        if row is None:
+            return position(total, 0, total)
+        found, count, behind = row
+        equal = count if found == value else 0
+        return position(total, total - behind - equal, behind)
+
+
+class TopK:
+    """The k best items pushed so far, kept in a bounded min-heap."""
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self._heap = []
+        self._pushed = 0
+
+    def push(self, key, item):
+        # The worst kept item sits on top; of two equal keys the later one
+        # counts as worse, which keeps the order of a stable sort.
+        entry = (key, -self._pushed, item)
+        self._pushed += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self):
+        return [
+            item
+            for _, _, item in sorted(
+                self._heap, key=lambda entry: entry[:2], reverse=True
+            )
+        ]
+
+
+def hero_name(row, hero_name_map):
+    return hero_name_map.get(row["max_floor_character"], row["max_floor_character"])
+
+
+def board_scores(users, season_rows, season_map, hero_name_map):
+    for user in users:
+        yield ALL_TIME, score(user["max_floor"], user["xp"])
+    for row in season_rows:
+        season = season_map.get(row["season_id"])
+        if season is None:
+            continue
+        value = score(row["max_floor"], row["xp_gained"])
+        yield season_board(season["season_key"]), value
+        hero = hero_name(row, hero_name_map)
+        if hero:
+            yield hero_board(season["season_key"], hero), value
+
+
+def build_index(users, season_rows, season_map, hero_name_map):
+    index = RankIndex()
+    index.extend(ALL_TIME, (score(user["max_floor"], user["xp"]) for user in users))
+    for row in season_rows:
+        season = season_map.get(row["season_id"])
+        if season is None:
+            continue
+        index.add(
+            season_board(season["season_key"]), row["max_floor"], row["xp_gained"]
+        )
+        hero = hero_name(row, hero_name_map)
+        if hero:
+            index.add(
+                hero_board(season["season_key"], hero),
+                row["max_floor"],
+                row["xp_gained"],
+            )
+    return index.freeze()
+
+
+def read_index(conn, season_map, hero_name_map):
+    return build_index(
+        build_stats.counted("users", conn.execute(USER_SCORES)),
+        build_stats.counted("user_season_stats", conn.execute(SEASON_ROWS)),
+        season_map,
+        hero_name_map,
+    )
+
+
+def read_table(conn, season_map, hero_name_map):
+    table = RankTable()
+    try:
+        return table.fill(
+            board_scores(
+                build_stats.counted("users", conn.execute(USER_SCORES)),
+                build_stats.counted("user_season_stats", conn.execute(SEASON_ROWS)),
+                season_map,
+                hero_name_map,
+            )
+        )
+    except BaseException:
+        table.close()
+        raise
+
+
+def annotate(details, index):
+    details["rank"] = index.position(ALL_TIME, details["max_floor"], details["xp"])
+    for entry in details["seasons"]:
+        entry["rank"] = index.position(
+            season_board(entry["season_key"]), entry["max_floor"], entry["xp_gained"]
+        )
+        entry["hero_rank"] = (
+            index.position(
+                hero_board(entry["season_key"], entry["max_floor_character"]),
+                entry["max_floor"],
+                entry["xp_gained"],
+            )
+            if entry["max_floor_character"]
+            else None
+        )
+    return details
+
+
+def season_leaderboard(season_rows, season, hero_name_map, fetch_users):
+    """Top TOP_K of one season overall and per hero, in one pass over its rows.
+
+    fetch_users(ids) returns {id: users row} and is only asked for winners.
+    """
+    if season is None:
+        return None
+    top = TopK()
+    heroes = defaultdict(TopK)
+    for row in season_rows:
+        if row["season_id"] != season["id"]:
+            continue
+        key = score(row["max_floor"], row["xp_gained"])
+        top.push(key, row)
+        hero = hero_name(row, hero_name_map)
+        if hero:
+            heroes[hero].push(key, row)
+    top = top.items()
+    heroes = {hero: heroes[hero].items() for hero in sorted(heroes)}
+    users = fetch_users(
+        {row["user_id"] for rows in [top, *heroes.values()] for row in rows}
+    )
+
+    def entry(row):
+        user = users.get(row["user_id"]) or {"id": row["user_id"], "username": None}
+        return {
+            "id": row["user_id"],
+            "username": build_stats.display_name(user),
+            "max_floor": int(row["max_floor"] or 0),
+            "xp_gained": int(row["xp_gained"] or 0),
+            "max_floor_character": hero_name(row, hero_name_map),
+        }
+
+    return {
+        "season_key": season["season_key"],
+        "top": [entry(row) for row in top],
+        "heroes": {hero: [entry(row) for row in rows] for hero, rows in heroes.items()},
+    }
+
+
+def read_season_leaderboard(conn, season, hero_name_map):
+    if season is None:
+        return None
+    rows = conn.execute(SEASON_ROWS_OF, (season["id"],))
+    return season_leaderboard(
+        build_stats.counted("user_season_stats", rows),
+        season,
+        hero_name_map,
+        users_from_db(conn),
+    )
+
+
+def users_from(users):
+    def fetch(ids):
+        return {user["id"]: user for user in users if user["id"] in ids}
+
+    return fetch
+
+
+def users_from_db(conn):
+    def fetch(ids):
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), ID_CHUNK):
+            chunk = ids[start:start + ID_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"select * from users where id in ({marks})", chunk
+            ):
+                found[row["id"]] = row
+        return found
+
+    return fetch
+
+
+def missing_rank_indexes(conn):
+    """Index statements for the boards whose rank counts would scan."""
+    missing = []
+    for table, where, score_sql, statement in RANK_INDEXES:
+        plan = conn.execute(
+            "explain query plan "
+            + COUNT.format(table=table, where=f"{where} and {score_sql} >= :score"),
+            {"season_key": "", "hero": "", "score": 0},
+        ).fetchall()
+        if any(row[-1].startswith(f"SCAN {table}") for row in plan):
+            missing.append(statement)
+    return missing
+
+
+def query_position(conn, table, where, score_sql, params, max_floor, xp):
+    """Rank on one board from the board total and the scores at or above.
+
+    With the board's RANK_INDEXES entry the second count is an index range
+    search and the total only reads that index.
+    """
+    params = dict(params, score=score(max_floor, xp))
+    total = conn.execute(COUNT.format(table=table, where=where), params).fetchone()[0]
+    if not total:
+        return None
+    at_or_above, equal = conn.execute(
+        f"select count(*), coalesce(sum({score_sql} = :score), 0) "
+        f"from {table} where {where} and {score_sql} >= :score",
+        params,
+    ).fetchone()
+    return position(total, at_or_above - equal, total - at_or_above)
+
+
+def query_annotate(conn, details, season_rows, season_map):
+    """Same fields as annotate, counted in SQL for a single live card.
+
+    season_rows are the raw user_season_stats rows behind details["seasons"],
+    in the same order.
+    """
+    details["rank"] = query_position(
+        conn, "users", "true", USERS_SCORE, {}, details["max_floor"], details["xp"]
+    )
+    for entry, row in zip(details["seasons"], season_rows):
+        params = {"season_key": season_map[row["season_id"]]["season_key"]}
+        entry["rank"] = query_position(
+            conn,
+            "user_season_stats",
+            SEASON_WHERE,
+            SEASON_SCORE,
+            params,
+            entry["max_floor"],
+            entry["xp_gained"],
+        )
+        entry["hero_rank"] = (
+            query_position(
+                conn,
+                "user_season_stats",
+                HERO_WHERE,
+                SEASON_SCORE,
+                dict(params, hero=row["max_floor_character"]),
+                entry["max_floor"],
+                entry["xp_gained"],
+            )
+            if entry["max_floor_character"]
+            else None
+        )
+    return details
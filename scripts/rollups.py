@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import time
+import urllib.parse
+
+import build_stats
+from sql_aggregates import RUN_BUCKETS
+
+
+ROLLUP_VERSION = 2
+FULL_REBUILD_INTERVAL = float(os.environ.get("STATS_FULL_REBUILD_INTERVAL", "3600"))
+ACTIVE = "(case when is_active then 1 else 0 end)"
+
+# floor has no declared type so values keep the exact type they had in runs;
+# day is '' for runs without a parseable start.
+SCHEMA = """
+create table if not exists meta (key text primary key, value);
+create table if not exists buckets (
+    day text not null,
+    floor not null,
+    runs integer not null,
+    ended integer not null,
+    duration_ms integer not null,
+    primary key (day, floor)
+);
+create table if not exists open_runs (id integer primary key);
+"""
+
+FOLD = """
+insert into buckets (day, floor, runs, ended, duration_ms)
+select coalesce(day, ''), floor, runs, ended, bucket_ms
+from ({buckets})
+where true
+on conflict (day, floor) do update set
+    runs = runs + excluded.runs,
+    ended = ended + excluded.ended,
+    duration_ms = duration_ms + excluded.duration_ms
+"""
+
+FROZEN = "select nullif(day, ''), floor, runs, 0, ended, duration_ms from buckets"
+
+
+def bucket_sql(where):
+    return RUN_BUCKETS.format(runs="game.runs", where="where " + where)
+
+
+def open_store(path, db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(
+        f"file:{urllib.parse.quote(path)}",
+        uri=True,
+        isolation_level=None,
+        timeout=30,
+    )
+    conn.executescript(SCHEMA)
+    conn.execute(
+        "attach database ? as game", (f"file:{urllib.parse.quote(db_path)}?mode=ro",)
+    )
+    return conn
+
+
+def is_reusable(meta, db_path, max_id):
+    # Deleted runs below the mark are only noticed by the periodic full
+    # rebuild; counting them would read the whole table on every build.
+    return (
+        meta.get("version") == ROLLUP_VERSION
+        and meta.get("db_path") == db_path
+        and time.time() - meta.get("built_at", 0) < FULL_REBUILD_INTERVAL
+        and max_id >= meta.get("hwm", 0)
+    )
+
+
+def fold(conn, db_path):
+    meta = dict(conn.execute("select key, value from meta"))
+    max_id = conn.execute("select coalesce(max(id), 0) from game.runs").fetchone()[0]
+    hwm = meta.get("hwm", 0)
+    if not is_reusable(meta, db_path, max_id):
+        conn.execute("delete from buckets")
+        conn.execute("delete from open_runs")
+        meta = {"built_at": time.time()}
+        hwm = 0
+
+    # Finished runs never change again, so only runs that were still active
+    # at the last fold and runs added since then are read.
+    conn.execute(
+        FOLD.format(
+            buckets=bucket_sql(
+                f"id in (select id from open_runs) and {ACTIVE} = 0 and id <= :max_id"
+            )
+        ),
+        {"max_id": max_id},
+    )
+    conn.execute(
+        FOLD.format(
+            buckets=bucket_sql(f"id > :hwm and id <= :max_id and {ACTIVE} = 0")
+        ),
+        {"hwm": hwm, "max_id": max_id},
+    )
+    conn.execute("delete from open_runs")
+    conn.execute(
+        f"insert into open_runs select id from game.runs "
+        f"where id <= ? and {ACTIVE} = 1",
+        (max_id,),
+    )
+    meta.update(version=ROLLUP_VERSION, db_path=db_path, hwm=max_id)
+    conn.execute("delete from meta")
+    conn.executemany(
+        "insert or replace into meta (key, value) values (?, ?)", meta.items()
+    )
+
+    rows = conn.execute(FROZEN).fetchall()
+    rows.extend(
+        conn.execute(
+            bucket_sql(f"id <= :max_id and {ACTIVE} = 1"), {"max_id": max_id}
+        )
+    )
+    return rows
+
+
+def run_buckets(db_path, path=None):
+    """Per (day, floor) run buckets, same shape as RUN_BUCKETS.
+
+    The whole fold runs in one transaction, so the frozen buckets, the open
+    run set and the active runs all come from a single snapshot of runs.
+    """
+    conn = open_store(path or build_stats.ROLLUP_PATH, db_path)
+    try:
+        conn.execute("begin immediate")
+        try:
+            rows = fold(conn, db_path)
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        conn.execute("commit")
+    finally:
+        conn.close()
+    return rows
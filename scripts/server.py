@@ -1,30 +1,886 @@
 #!/usr/bin/env python3
+import asyncio
+import concurrent.futures
+import email.utils
+import functools
+import hashlib
+import http
 import http.server
+import json
+import logging
+import mimetypes
 import os
-import subprocess
-import sys
+import posixpath
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import api
+import build_stats
+import live
+import metrics
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PUBLIC_DIR = os.path.join(BASE_DIR, "public")
-STATS_PATH = "/data/stats.json"
+DATA_PREFIX = "/data/"
+SUMMARY_PATH = DATA_PREFIX + build_stats.SUMMARY_NAME
+MIN_REBUILD_INTERVAL = float(os.environ.get("STATS_MIN_INTERVAL", "5"))
+POLL_INTERVAL = float(os.environ.get("STATS_POLL_INTERVAL", "2"))
+REBUILD_INTERVAL = float(os.environ.get("STATS_REBUILD_INTERVAL", "0"))
+ETAG_CACHE_SIZE = 4096
+PORT = int(os.environ.get("STATS_PORT", "8000"))
+SERVER_MODE = os.environ.get("STATS_SERVER", "threading")
+MAX_INFLIGHT = int(os.environ.get("STATS_MAX_INFLIGHT", "64"))
+KEEPALIVE_TIMEOUT = float(os.environ.get("STATS_KEEPALIVE_TIMEOUT", "15"))
+ASSET_CACHE_SIZE = 64
+ASSET_CACHE_MAX_BYTES = 256 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+LIVE_POLL_INTERVAL = 0.1
+METRICS_PATH = "/metrics"
+LIVE_PATH = "/events/active-runs"
+BUILD_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+METRICS = metrics.Registry()
+BUILD_SECONDS = METRICS.histogram(
+    "stats_build_duration_seconds",
+    "Wall time of successful stats builds.",
+    BUILD_BUCKETS,
+)
+BUILDS = METRICS.counter(
+    "stats_builds_total", "Stats build attempts by result.", ["result"]
+)
+LAST_BUILD = METRICS.gauge(
+    "stats_last_build_timestamp_seconds", "Unix time of the last successful build."
+)
+BUILD_PHASES = METRICS.gauge(
+    "stats_build_phase_seconds",
+    "Time spent in each phase of the last successful build.",
+    ["phase"],
+)
+BUILD_ROWS = METRICS.gauge(
+    "stats_build_rows",
+    "Rows read into Python per table by the last successful build.",
+    ["table"],
+)
+BUILD_ITEMS = METRICS.gauge(
+    "stats_build_items",
+    "JSON blobs parsed, parse failures and bytes written by the last successful build.",
+    ["item"],
+)
+REQUEST_SECONDS = METRICS.histogram(
+    "stats_http_request_duration_seconds",
+    "Time to answer GET requests.",
+    REQUEST_BUCKETS,
+    ["route"],
+)
+REQUESTS = METRICS.counter(
+    "stats_http_requests_total",
+    "GET responses by route and status; 304 means the client cache was still valid.",
+    ["route", "status"],
+)
+API_CACHE = METRICS.counter(
+    "stats_api_cache_lookups_total",
+    "Lookups in the API response TTL cache.",
+    ["result"],
+)
+LIVE_SUBSCRIBERS = METRICS.gauge(
+    "stats_live_subscribers", "Dashboards connected to the active-run feed."
+)
+ETAG_CACHE = METRICS.counter(
+    "stats_etag_cache_lookups_total",
+    "Lookups in the per-file ETag digest cache.",
+    ["result"],
+)
+
+
+def accepted_encodings(header):
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def pick_encoding(header, available):
+    accepted = accepted_encodings(header)
+    for name in build_stats.COMPRESSED_SUFFIXES:
+        if name in available and accepted.get(name, accepted.get("*", 0)) > 0:
+            return name
+    return None
+
+
+def content_digest(payload):
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def make_etag(digest, encoding):
+    if encoding is None:
+        return f'"{digest}"'
+    return f'"{digest}-{encoding}"'
+
+
+def load_document(path):
+    variants = {}
+    with open(path, "rb") as handle:
+        variants[None] = handle.read()
+    for name, suffix in build_stats.COMPRESSED_SUFFIXES.items():
+        try:
+            with open(path + suffix, "rb") as handle:
+                variants[name] = handle.read()
+        except OSError:
+            continue
+    return {
+        "variants": variants,
+        "digest": content_digest(variants[None]),
+        "modified": os.stat(path).st_mtime,
+    }
+
+
+def data_file_path(url_path):
+    relative = posixpath.normpath(
+        urllib.parse.unquote(url_path[len(DATA_PREFIX):])
+    )
+    if relative.startswith(("/", "..")):
+        return None
+    return os.path.join(build_stats.OUT_DIR, *relative.split("/"))
+
+
+@functools.lru_cache(maxsize=ETAG_CACHE_SIZE)
+def file_digest(path, mtime_ns, size):
+    with open(path, "rb") as handle:
+        return content_digest(handle.read())
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=ASSET_CACHE_SIZE)
+def static_asset(path, mtime_ns, size):
+    with open(path, "rb") as handle:
+        payload = handle.read()
+    return payload, content_digest(payload)
+
+
+def static_file_path(url_path):
+    relative = posixpath.normpath(urllib.parse.unquote(url_path))
+    parts = [part for part in relative.split("/") if part not in ("", ".", "..")]
+    path = os.path.join(PUBLIC_DIR, *parts)
+    if os.path.isdir(path):
+        path = os.path.join(path, "index.html")
+    return path
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, modified):
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+    if if_modified_since is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    if since is None or since.tzinfo is None:
+        return False
+    return int(modified) <= since.timestamp()
+
+
+def validators(etag, modified):
+    return [
+        ("ETag", etag),
+        ("Last-Modified", email.utils.formatdate(int(modified), usegmt=True)),
+        ("Cache-Control", "no-cache"),
+        ("Vary", "Accept-Encoding"),
+    ]
+
+
+def route_name(path):
+    if path == METRICS_PATH:
+        return "metrics"
+    if path == SUMMARY_PATH:
+        return "summary"
+    if path == LIVE_PATH:
+        return "live"
+    if path.startswith(api.API_PREFIX):
+        return "api"
+    if path.startswith(DATA_PREFIX):
+        return "data"
+    return "static"
+
+
+def record_build(seconds):
+    BUILDS.inc(result="ok")
+    BUILD_SECONDS.observe(seconds)
+    LAST_BUILD.set(time.time())
+    for gauge, values in (
+        (BUILD_PHASES, build_stats.phase_timings),
+        (BUILD_ROWS, build_stats.table_rows),
+        (BUILD_ITEMS, build_stats.build_counters),
+    ):
+        gauge.clear()
+        label = gauge.labels[0]
+        for name, value in values.items():
+            gauge.set(value, **{label: name})
+
+
+def render_metrics():
+    hits, misses = file_digest.cache_info()[:2]
+    ETAG_CACHE.set(hits, result="hit")
+    ETAG_CACHE.set(misses, result="miss")
+    API_CACHE.set(api.CACHE.hits, result="hit")
+    API_CACHE.set(api.CACHE.misses, result="miss")
+    LIVE_SUBSCRIBERS.set(live.FEED.subscriber_count())
+    return METRICS.render().encode("utf-8")
+
+
+class StatsCache:
+    def __init__(
+        self,
+        min_interval=MIN_REBUILD_INTERVAL,
+        poll_interval=POLL_INTERVAL,
+        rebuild_interval=REBUILD_INTERVAL,
+    ):
+        self.min_interval = min_interval
+        self.poll_interval = poll_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._payload = None
+        self._error = None
+        self._signature = None
+        self._attempted_at = None
+        self._thread = None
+        self._watch_conns = {}
+
+    def _data_version(self, db_path):
+        try:
+            conn = self._watch_conns.get(db_path)
+            if conn is None:
+                # mode=ro: a wrong or not yet mounted path must not be created.
+                conn = build_stats.connect_readonly(db_path)
+                self._watch_conns[db_path] = conn
+            return conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            self._watch_conns.pop(db_path, None)
+            return None
+
+    def _db_signature(self, db_path):
+        paths = build_stats.db_paths(db_path)
+        for stale in set(self._watch_conns) - set(paths):
+            self._watch_conns.pop(stale).close()
+        return tuple(
+            (
+                path,
+                file_signature(path),
+                file_signature(path + "-wal"),
+                self._data_version(path),
+            )
+            for path in paths
+        )
+
+    def _is_due(self, signature):
+        if self._attempted_at is None:
+            return True
+        elapsed = time.monotonic() - self._attempted_at
+        if elapsed < self.min_interval:
+            return False
+        if signature != self._signature:
+            return True
+        return 0 < self.rebuild_interval <= elapsed
+
+    def get(self):
+        with self._lock:
+            return self._payload
+
+    def load_existing(self):
+        try:
+            payload = load_document(
+                os.path.join(build_stats.OUT_DIR, build_stats.SUMMARY_NAME)
+            )
+        except OSError:
+            return
+        with self._lock:
+            if self._payload is None:
+                self._payload = payload
+
+    def rebuild(self, db_path, data_dir, signature):
+        self._attempted_at = time.monotonic()
+        started = time.perf_counter()
+        try:
+            build_stats.write_stats(db_path, data_dir)
+            payload = load_document(
+                os.path.join(build_stats.OUT_DIR, build_stats.SUMMARY_NAME)
+            )
+        except Exception as exc:
+            BUILDS.inc(result="error")
+            # The last good snapshot keeps being served; the signature is not
+            # recorded, so the next poll after min_interval retries.
+            if self._error is None:
+                logging.exception("stats build failed")
+            else:
+                logging.error("stats build failed again: %r", exc)
+            with self._lock:
+                self._error = exc
+            return False
+        self._signature = signature
+        with self._lock:
+            self._payload = payload
+            self._error = None
+        seconds = time.perf_counter() - started
+        record_build(seconds)
+        logging.info("stats rebuilt in %.2fs", seconds)
+        return True
+
+    def poll(self):
+        db_path, data_dir = build_stats.resolve_paths()
+        signature = self._db_signature(db_path)
+        if self._is_due(signature):
+            self.rebuild(db_path, data_dir, signature)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("stats scheduler failed")
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        self.load_existing()
+        self._thread = threading.Thread(
+            target=self._run, name="stats-builder", daemon=True
+        )
+        self._thread.start()
+
+
+STATS_CACHE = StatsCache()
 
 
 class StatsHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
-        if self.path.split("?")[0] == STATS_PATH:
-            subprocess.run(
-                [sys.executable, os.path.join(BASE_DIR, "scripts", "build_stats.py")],
-                check=True,
-                cwd=BASE_DIR,
-                env=os.environ.copy(),
-            )
+        started = time.perf_counter()
+        self._status = None
+        path, _, query = self.path.partition("?")
+        try:
+            self.route(path, query)
+        finally:
+            route = route_name(path)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+            REQUESTS.inc(route=route, status=self._status or 0)
+
+    def log_request(self, code="-", size="-"):
+        if isinstance(code, int):
+            self._status = int(code)
+        super().log_request(code, size)
+
+    def route(self, path, query):
+        if path == METRICS_PATH:
+            self.send_metrics()
+            return
+        if path == LIVE_PATH:
+            self.send_live()
+            return
+        if path.startswith(api.API_PREFIX):
+            self.send_api(path, query)
+            return
+        if path == SUMMARY_PATH:
+            summary = STATS_CACHE.get()
+            if summary is None:
+                self.send_unavailable()
+                return
+            self.send_variants(summary)
+            return
+        if path.startswith(DATA_PREFIX) and path.endswith(".json"):
+            self.send_data_file(data_file_path(path))
+            return
         super().do_GET()
 
+    def send_metrics(self):
+        payload = render_metrics()
+        self.send_response(200)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_api(self, path, query):
+        try:
+            document = api.respond(path, query)
+        except api.ApiError as exc:
+            self.send_api_error(exc.status, str(exc))
+            return
+        except sqlite3.Error as exc:
+            logging.error("api query failed: %r", exc)
+            self.send_api_error(503, "database unavailable")
+            return
+        self.send_variants(document)
+
+    def send_live(self):
+        try:
+            subscription, snapshot = live.FEED.subscribe()
+        except sqlite3.Error as exc:
+            logging.error("live feed unavailable: %r", exc)
+            self.send_api_error(503, "database unavailable")
+            return
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+            self.wfile.write(f"retry: {live.RETRY_MS}\n".encode("ascii"))
+            self.wfile.write(live.format_event("snapshot", {"active_runs": snapshot}))
+            self.wfile.flush()
+            while True:
+                try:
+                    message = subscription.get(timeout=live.KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    message = b": keep-alive\n\n"
+                if message is None:
+                    break
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            live.FEED.unsubscribe(subscription)
+            self.close_connection = True
+
+    def send_api_error(self, status, message):
+        payload = json.dumps({"error": message}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_unavailable(self):
+        self.send_response(503)
+        self.send_header("Retry-After", str(max(int(STATS_CACHE.poll_interval), 1)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_variants(self, document):
+        variants = document["variants"]
+        encoding = pick_encoding(self.headers.get("Accept-Encoding"), variants)
+        self.send_document(
+            document["digest"],
+            document["modified"],
+            encoding,
+            lambda: variants[encoding],
+        )
+
+    def send_data_file(self, fs_path):
+        if fs_path is None:
+            self.send_error(404, "File not found")
+            return
+        try:
+            stat = os.stat(fs_path)
+            digest = file_digest(fs_path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        available = [
+            name
+            for name, suffix in build_stats.COMPRESSED_SUFFIXES.items()
+            if os.path.isfile(fs_path + suffix)
+        ]
+        encoding = pick_encoding(self.headers.get("Accept-Encoding"), available)
+        if encoding is not None:
+            fs_path += build_stats.COMPRESSED_SUFFIXES[encoding]
+
+        def load():
+            with open(fs_path, "rb") as handle:
+                return handle.read()
+
+        self.send_document(digest, stat.st_mtime, encoding, load)
+
+    def send_document(self, digest, modified, encoding, load):
+        etag = make_etag(digest, encoding)
+        if self.is_not_modified(etag, modified):
+            self.send_response(304)
+            self.send_validators(etag, modified)
+            self.end_headers()
+            return
+        try:
+            payload = load()
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_validators(etag, modified)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_validators(self, etag, modified):
+        for name, value in validators(etag, modified):
+            self.send_header(name, value)
+
+    def is_not_modified(self, etag, modified):
+        return is_not_modified(
+            self.headers.get("If-None-Match"),
+            self.headers.get("If-Modified-Since"),
+            etag,
+            modified,
+        )
+
+
+def parse_request(head):
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(":")
+        if not separator:
+            return None
+        headers[name.strip().lower()] = value.strip()
+    path, _, query = parts[1].partition("?")
+    connection = headers.get("connection", "").lower()
+    if parts[2] == "HTTP/1.0":
+        keep_alive = connection == "keep-alive"
+    else:
+        keep_alive = connection != "close"
+    return {
+        "method": parts[0],
+        "path": path,
+        "query": query,
+        "headers": headers,
+        # A request body of unknown length cannot be skipped safely.
+        "keep_alive": keep_alive and "transfer-encoding" not in headers,
+    }
+
+
+def response_head(status, headers, keep_alive):
+    lines = [
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+        "Date: " + email.utils.formatdate(usegmt=True),
+    ]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def error_response(status, message):
+    return (
+        status,
+        [("Content-Type", "text/plain; charset=utf-8")],
+        f"{status} {message}\n".encode("utf-8"),
+    )
+
+
+def api_error_response(status, message):
+    return (
+        status,
+        [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Cache-Control", "no-store"),
+        ],
+        json.dumps({"error": message}).encode("utf-8"),
+    )
+
+
+class AsyncStatsServer:
+    """Serves the same routes as StatsHandler from one asyncio loop.
+
+    Connections are kept alive between requests, data files are sent with
+    sendfile straight from the page cache and small files from public/ are
+    answered from memory. At most max_inflight requests are handled at once;
+    database work runs on a thread pool of the same size.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT):
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_inflight, thread_name_prefix="stats-io"
+        )
+
+    async def serve(self, port):
+        server = await asyncio.start_server(
+            self.handle, "", port, limit=MAX_HEADER_BYTES
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT
+                    )
+                except asyncio.LimitOverrunError:
+                    await self.send(
+                        writer, None, *error_response(431, "Headers too large")
+                    )
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                request = parse_request(head)
+                if request is None:
+                    await self.send(writer, None, *error_response(400, "Bad request"))
+                    break
+                length = request["headers"].get("content-length", "0")
+                if length.isdigit() and int(length):
+                    await reader.readexactly(int(length))
+                keep_alive = await self.dispatch(request, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request, reader, writer):
+        started = time.perf_counter()
+        path = request["path"]
+        route = route_name(path)
+        status = 0
+        try:
+            if request["method"] not in ("GET", "HEAD"):
+                request["keep_alive"] = False
+                response = error_response(501, "Unsupported method")
+            elif route == "live":
+                status = await self.send_live(request, reader, writer)
+                return False
+            else:
+                async with self._inflight:
+                    try:
+                        response = await self.route(request)
+                    except Exception:
+                        logging.exception("request for %s failed", path)
+                        request["keep_alive"] = False
+                        response = error_response(500, "Internal error")
+            status = response[0]
+            await self.send(writer, request, *response)
+            return request["keep_alive"]
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+            REQUESTS.inc(route=route, status=status)
+
+    async def send(self, writer, request, status, headers, body):
+        keep_alive = request is not None and request["keep_alive"]
+        try:
+            if status != 304:
+                if isinstance(body, bytes):
+                    length = len(body)
+                else:
+                    length = os.fstat(body.fileno()).st_size
+                headers = headers + [("Content-Length", str(length))]
+            writer.write(response_head(status, headers, keep_alive))
+            if request is None or request["method"] == "HEAD" or not body:
+                pass
+            elif isinstance(body, bytes):
+                writer.write(body)
+            else:
+                # Zero-copy from the page cache; the head is flushed first.
+                await asyncio.get_running_loop().sendfile(writer.transport, body)
+            await writer.drain()
+        finally:
+            if body is not None and not isinstance(body, bytes):
+                body.close()
+
+    async def route(self, request):
+        path = request["path"]
+        if path == METRICS_PATH:
+            return (
+                200,
+                [("Content-Type", metrics.CONTENT_TYPE), ("Cache-Control", "no-store")],
+                render_metrics(),
+            )
+        if path.startswith(api.API_PREFIX):
+            return await self.api_response(request)
+        if path == SUMMARY_PATH:
+            summary = STATS_CACHE.get()
+            if summary is None:
+                return (
+                    503,
+                    [("Retry-After", str(max(int(STATS_CACHE.poll_interval), 1)))],
+                    b"",
+                )
+            return self.variants_response(request, summary)
+        if path.startswith(DATA_PREFIX) and path.endswith(".json"):
+            return self.data_file_response(request, data_file_path(path))
+        return self.static_response(request, static_file_path(path))
+
+    async def api_response(self, request):
+        try:
+            document = await asyncio.get_running_loop().run_in_executor(
+                self._executor, api.respond, request["path"], request["query"]
+            )
+        except api.ApiError as exc:
+            return api_error_response(exc.status, str(exc))
+        except sqlite3.Error as exc:
+            logging.error("api query failed: %r", exc)
+            return api_error_response(503, "database unavailable")
+        return self.variants_response(request, document)
+
+    def variants_response(self, request, document):
+        variants = document["variants"]
+        encoding = pick_encoding(request["headers"].get("accept-encoding"), variants)
+        return self.document_response(
+            request,
+            make_etag(document["digest"], encoding),
+            document["modified"],
+            "application/json; charset=utf-8",
+            encoding,
+            lambda: variants[encoding],
+        )
+
+    def data_file_response(self, request, fs_path):
+        if fs_path is None:
+            return error_response(404, "File not found")
+        try:
+            stat = os.stat(fs_path)
+            digest = file_digest(fs_path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return error_response(404, "File not found")
+        available = [
+            name
+            for name, suffix in build_stats.COMPRESSED_SUFFIXES.items()
+            if os.path.isfile(fs_path + suffix)
+        ]
+        encoding = pick_encoding(request["headers"].get("accept-encoding"), available)
+        if encoding is not None:
+            fs_path += build_stats.COMPRESSED_SUFFIXES[encoding]
+        return self.document_response(
+            request,
+            make_etag(digest, encoding),
+            stat.st_mtime,
+            "application/json; charset=utf-8",
+            encoding,
+            lambda: open(fs_path, "rb"),
+        )
+
+    def static_response(self, request, fs_path):
+        try:
+            stat = os.stat(fs_path)
+        except OSError:
+            return error_response(404, "File not found")
+        if stat.st_size <= ASSET_CACHE_MAX_BYTES:
+            payload, digest = static_asset(fs_path, stat.st_mtime_ns, stat.st_size)
+
+            def load():
+                return payload
+
+        else:
+            digest = file_digest(fs_path, stat.st_mtime_ns, stat.st_size)
+
+            def load():
+                return open(fs_path, "rb")
+
+        content_type = mimetypes.guess_type(fs_path)[0] or "application/octet-stream"
+        return self.document_response(
+            request, make_etag(digest, None), stat.st_mtime, content_type, None, load
+        )
+
+    def document_response(self, request, etag, modified, content_type, encoding, load):
+        headers = request["headers"]
+        if is_not_modified(
+            headers.get("if-none-match"),
+            headers.get("if-modified-since"),
+            etag,
+            modified,
+        ):
+            return 304, validators(etag, modified), b""
+        try:
+            body = load()
+        except OSError:
+            return error_response(404, "File not found")
+        response_headers = [("Content-Type", content_type)]
+        if encoding is not None:
+            response_headers.append(("Content-Encoding", encoding))
+        return 200, response_headers + validators(etag, modified), body
+
+    async def send_live(self, request, reader, writer):
+        try:
+            subscription, snapshot = await asyncio.get_running_loop().run_in_executor(
+                self._executor, live.FEED.subscribe
+            )
+        except sqlite3.Error as exc:
+            logging.error("live feed unavailable: %r", exc)
+            request["keep_alive"] = False
+            await self.send(
+                writer, request, *api_error_response(503, "database unavailable")
+            )
+            return 503
+        try:
+            writer.write(
+                response_head(
+                    200,
+                    [
+                        ("Content-Type", "text/event-stream; charset=utf-8"),
+                        ("Cache-Control", "no-cache"),
+                        ("X-Accel-Buffering", "no"),
+                    ],
+                    False,
+                )
+            )
+            if request["method"] == "HEAD":
+                await writer.drain()
+                return 200
+            writer.write(f"retry: {live.RETRY_MS}\n".encode("ascii"))
+            writer.write(live.format_event("snapshot", {"active_runs": snapshot}))
+            await writer.drain()
+            idle = 0.0
+            while not reader.at_eof():
+                # The feed hands out thread queues; polling them keeps every
+                # subscriber off the thread pool.
+                try:
+                    message = subscription.get_nowait()
+                except queue.Empty:
+                    await asyncio.sleep(LIVE_POLL_INTERVAL)
+                    idle += LIVE_POLL_INTERVAL
+                    if idle < live.KEEPALIVE_INTERVAL:
+                        continue
+                    message = b": keep-alive\n\n"
+                if message is None:
+                    break
+                idle = 0.0
+                writer.write(message)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            live.FEED.unsubscribe(subscription)
+        return 200
+
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
     os.chdir(PUBLIC_DIR)
-    server = http.server.ThreadingHTTPServer(("", 8000), StatsHandler)
+    STATS_CACHE.start()
+    if SERVER_MODE == "asyncio":
+        asyncio.run(AsyncStatsServer().serve(PORT))
+        return
+    server = http.server.ThreadingHTTPServer(("", PORT), StatsHandler)
     server.serve_forever()
 
 
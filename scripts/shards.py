@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+from collections import Counter
+
+import analytics
+import build_stats
+import parallel
+import ranks
+import sql_aggregates
+import streaming
+
+
+def rollup_path(shard):
+    if not build_stats.ROLLUP_PATH:
+        return build_stats.ROLLUP_PATH
+    root, ext = os.path.splitext(build_stats.ROLLUP_PATH)
+    return f"{root}-{shard}{ext}"
+
+
+def rank_key(entry):
+    return (-entry["max_floor"], -entry["xp"])
+
+
+def read_shard(
+    shard, conn, db_path, staging_dir, enemy_name_map, hero_name_map, rank_index
+):
+    totals = sql_aggregates.aggregate_totals(conn, db_path, rollup_path(shard))
+    seasons = build_stats.read_table(conn, "seasons")
+    season_info = streaming.season_info_for(conn, seasons)
+    season_map = season_info["season_map"]
+    current = season_map.get(season_info["current_season_id"])
+
+    active_runs = streaming.read_active_runs(conn)
+    for details in active_runs.values():
+        details["run_id"] = build_stats.shard_key(shard, details["run_id"])
+        details["user_id"] = build_stats.shard_key(shard, details["user_id"])
+    streaming.write_user_details(
+        conn,
+        staging_dir,
+        season_map,
+        active_runs,
+        enemy_name_map,
+        hero_name_map,
+        rank_index,
+        shard=shard,
+    )
+
+    users = []
+    for row in build_stats.counted("users", conn.execute(
+        streaming.RANKED_USERS, (season_info["current_season_id"],)
+    )):
+        entry = build_stats.users_list_entry(row, row["in_current_season"])
+        entry["id"] = build_stats.shard_key(shard, entry["id"])
+        users.append(entry)
+    summaries = []
+    for row in build_stats.read_table(conn, "user_season_stats"):
+        season = season_map.get(row["season_id"])
+        if season:
+            summary = build_stats.season_summary(row, season, hero_name_map)
+            summary["user_id"] = build_stats.shard_key(shard, summary["user_id"])
+            summaries.append(summary)
+    leaderboard = build_stats.leaderboard_section(conn.execute(streaming.LEADERBOARD))
+    for entry in leaderboard:
+        entry["id"] = build_stats.shard_key(shard, entry["id"])
+    season_leaderboard = ranks.read_season_leaderboard(conn, current, hero_name_map)
+    if season_leaderboard is not None:
+        boards = [season_leaderboard["top"], *season_leaderboard["heroes"].values()]
+        for entry in itertools.chain(*boards):
+            entry["id"] = build_stats.shard_key(shard, entry["id"])
+
+    return {
+        "totals": totals,
+        "seasons": [dict(season) for season in seasons],
+        "current_season_key": current["season_key"] if current else None,
+        "season_totals": (
+            season_info["total_users_season"],
+            season_info["total_runs_season"],
+            season_info["total_xp_season"],
+            season_info["max_floor_sum_season"],
+        ),
+        "season_summaries": summaries,
+        "season_history": build_stats.season_history_section(
+            build_stats.read_table(conn, "season_history")
+        ),
+        # Each shard's top 10 holds every candidate for the overall top 10.
+        "leaderboard": leaderboard,
+        "season_leaderboard": season_leaderboard,
+        "active_runs": list(active_runs.values()),
+        "users": users,
+        "analytics": analytics.read_columns(conn, hero_name_map),
+    }
+
+
+def index_shard(db_path, data_dir):
+    """Snapshot one database and build its rank index from the snapshot.
+
+    Returns the snapshot path with the index; the shard's cards are built
+    from the same snapshot later, and the parent releases it.
+    """
+    _, hero_name_map = build_stats.load_name_maps(data_dir)
+    source = build_stats.take_source(db_path)
+    try:
+        with build_stats.phase("index"):
+            conn = build_stats.connect_build(source)
+            try:
+                season_map = {
+                    row["id"]: row for row in build_stats.read_table(conn, "seasons")
+                }
+                return source, ranks.read_index(conn, season_map, hero_name_map)
+            finally:
+                conn.close()
+    except BaseException:
+        build_stats.release_source(source, db_path)
+        raise
+
+
+def build_shard(shard, source, data_dir, staging_dir, rank_index):
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    conn = build_stats.connect_build(source)
+    try:
+        with build_stats.phase("aggregate"):
+            return read_shard(
+                shard,
+                conn,
+                source,
+                staging_dir,
+                enemy_name_map,
+                hero_name_map,
+                rank_index,
+            )
+    finally:
+        conn.close()
+
+
+def in_worker(function, *args):
+    # Workers are reused across shards, so counters are reported per call
+    # and summed by the parent.
+    build_stats.phase_timings.clear()
+    build_stats.table_rows.clear()
+    build_stats.build_counters.clear()
+    result = function(*args)
+    return result, (
+        dict(build_stats.phase_timings),
+        build_stats.table_rows,
+        build_stats.build_counters,
+    )
+
+
+def run_all(pool, names, function, calls, results):
+    """Append each call's result to results, in call order.
+
+    A failed call leaves None in its place, and the first error is raised
+    once every call has finished, so the caller can still clean up after
+    the calls that succeeded.
+    """
+    if pool is None:
+        for args in calls:
+            results.append(function(*args))
+        return results
+    futures = [pool.submit(in_worker, function, *args) for args in calls]
+    error = None
+    for name, future in zip(names, futures):
+        try:
+            result, (timings, rows, counters) = future.result()
+        except Exception as exc:
+            error = error or exc
+            results.append(None)
+            continue
+        # Per-shard phases show which shard bounds the build.
+        for phase_name, seconds in timings.items():
+            build_stats.phase_timings[f"{phase_name}:{name}"] = seconds
+        build_stats.table_rows.update(rows)
+        build_stats.build_counters.update(counters)
+        results.append(result)
+    if error is not None:
+        raise error
+    return results
+
+
+def run_shards(pool, names, paths, data_dir, staging_dir):
+    """Both passes over the shards: rank indexes, then aggregates and cards.
+
+    Cards carry overall ranks, so every shard's index is merged before any
+    card is written. A card's rank is looked up with the card's own score,
+    and both passes read the same snapshot, so the two always agree.
+    """
+    indexed = []
+    try:
+        with build_stats.phase("ranks"):
+            run_all(
+                pool,
+                names,
+                index_shard,
+                [(path, data_dir) for path in paths],
+                indexed,
+            )
+            rank_index = ranks.RankIndex.merged(index for _, index in indexed)
+        with build_stats.phase("shards"):
+            return run_all(
+                pool,
+                names,
+                build_shard,
+                [
+                    (name, source, data_dir, staging_dir, rank_index)
+                    for name, (source, _) in zip(names, indexed)
+                ],
+                [],
+            )
+    finally:
+        for path, result in zip(paths, indexed):
+            if result is not None:
+                build_stats.release_source(result[0], path)
+
+
+def merge_totals(partials):
+    totals = build_stats.new_totals()
+    for partial in partials:
+        for key, value in partial["totals"].items():
+            if isinstance(value, Counter):
+                totals[key].update(value)
+            else:
+                totals[key] += value
+    return totals
+
+
+def merge_seasons(partials):
+    """Season figures over all shards, keyed by season_key.
+
+    Shards keep their own seasons table; the current season is picked from
+    all of them the same way as for one database, and only shards that are
+    in that season contribute to its totals.
+    """
+    season_map = {}
+    for partial in partials:
+        for season in partial["seasons"]:
+            season_map.setdefault(season["season_key"], season)
+    current = build_stats.pick_current_season(list(season_map.values()))
+    current_key = current["season_key"] if current else None
+    users = runs = xp = floor_sum = 0
+    for partial in partials:
+        if current_key is not None and partial["current_season_key"] == current_key:
+            shard_users, shard_runs, shard_xp, shard_floor = partial["season_totals"]
+            users += shard_users
+            runs += shard_runs
+            xp += shard_xp
+            floor_sum += shard_floor
+    return {
+        "season_map": season_map,
+        "current_season_key": current_key,
+        "total_users_season": users,
+        "total_runs_season": runs,
+        "total_xp_season": xp,
+        "avg_max_floor_season": build_stats.safe_round(
+            floor_sum / users, 2
+        ) if users else 0,
+    }
+
+
+def merge_history(partials):
+    history = {}
+    for partial in partials:
+        for key, value in partial["season_history"].items():
+            history.setdefault(key, value)
+    return history
+
+
+def merge_leaderboard(partials):
+    candidates = [entry for partial in partials for entry in partial["leaderboard"]]
+    return sorted(
+        candidates, key=lambda item: (item["max_floor"], item["xp"]), reverse=True
+    )[:10]
+
+
+def merge_season_leaderboard(partials, current_key):
+    boards = [
+        p["season_leaderboard"]
+        for p in partials
+        if p["season_leaderboard"] is not None
+        and p["current_season_key"] == current_key
+    ]
+    if current_key is None or not boards:
+        return None
+
+    def top(entries):
+        return sorted(
+            entries,
+            key=lambda item: (item["max_floor"], item["xp_gained"]),
+            reverse=True,
+        )[:ranks.TOP_K]
+
+    heroes = sorted({hero for board in boards for hero in board["heroes"]})
+    return {
+        "season_key": current_key,
+        "top": top(entry for board in boards for entry in board["top"]),
+        "heroes": {
+            hero: top(
+                entry for board in boards for entry in board["heroes"].get(hero, [])
+            )
+            for hero in heroes
+        },
+    }
+
+
+def write_merged(partials, staging_dir, enemy_name_map, hero_name_map):
+    # Every shard lists its users already ranked, so a k-way merge is enough.
+    ranked = list(heapq.merge(*(p["users"] for p in partials), key=rank_key))
+    index = build_stats.users_index(len(ranked))
+    for number in range(1, index["pages"] + 1):
+        start = (number - 1) * index["page_size"]
+        build_stats.write_json(
+            build_stats.page_path(staging_dir, number),
+            build_stats.users_page(
+                number, index, ranked[start:start + index["page_size"]]
+            ),
+        )
+
+    totals = merge_totals(partials)
+    season_info = merge_seasons(partials)
+    build_stats.write_json(
+        os.path.join(staging_dir, build_stats.SEASONS_NAME),
+        [summary for p in partials for summary in p["season_summaries"]],
+    )
+    streaming.write_days(staging_dir, totals, season_info["season_map"])
+    # Analytics columns carry no ids, so they are merged by concatenation
+    # and every percentile is exact over all shards.
+    analytics_section = analytics.analyze(
+        analytics.merge_columns(p["analytics"] for p in partials),
+        totals["deaths_by_floor"],
+    )
+    summary = build_stats.compose_header(
+        totals, season_info, analytics_section, enemy_name_map, hero_name_map
+    )
+    summary.update(
+        {
+            "season_history": merge_history(partials),
+            "leaderboard": merge_leaderboard(partials),
+            "season_leaderboard": merge_season_leaderboard(
+                partials, season_info["current_season_key"]
+            ),
+            "active_runs": [run for p in partials for run in p["active_runs"]],
+            "users_list": index,
+        }
+    )
+    build_stats.write_json(
+        os.path.join(staging_dir, build_stats.SUMMARY_NAME), summary
+    )
+
+
+def build(paths, data_dir, out_dir):
+    """Build one layout from several databases, one worker per shard.
+
+    Each worker snapshots its own database, builds its rank index and later
+    aggregates it and writes its players' cards; the parent only merges the
+    indexes and the partial results, so the build takes about as long as
+    the slowest shard.
+    """
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    names = build_stats.shard_names(paths)
+    staging_dir = build_stats.start_layout(out_dir)
+    workers = min(parallel.WORKERS, len(paths))
+    try:
+        if workers <= 1:
+            partials = run_shards(None, names, paths, data_dir, staging_dir)
+        else:
+            # spawn rather than fork: the server builds from a background
+            # thread.
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                partials = run_shards(pool, names, paths, data_dir, staging_dir)
+        with build_stats.phase("serialize"):
+            write_merged(partials, staging_dir, enemy_name_map, hero_name_map)
+        build_stats.publish_layout(staging_dir, out_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
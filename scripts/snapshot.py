@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+import build_stats
+
+
+SNAPSHOT_PAGES = int(os.environ.get("STATS_SNAPSHOT_PAGES", "1024"))
+SNAPSHOT_SLEEP = float(os.environ.get("STATS_SNAPSHOT_SLEEP", "0.005"))
+# Every commit by another connection restarts an online backup from page
+# one; after this many restarts the rest is copied in a single step.
+MAX_RESTARTS = 3
+
+
+class Restarted(Exception):
+    pass
+
+
+def snapshot_path(db_path, snapshot_dir):
+    # One stable name per source database, so the incremental checkpoint and
+    # the rollup store keep recognising it from build to build.
+    digest = hashlib.blake2b(
+        os.path.abspath(db_path).encode("utf-8"), digest_size=8
+    ).hexdigest()
+    return os.path.join(snapshot_dir, f"ruins-stats-{digest}.db")
+
+
+def data_version(conn):
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def copy_pages(source, target):
+    """Copy source into target step by step, retrying torn copies.
+
+    A commit by another connection restarts the backup; growing "remaining"
+    shows that early. A commit that keeps the page count, or one that lands
+    around a copy short enough for a single step, is caught by comparing
+    PRAGMA data_version before and after the copy.
+    """
+    state = {"remaining": None, "restarts": 0}
+
+    def restarted():
+        state["restarts"] += 1
+        build_stats.build_counters["snapshot_restarts"] += 1
+        if state["restarts"] > MAX_RESTARTS:
+            raise Restarted()
+
+    def progress(status, remaining, total):
+        build_stats.build_counters["snapshot_steps"] += 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            restarted()
+        state["remaining"] = remaining
+        # No lock is held between steps; this is where the writer gets in.
+        if remaining:
+            time.sleep(SNAPSHOT_SLEEP)
+
+    try:
+        while True:
+            version = data_version(source)
+            state["remaining"] = None
+            source.backup(target, pages=SNAPSHOT_PAGES, progress=progress)
+            if data_version(source) == version:
+                return
+            restarted()
+    except Restarted:
+        # One step copies everything under a single read lock.
+        source.backup(target)
+
+
+def take(db_path, snapshot_dir):
+    """Copy db_path into snapshot_dir and return the copy's path.
+
+    The copy is taken with the online backup API in SNAPSHOT_PAGES steps, so
+    the game's writer is never locked out for longer than one step and WAL
+    checkpoints are not held back by a build's long reads.
+    """
+    path = snapshot_path(db_path, snapshot_dir)
+    staging = f"{path}.{os.getpid()}.tmp"
+    source = build_stats.connect_readonly(db_path)
+    try:
+        target = sqlite3.connect(staging)
+        try:
+            copy_pages(source, target)
+            # The copy is private to the build; rollback mode keeps it to a
+            # single file without -wal/-shm companions.
+            target.execute("PRAGMA journal_mode = DELETE")
+            build_stats.build_counters["snapshot_pages"] += target.execute(
+                "PRAGMA page_count"
+            ).fetchone()[0]
+        finally:
+            target.close()
+        os.replace(staging, path)
+    except (OSError, sqlite3.Error):
+        logging.warning(
+            "snapshot of %s into %s failed, reading the live database",
+            db_path,
+            snapshot_dir,
+            exc_info=True,
+        )
+        return db_path
+    finally:
+        source.close()
+        if os.path.exists(staging):
+            os.remove(staging)
+    return path
+
+
+def release(path, db_path):
+    if path != db_path and os.path.exists(path):
+        os.remove(path)
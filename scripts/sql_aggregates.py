@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+from collections import Counter
+
+import build_stats
+
+
+# Mirrors int(value) in add_counter_from_json for a json_each() row: numbers,
+# booleans and plain integer strings count, everything else is skipped.
+JSON_INT = """
+case j.type
+    when 'integer' then j.atom
+    when 'real' then cast(j.atom as integer)
+    when 'true' then 1
+    when 'false' then 0
+    when 'text' then case
+        when ltrim(trim(j.atom), '+-') <> ''
+            and ltrim(trim(j.atom), '+-') not glob '*[^0-9]*'
+            and length(trim(j.atom)) - length(ltrim(trim(j.atom), '+-')) <= 1
+        then cast(trim(j.atom) as integer)
+    end
+end
+"""
+
+# Mirrors str(hero) for the scalar elements of a parsed JSON list; objects and
+# arrays are skipped by both engines (see build_stats.unlocked_hero_keys).
+JSON_STR = """
+case j.type
+    when 'null' then 'None'
+    when 'true' then 'True'
+    when 'false' then 'False'
+    else cast(j.atom as text)
+end
+"""
+
+# Counter.most_common() breaks ties by insertion order, so every keyed
+# aggregate is returned in order of first appearance: table row first, then
+# position inside the JSON document (json_each ids stay below 2**20).
+FIRST_SEEN = "min(src.rowid * 1048576 + j.id)"
+
+JSON_OBJECT_SUM = f"""
+select key, sum(amount) from (
+    select j.key as key, {JSON_INT} as amount, src.rowid * 1048576 + j.id as seen
+    from {{table}} as src, json_each(
+        case
+            when json_valid(src.{{column}}) and json_type(src.{{column}}) = 'object'
+            then src.{{column}}
+        end
+    ) as j
+)
+where amount is not null
+group by key
+order by min(seen)
+"""
+
+JSON_ARRAY_COUNT = f"""
+select {JSON_STR} as item, count(*)
+from {{table}} as src, json_each(
+    case
+        when json_valid(src.{{column}}) and json_type(src.{{column}}) = 'array'
+        then src.{{column}}
+    end
+) as j
+where j.type not in ('object', 'array')
+group by item
+order by {FIRST_SEEN}
+"""
+
+RUN_BUCKETS = """
+select
+    case when julianday(started_at) is not null then substr(started_at, 1, 10) end
+        as day,
+    coalesce(max_floor, 0) as floor,
+    count(*) as runs,
+    sum(case when is_active then 1 else 0 end) as active,
+    count(duration_ms) as ended,
+    coalesce(sum(duration_ms), 0) as bucket_ms
+from (
+    select
+        started_at,
+        max_floor,
+        is_active,
+        case
+            when julianday(started_at) is not null
+                and julianday(ended_at) >= julianday(started_at)
+            then round((julianday(ended_at) - julianday(started_at)) * 86400000.0)
+        end as duration_ms
+    from {runs} {where}
+)
+group by 1, 2
+"""
+
+
+def int_sum(column):
+    return f"coalesce(sum(cast(coalesce({column}, 0) as integer)), 0)"
+
+
+def keyed_counter(conn, sql, **params):
+    counter = Counter()
+    for key, value in conn.execute(sql.format(**params)):
+        counter[str(key)] += value
+    return counter
+
+
+def aggregate_totals(conn, db_path=None, rollup_path=None):
+    totals = build_stats.new_totals()
+
+    total_users, tutorial_done = conn.execute(
+        "select count(*), coalesce(sum(case when tutorial_done then 1 else 0 end), 0) "
+        "from users"
+    ).fetchone()
+    totals["total_users"] = total_users
+    totals["tutorial_done"] = tutorial_done
+    totals["unlocked_heroes"] = keyed_counter(
+        conn, JSON_ARRAY_COUNT, table="users", column="unlocked_heroes_json"
+    )
+
+    deaths, treasures, chests = conn.execute(
+        f"select {int_sum('deaths')}, {int_sum('treasures_found')}, "
+        f"{int_sum('chests_opened')} from user_stats"
+    ).fetchone()
+    totals["total_deaths"] = deaths
+    totals["total_treasures"] = treasures
+    totals["total_chests"] = chests
+    for name, column in (
+        ("deaths_by_floor", "deaths_by_floor"),
+        ("kills_by_type", "kills_json"),
+        ("hero_runs", "hero_runs_json"),
+    ):
+        totals[name] = keyed_counter(
+            conn, JSON_OBJECT_SUM, table="user_stats", column=column
+        )
+
+    if db_path is not None and build_stats.ROLLUP_PATH:
+        import rollups
+
+        buckets = rollups.run_buckets(db_path, rollup_path)
+    else:
+        buckets = conn.execute(RUN_BUCKETS.format(runs="runs", where=""))
+    duration_ms = 0
+    for day, floor, runs, active, ended, bucket_ms in buckets:
+        totals["active_runs"] += active
+        totals["run_max_floor"][str(floor)] += runs
+        if day is not None:
+            totals["runs_per_day"][day] += runs
+            totals["floor_per_day"][day] += floor * runs
+            totals["ended_per_day"][day] += ended
+            totals["duration_ms_per_day"][day] += int(bucket_ms)
+        totals["duration_count"] += ended
+        duration_ms += bucket_ms
+    totals["duration_sum"] = duration_ms / 60000.0
+
+    purchases = conn.execute(
+        f"select count(*), {int_sum('stars')}, {int_sum('levels')}, "
+        f"{int_sum('xp_added')} from star_purchases"
+    ).fetchone()
+    (
+        totals["purchase_count"],
+        totals["stars_bought"],
+        totals["levels_bought"],
+        totals["xp_from_purchases"],
+    ) = purchases
+
+    for action, count, stars in conn.execute(
+        f"select coalesce(nullif(action, ''), 'unknown'), count(*), {int_sum('stars')} "
+        "from star_actions group by 1 order by min(rowid)"
+    ):
+        totals["actions_by_type"][action] += count
+        totals["stars_spent"] += stars
+    return totals
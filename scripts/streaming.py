@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+import itertools
+import json
+import os
+import shutil
+
+import build_stats
+import ranks
+import sql_aggregates
+from build_stats import (
+    active_run_details,
+    badge_entry,
+    broadcast_entry,
+    parse_json,
+    parse_user_stats,
+    user_active_run,
+    user_season_entry,
+)
+
+
+BATCH_SIZE = int(os.environ.get("STATS_STREAM_BATCH", "2000"))
+
+SEASON_TOTALS = f"""
+select
+    count(*),
+    {sql_aggregates.int_sum('total_runs')},
+    {sql_aggregates.int_sum('xp_gained')},
+    {sql_aggregates.int_sum('max_floor')}
+from user_season_stats
+where season_id = ?
+"""
+
+LEADERBOARD = """
+select * from users
+order by
+    cast(coalesce(max_floor, 0) as integer) desc,
+    cast(coalesce(xp, 0) as integer) desc,
+    rowid
+limit 10
+"""
+
+
+RANKED_USERS = """
+select users.*, exists(
+    select 1 from user_season_stats as s
+    where s.user_id = users.id and s.season_id is ?
+) as in_current_season
+from users
+order by
+    cast(coalesce(max_floor, 0) as integer) desc,
+    cast(coalesce(xp, 0) as integer) desc,
+    rowid
+"""
+
+
+class JsonStreamWriter:
+    def __init__(self, handle, indent=None, ensure_ascii=True, separators=None):
+        self.handle = handle
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        if separators is None:
+            separators = (",", ": ") if indent is not None else (", ", ": ")
+        self.item_separator, self.key_separator = separators
+        self._stack = []
+
+    def _newline(self, depth):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * depth)
+
+    def _member(self, key):
+        if self._stack:
+            prefix = self.item_separator if self._stack[-1][1] else ""
+            self._stack[-1][1] = True
+            self.handle.write(prefix + self._newline(len(self._stack)))
+        if key is not None:
+            self.handle.write(
+                json.dumps(str(key), ensure_ascii=self.ensure_ascii)
+                + self.key_separator
+            )
+
+    def _open(self, key, opening, closing):
+        self._member(key)
+        self.handle.write(opening)
+        self._stack.append([closing, False])
+
+    def begin_object(self, key=None):
+        self._open(key, "{", "}")
+
+    def begin_array(self, key=None):
+        self._open(key, "[", "]")
+
+    def value(self, value, key=None):
+        self._member(key)
+        text = json.dumps(
+            value,
+            ensure_ascii=self.ensure_ascii,
+            indent=self.indent,
+            separators=(self.item_separator, self.key_separator),
+        )
+        if self.indent is not None and self._stack:
+            text = text.replace("\n", self._newline(len(self._stack)))
+        self.handle.write(text)
+
+    def end(self):
+        closing, has_items = self._stack.pop()
+        if has_items:
+            self.handle.write(self._newline(len(self._stack)))
+        self.handle.write(closing)
+
+
+def iter_rows(cursor, size=BATCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+class UserGroups:
+    """Walks a query ordered by user_id in step with an ascending user scan."""
+
+    def __init__(self, conn, sql, params, table):
+        rows = build_stats.counted(table, iter_rows(conn.execute(sql, params)))
+        self._groups = itertools.groupby(rows, key=lambda row: row["user_id"])
+        self._current = next(self._groups, None)
+
+    def take(self, user_id):
+        while self._current is not None and self._current[0] < user_id:
+            self._current = next(self._groups, None)
+        if self._current is None or self._current[0] != user_id:
+            return []
+        rows = list(self._current[1])
+        self._current = next(self._groups, None)
+        return rows
+
+
+def grouped(conn, table, columns="*", user_range=None):
+    sql = f"select {columns} from {table} where user_id is not null"
+    params = ()
+    if user_range is not None:
+        sql += " and user_id between ? and ?"
+        params = user_range
+    return UserGroups(conn, sql + " order by user_id, rowid", params, table)
+
+
+def season_info_for(conn, seasons):
+    current_season = build_stats.pick_current_season(seasons)
+    current_season_id = current_season["id"] if current_season else None
+    users_season, runs_season, xp_season, floor_season = (0, 0, 0, 0)
+    if current_season_id is not None:
+        users_season, runs_season, xp_season, floor_season = conn.execute(
+            SEASON_TOTALS, (current_season_id,)
+        ).fetchone()
+    return {
+        "season_map": {s["id"]: s for s in seasons},
+        "current_season_id": current_season_id,
+        "current_season_key": current_season["season_key"] if current_season else None,
+        "total_users_season": users_season,
+        "total_runs_season": runs_season,
+        "total_xp_season": xp_season,
+        "avg_max_floor_season": build_stats.safe_round(
+            floor_season / users_season, 2
+        ) if users_season else 0,
+        "max_floor_sum_season": floor_season,
+    }
+
+
+def read_active_runs(conn, where="", params=()):
+    return {
+        row["id"]: active_run_details(row)
+        for row in build_stats.read_active_runs(conn, where, params)
+    }
+
+
+def write_seasons(conn, staging_dir, season_map, hero_name_map):
+    path = os.path.join(staging_dir, build_stats.SEASONS_NAME)
+    with open(path, "w", encoding="utf-8") as handle:
+        writer = JsonStreamWriter(handle, **build_stats.json_options())
+        writer.begin_array()
+        rows = iter_rows(conn.execute("select * from user_season_stats"))
+        for row in build_stats.counted("user_season_stats", rows):
+            season = season_map.get(row["season_id"])
+            if season:
+                writer.value(build_stats.season_summary(row, season, hero_name_map))
+        writer.end()
+    build_stats.compress_file(path)
+
+
+def write_days(staging_dir, totals, season_map):
+    build_stats.write_json(
+        os.path.join(staging_dir, build_stats.DAYS_NAME),
+        build_stats.days_document(totals, season_map),
+    )
+
+
+def write_summary(
+    conn, staging_dir, header, season_leaderboard, active_runs_details, index
+):
+    path = os.path.join(staging_dir, build_stats.SUMMARY_NAME)
+    with open(path, "w", encoding="utf-8") as handle:
+        writer = JsonStreamWriter(handle, **build_stats.json_options())
+        writer.begin_object()
+        for key, value in header.items():
+            writer.value(value, key=key)
+        writer.value(
+            build_stats.season_history_section(
+                build_stats.read_table(conn, "season_history")
+            ),
+            key="season_history",
+        )
+        writer.value(
+            build_stats.leaderboard_section(conn.execute(LEADERBOARD)),
+            key="leaderboard",
+        )
+        writer.value(season_leaderboard, key="season_leaderboard")
+        writer.value(active_runs_details, key="active_runs")
+        writer.value(index, key="users_list")
+        writer.end()
+    build_stats.compress_file(path)
+
+
+def write_users_pages(conn, staging_dir, current_season_id):
+    total = conn.execute("select count(*) from users").fetchone()[0]
+    index = build_stats.users_index(total)
+    cursor = conn.execute(RANKED_USERS, (current_season_id,))
+    for number in range(1, index["pages"] + 1):
+        rows = cursor.fetchmany(index["page_size"])
+        build_stats.table_rows["users"] += len(rows)
+        entries = [
+            build_stats.users_list_entry(user, user["in_current_season"])
+            for user in rows
+        ]
+        build_stats.write_json(
+            build_stats.page_path(staging_dir, number),
+            build_stats.users_page(number, index, entries),
+        )
+    return index
+
+
+def write_user_details(
+    conn,
+    staging_dir,
+    season_map,
+    active_runs,
+    enemy_name_map,
+    hero_name_map,
+    rank_index,
+    user_range=None,
+    shard=None,
+):
+    runs = grouped(conn, "runs", build_stats.RUN_COLUMNS, user_range)
+    stats = grouped(conn, "user_stats", user_range=user_range)
+    season_rows = grouped(conn, "user_season_stats", user_range=user_range)
+    purchases = grouped(conn, "star_purchases", user_range=user_range)
+    actions = grouped(conn, "star_actions", user_range=user_range)
+    badges = grouped(conn, "user_badges", user_range=user_range)
+    broadcasts = grouped(conn, "user_broadcasts", user_range=user_range)
+
+    if user_range is None:
+        cursor = conn.execute("select * from users order by id")
+    else:
+        cursor = conn.execute(
+            "select * from users where id between ? and ? order by id", user_range
+        )
+    users = iter_rows(cursor)
+    for user in build_stats.counted("users", users):
+        user_id = user["id"]
+        run_rows = runs.take(user_id)
+        active_run = None
+        for row in run_rows:
+            if row["is_active"]:
+                active_run = user_active_run(active_runs[row["id"]])
+                break
+        stats_rows = stats.take(user_id)
+        details = build_stats.user_detail(
+            user,
+            parse_json(user["unlocked_heroes_json"], []),
+            parse_user_stats(stats_rows[-1]) if stats_rows else None,
+            run_rows,
+            [
+                user_season_entry(row, season_map[row["season_id"]], hero_name_map)
+                for row in season_rows.take(user_id)
+                if row["season_id"] in season_map
+            ],
+            purchases.take(user_id),
+            actions.take(user_id),
+            [badge_entry(row) for row in badges.take(user_id)],
+            [broadcast_entry(row) for row in broadcasts.take(user_id)],
+            active_run,
+            enemy_name_map,
+            hero_name_map,
+        )
+        ranks.annotate(details, rank_index)
+        details["id"] = build_stats.shard_key(shard, user_id)
+        build_stats.write_json(
+            build_stats.player_path(staging_dir, details["id"]), details
+        )
+
+
+def build(db_path, data_dir, out_dir):
+    enemy_name_map, hero_name_map = build_stats.load_name_maps(data_dir)
+    conn = build_stats.connect_build(db_path)
+    staging_dir = build_stats.start_layout(out_dir)
+    rank_index = None
+    try:
+        with build_stats.phase("aggregate"):
+            totals = sql_aggregates.aggregate_totals(conn, db_path)
+            seasons = build_stats.read_table(conn, "seasons")
+            season_info = season_info_for(conn, seasons)
+            season_map = season_info["season_map"]
+            active_runs = read_active_runs(conn)
+            # On disk, so that memory does not grow with the number of players.
+            rank_index = ranks.read_table(conn, season_map, hero_name_map)
+
+        with build_stats.phase("details"):
+            index = write_users_pages(
+                conn, staging_dir, season_info["current_season_id"]
+            )
+            write_user_details(
+                conn,
+                staging_dir,
+                season_map,
+                active_runs,
+                enemy_name_map,
+                hero_name_map,
+                rank_index,
+            )
+
+        with build_stats.phase("serialize"):
+            write_seasons(
+                conn, staging_dir, season_info["season_map"], hero_name_map
+            )
+            write_days(staging_dir, totals, season_info["season_map"])
+            # The analytics columns grow with the number of runs, so stream
+            # mode leaves the section out to keep its memory bounded.
+            header = build_stats.compose_header(
+                totals, season_info, None, enemy_name_map, hero_name_map
+            )
+            season_leaderboard = ranks.read_season_leaderboard(
+                conn, season_map.get(season_info["current_season_id"]), hero_name_map
+            )
+            write_summary(
+                conn,
+                staging_dir,
+                header,
+                season_leaderboard,
+                list(active_runs.values()),
+                index,
+            )
+        build_stats.publish_layout(staging_dir, out_dir)
+    finally:
+        if rank_index is not None:
+            rank_index.close()
+        conn.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
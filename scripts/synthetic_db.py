@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+
+SCHEMA = """
+create table users (
+    id integer primary key,
+    username text,
+    xp integer default 0,
+    max_floor integer default 0,
+    tutorial_done integer default 0,
+    unlocked_heroes_json text,
+    created_at text
+);
+create table runs (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    started_at text,
+    ended_at text,
+    max_floor integer default 0,
+    is_active integer default 0,
+    is_tutorial integer default 0,
+    state_json text
+);
+create index runs_user_id on runs (user_id);
+create index runs_active on runs (is_active);
+create table user_stats (
+    user_id integer primary key,
+    total_runs integer default 0,
+    deaths integer default 0,
+    treasures_found integer default 0,
+    chests_opened integer default 0,
+    deaths_by_floor text,
+    kills_json text,
+    hero_runs_json text
+);
+create table user_badges (
+    user_id integer,
+    badge_id text,
+    count integer default 0,
+    last_awarded_season text,
+    last_awarded_at text,
+    primary key (user_id, badge_id)
+);
+create table user_broadcasts (
+    user_id integer,
+    broadcast_key text,
+    sent_at text,
+    primary key (user_id, broadcast_key)
+);
+create table seasons (
+    id integer primary key autoincrement,
+    season_key text unique,
+    started_at text,
+    ended_at text
+);
+create table user_season_stats (
+    user_id integer,
+    season_id integer,
+    max_floor integer default 0,
+    total_runs integer default 0,
+    deaths integer default 0,
+    treasures_found integer default 0,
+    chests_opened integer default 0,
+    xp_gained integer default 0,
+    max_floor_character text,
+    primary key (user_id, season_id)
+);
+create table season_history (
+    season_key text primary key,
+    season_number integer,
+    winners_json text,
+    summary_json text
+);
+create table star_purchases (
+    id integer primary key autoincrement,
+    user_id integer,
+    created_at text,
+    stars integer,
+    levels integer,
+    xp_added integer
+);
+create table star_actions (
+    id integer primary key autoincrement,
+    user_id integer,
+    created_at text,
+    action text,
+    stars integer
+);
+"""
+
+HEROES = [
+    "wanderer",
+    "rune_guard",
+    "berserk",
+    "assassin",
+    "hunter",
+    "executioner",
+    "duelist",
+]
+ENEMIES = [
+    ("zombie", "Зомби"),
+    ("skeleton", "Скелет"),
+    ("ghoul", "Упырь"),
+    ("bone_knight", "Костяной рыцарь"),
+    ("rot_dog", "Гниющий пёс"),
+    ("warlock", "Чернокнижник"),
+    ("goblin", "Гоблин"),
+    ("ghost", "Призрак"),
+    ("lich_minion", "Приспешник лича"),
+    ("abyss_guard", "Страж бездны"),
+    ("stone_golem", "Каменный голем"),
+    ("necromancer", "Некромант"),
+]
+WEAPONS = ["Костяное копьё", "Ржавый меч", "Топор палача", "Кинжал тени"]
+PHASES = ["battle", "rest", "treasure", "shop"]
+ACTIONS = ["second_chance", "revive", "reroll"]
+SEASON_COUNT = 3
+EPOCH = datetime(2025, 10, 1)
+BATCH = 5000
+
+
+def fmt(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def month_start(offset):
+    month = EPOCH.month - 1 + offset
+    return EPOCH.replace(year=EPOCH.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def game_state(rnd, floor, full):
+    enemy_count = rnd.randint(0, 3)
+    state = {
+        "floor": floor,
+        "phase": rnd.choice(PHASES),
+        "tutorial": False,
+        "player": {
+            "hp": rnd.randint(1, 40),
+            "hp_max": 40,
+            "ap": rnd.randint(0, 3),
+            "ap_max": 3,
+            "armor": round(rnd.random(), 2),
+            "accuracy": 0.7,
+            "evasion": 0.05,
+            "power": rnd.randint(1, 5),
+            "luck": 0.2,
+            "weapon": {"id": "weapon", "name": rnd.choice(WEAPONS), "damage": 4},
+            "potions": [{"id": "heal", "power": 10}] * rnd.randint(0, 3),
+            "scrolls": [{"id": "fire", "power": 6}] * rnd.randint(0, 2),
+        },
+        "enemies": [],
+    }
+    for _ in range(enemy_count):
+        enemy_id, name = rnd.choice(ENEMIES)
+        state["enemies"].append(
+            {
+                "id": enemy_id,
+                "name": name,
+                "hp": rnd.randint(1, 20),
+                "max_hp": 20,
+                "attack": round(rnd.uniform(2, 8), 1),
+                "armor": round(rnd.random(), 1),
+                "danger": "средняя",
+            }
+        )
+    if full:
+        state["player"]["inventory"] = [
+            {"id": f"item_{index}", "count": rnd.randint(1, 3)} for index in range(12)
+        ]
+        state["log"] = [f"floor {floor}: event {index}" for index in range(30)]
+    return json.dumps(state, ensure_ascii=False)
+
+
+def generate(path, users, runs_per_user, seed=1, active_ratio=0.05):
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(SCHEMA)
+
+    now = datetime.utcnow().replace(microsecond=0)
+    span_days = max((now - EPOCH).days, 1)
+    for index in range(SEASON_COUNT):
+        started = month_start(index)
+        ended = None if index == SEASON_COUNT - 1 else month_start(index + 1)
+        conn.execute(
+            "insert into seasons (season_key, started_at, ended_at) values (?, ?, ?)",
+            (started.strftime("%Y-%m"), fmt(started), fmt(ended) if ended else None),
+        )
+        if ended:
+            conn.execute(
+                "insert into season_history values (?, ?, ?, ?)",
+                (
+                    started.strftime("%Y-%m"),
+                    index + 1,
+                    json.dumps({"1": [1], "2": [2], "3": [3]}),
+                    json.dumps({"players": users, "runs": users * runs_per_user}),
+                ),
+            )
+
+    pending = {
+        "users": [],
+        "runs": [],
+        "stats": [],
+        "seasons": [],
+        "purchases": [],
+        "actions": [],
+        "badges": [],
+        "broadcasts": [],
+    }
+
+    def flush():
+        conn.executemany(
+            "insert into users values (?, ?, ?, ?, ?, ?, ?)", pending["users"]
+        )
+        conn.executemany(
+            "insert into runs (user_id, started_at, ended_at, max_floor, is_active, "
+            "is_tutorial, state_json) values (?, ?, ?, ?, ?, ?, ?)",
+            pending["runs"],
+        )
+        conn.executemany(
+            "insert into user_stats values (?, ?, ?, ?, ?, ?, ?, ?)", pending["stats"]
+        )
+        conn.executemany(
+            "insert into user_season_stats values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            pending["seasons"],
+        )
+        conn.executemany(
+            "insert into star_purchases (user_id, created_at, stars, levels, xp_added) "
+            "values (?, ?, ?, ?, ?)",
+            pending["purchases"],
+        )
+        conn.executemany(
+            "insert into star_actions (user_id, created_at, action, stars) "
+            "values (?, ?, ?, ?)",
+            pending["actions"],
+        )
+        conn.executemany(
+            "insert into user_badges values (?, ?, ?, ?, ?)", pending["badges"]
+        )
+        conn.executemany(
+            "insert into user_broadcasts values (?, ?, ?)", pending["broadcasts"]
+        )
+        for items in pending.values():
+            items.clear()
+
+    for user_id in range(1, users + 1):
+        created = EPOCH + timedelta(seconds=rnd.randint(0, span_days * 86400))
+        run_count = rnd.randint(0, runs_per_user * 2)
+        max_floor = 0
+        deaths_by_floor = {}
+        kills = {}
+        hero_runs = {}
+        started = created
+        gap = max(int((now - created).total_seconds() / 60 / max(run_count, 1)), 1)
+        for index in range(run_count):
+            started = min(started + timedelta(minutes=rnd.randint(1, gap)), now)
+            floor = rnd.randint(1, 70)
+            max_floor = max(max_floor, floor)
+            hero = rnd.choice(HEROES)
+            hero_runs[hero] = hero_runs.get(hero, 0) + 1
+            active = index == run_count - 1 and rnd.random() < active_ratio
+            if active:
+                ended = None
+            else:
+                ended = fmt(started + timedelta(seconds=rnd.randint(10, 7200)))
+                deaths_by_floor[str(floor)] = deaths_by_floor.get(str(floor), 0) + 1
+            for _ in range(2):
+                enemy_id = rnd.choice(ENEMIES)[0]
+                kills[enemy_id] = kills.get(enemy_id, 0) + rnd.randint(1, 6)
+            pending["runs"].append(
+                (
+                    user_id,
+                    fmt(started),
+                    ended,
+                    floor,
+                    int(active),
+                    int(index == 0),
+                    game_state(rnd, floor, active),
+                )
+            )
+        pending["users"].append(
+            (
+                user_id,
+                None if user_id % 97 == 0 else f"player_{user_id}",
+                rnd.randint(0, 20000),
+                max_floor,
+                int(run_count > 0),
+                json.dumps(rnd.sample(HEROES, rnd.randint(1, 4))),
+                fmt(created),
+            )
+        )
+        if run_count:
+            pending["stats"].append(
+                (
+                    user_id,
+                    run_count,
+                    sum(deaths_by_floor.values()),
+                    rnd.randint(0, run_count),
+                    rnd.randint(0, run_count * 3),
+                    json.dumps(deaths_by_floor),
+                    json.dumps(kills),
+                    json.dumps(hero_runs),
+                )
+            )
+            for season_id in range(1, SEASON_COUNT + 1):
+                if rnd.random() < 0.5:
+                    pending["seasons"].append(
+                        (
+                            user_id,
+                            season_id,
+                            rnd.randint(0, max_floor),
+                            rnd.randint(1, run_count),
+                            rnd.randint(0, run_count),
+                            rnd.randint(0, 10),
+                            rnd.randint(0, 30),
+                            rnd.randint(0, 5000),
+                            rnd.choice(HEROES),
+                        )
+                    )
+        for _ in range(rnd.choice((0, 0, 0, 1, 2))):
+            pending["purchases"].append(
+                (user_id, fmt(created + timedelta(days=1)), 25, 2, 300)
+            )
+        for _ in range(rnd.choice((0, 0, 1, 3))):
+            pending["actions"].append(
+                (user_id, fmt(created + timedelta(days=2)), rnd.choice(ACTIONS), 1)
+            )
+        if rnd.random() < 0.05:
+            pending["badges"].append(
+                (user_id, "season_top", 1, EPOCH.strftime("%Y-%m"), fmt(month_start(1)))
+            )
+        if rnd.random() < 0.2:
+            pending["broadcasts"].append((user_id, "season_start", fmt(EPOCH)))
+        if len(pending["runs"]) >= BATCH or len(pending["users"]) >= BATCH:
+            flush()
+    flush()
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ruins.db")
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--runs-per-user", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, args.users, args.runs_per_user, args.seed)
+
+
+if __name__ == "__main__":
+    main()
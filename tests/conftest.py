@@ -0,0 +1,121 @@
+import http.client
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS)
+
+import bench_stats  # noqa: E402
+import synthetic_db  # noqa: E402
+
+
+def read_output(out_dir):
+    """Every JSON document of a build by relative path, minus generated_at."""
+    documents = {}
+    for relative, path in bench_stats.walk_output(out_dir):
+        if relative.endswith((".gz", ".br")):
+            continue
+        with open(path, encoding="utf-8") as handle:
+            documents[relative] = json.load(handle)
+    documents["summary.json"].pop("generated_at", None)
+    return documents
+
+
+@pytest.fixture(scope="session")
+def game_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("db") / "ruins.db")
+    synthetic_db.generate(path, users=200, runs_per_user=10)
+    return path
+
+
+@pytest.fixture
+def build_env(tmp_path):
+    def env(db_path, mode="full", out_dir=None, **overrides):
+        environ = dict(
+            os.environ,
+            STATS_BUILD_MODE=mode,
+            DB_PATH=db_path,
+            STATS_OUT_DIR=out_dir or str(tmp_path / f"out-{mode}"),
+            GAME_DATA_DIR=str(tmp_path / "no-game-data"),
+            STATS_ROLLUP_PATH="",
+            STATS_SNAPSHOT_DIR="",
+            STATS_CHECKPOINT_PATH=str(tmp_path / "checkpoint.pickle"),
+            STATS_WORKERS="2",
+        )
+        environ.update(overrides)
+        return environ
+
+    return env
+
+
+@pytest.fixture
+def run_build(build_env):
+    """Run build_stats.py in a fresh process and return its output dir.
+
+    The builder reads its settings from the environment at import time, so
+    every build gets its own interpreter.
+    """
+
+    def run(db_path, mode="full", out_dir=None, **overrides):
+        environ = build_env(db_path, mode, out_dir, **overrides)
+        process = subprocess.run(
+            [sys.executable, "build_stats.py"],
+            cwd=SCRIPTS,
+            env=environ,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        assert process.returncode == 0, process.stderr
+        return environ["STATS_OUT_DIR"]
+
+    return run
+
+
+@pytest.fixture(params=["threading", "asyncio"])
+def serve(request, build_env, tmp_path):
+    """Start server.py in both server modes and return a request function.
+
+    The server is ready once its first build answers summary.json.
+    """
+    servers = []
+
+    def start(db_path):
+        port = bench_stats.free_port()
+        environ = build_env(
+            db_path,
+            out_dir=str(tmp_path / "served"),
+            STATS_PORT=str(port),
+            STATS_SERVER=request.param,
+        )
+        process = subprocess.Popen(
+            [sys.executable, bench_stats.SERVER_SCRIPT],
+            env=environ,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        servers.append(process)
+        bench_stats.wait_for_server(port, process)
+
+        def get(path, headers=None):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            try:
+                conn.request("GET", path, headers=headers or {})
+                response = conn.getresponse()
+                received = {
+                    name.lower(): value for name, value in response.getheaders()
+                }
+                return response.status, received, response.read()
+            finally:
+                conn.close()
+
+        return get
+
+    yield start
+    for process in servers:
+        process.terminate()
+        process.wait()
@@ -0,0 +1,98 @@
+import shutil
+import sqlite3
+import statistics
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import analytics  # noqa: E402
+import build_stats  # noqa: E402
+
+NOW = 1_800_000_000
+DEATHS_BY_FLOOR = {"1": 40, "2": 25, "3": 10, "5": 3, "unknown": 7}
+
+
+def read_columns(db_path):
+    conn = build_stats.connect_readonly(db_path)
+    try:
+        return analytics.read_columns(conn, {})
+    finally:
+        conn.close()
+
+
+def expected_percentiles(values):
+    # NumPy's default percentile interpolates linearly, like "inclusive".
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        f"p{rank}": pytest.approx(cuts[rank - 1], abs=0.01)
+        for rank in analytics.PERCENTILES
+    }
+
+
+def test_percentiles_match_sqlite(game_db):
+    result = analytics.analyze(read_columns(game_db), DEATHS_BY_FLOOR, now=NOW)
+    conn = sqlite3.connect(game_db)
+    floors = [
+        row[0]
+        for row in conn.execute(
+            "select cast(coalesce(max_floor, 0) as integer) from runs"
+        )
+    ]
+    minutes = [
+        row[0]
+        for row in conn.execute(
+            "select (julianday(ended_at) - julianday(started_at)) * 1440 from runs "
+            "where julianday(ended_at) >= julianday(started_at)"
+        )
+    ]
+    regular = conn.execute(
+        "select count(*) from runs where not is_tutorial"
+    ).fetchone()[0]
+    conn.close()
+
+    overall = result["percentiles"]["all"]
+    assert overall["runs"] == len(floors)
+    assert overall["ended"] == len(minutes)
+    assert overall["max_floor"] == expected_percentiles(floors)
+    assert overall["duration_minutes"] == expected_percentiles(minutes)
+    assert result["percentiles"]["regular"]["runs"] == regular
+
+    survival = result["survival"]
+    for index, floor in enumerate(survival["floors"]):
+        assert survival["at_risk"][index] == sum(value >= floor for value in floors)
+        assert survival["deaths"][index] == DEATHS_BY_FLOOR.get(str(floor), 0)
+
+
+def test_survival_curve_known_values():
+    runs = np.array([1, 2, 2, 3])
+    curve = analytics.survival_curve(runs, {"1": 1, "2": 1, "x": 5})
+    assert curve == {
+        "floors": [1, 2, 3],
+        "at_risk": [4, 3, 1],
+        "deaths": [1, 1, 0],
+        "hazard": [0.25, 0.3333, 0.0],
+        "survival": [0.75, 0.5, 0.5],
+    }
+
+
+def test_merged_shards_match_single_database(game_db, tmp_path):
+    # Split the fixture by player into two databases, as if it were sharded.
+    parts = []
+    for parity in (0, 1):
+        path = str(tmp_path / f"part{parity}.db")
+        shutil.copy(game_db, path)
+        conn = sqlite3.connect(path)
+        conn.execute("delete from users where id % 2 = ?", (parity,))
+        for table in ("runs", "user_season_stats"):
+            conn.execute(f"delete from {table} where user_id % 2 = ?", (parity,))
+        conn.commit()
+        conn.close()
+        parts.append(read_columns(path))
+
+    merged = analytics.analyze(
+        analytics.merge_columns(parts), DEATHS_BY_FLOOR, now=NOW
+    )
+    single = analytics.analyze(read_columns(game_db), DEATHS_BY_FLOOR, now=NOW)
+    assert merged == single
+    assert single["hero_floors"] and single["retention"]["cohorts"]
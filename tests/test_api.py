@@ -0,0 +1,109 @@
+import json
+import shutil
+import sqlite3
+
+import pytest
+
+import ranks
+
+
+def get_json(get, path):
+    status, _, body = get(path)
+    assert status == 200, path
+    return json.loads(body)
+
+
+@pytest.mark.parametrize("user_id", [1, 7, 200])
+def test_player_card_matches_built_file(user_id, game_db, serve):
+    get = serve(game_db)
+    built = get_json(get, f"/data/players/{user_id}.json")
+    assert get_json(get, f"/api/players/{user_id}") == built
+
+
+def test_player_ranks_use_rank_indexes(tmp_path, game_db, serve):
+    db_path = str(tmp_path / "ruins.db")
+    shutil.copy(game_db, db_path)
+    conn = sqlite3.connect(db_path)
+    assert len(ranks.missing_rank_indexes(conn)) == len(ranks.RANK_INDEXES)
+    for statement in ranks.missing_rank_indexes(conn):
+        conn.execute(statement)
+    conn.commit()
+    assert ranks.missing_rank_indexes(conn) == []
+    conn.close()
+
+    get = serve(db_path)
+    for user_id in (1, 7, 200):
+        built = get_json(get, f"/data/players/{user_id}.json")
+        assert get_json(get, f"/api/players/{user_id}") == built
+
+
+def test_players_page_matches_built_page(game_db, serve):
+    get = serve(game_db)
+    page = get_json(get, "/api/players?page=1")
+    assert page.pop("sort") == "floor"
+    assert page == get_json(get, "/data/users/1.json")
+    by_xp = get_json(get, "/api/players?sort=xp&limit=20")["users"]
+    xp = [entry["xp"] for entry in by_xp]
+    assert len(xp) == 20 and xp == sorted(xp, reverse=True)
+
+
+def test_players_page_past_the_end(game_db, serve):
+    page = get_json(serve(game_db), "/api/players?page=4611686018427387904")
+    assert page["users"] == []
+
+
+def test_player_runs_pages(game_db, serve):
+    get = serve(game_db)
+    conn = sqlite3.connect(game_db)
+    expected = [
+        row[0]
+        for row in conn.execute(
+            "select id from runs where user_id = 5 order by id desc"
+        )
+    ]
+    conn.close()
+    seen = []
+    path = "/api/players/5/runs?limit=3"
+    while True:
+        page = get_json(get, path)
+        assert len(page["runs"]) <= 3
+        seen.extend(run["id"] for run in page["runs"])
+        if page["next_before"] is None:
+            break
+        path = f"/api/players/5/runs?limit=3&before={page['next_before']}"
+    assert seen == expected
+
+
+def test_leaderboard_and_active_runs_match_summary(game_db, serve):
+    get = serve(game_db)
+    summary = get_json(get, "/data/summary.json")
+    board = get_json(get, "/api/leaderboard?limit=5")
+    assert board == {"season": None, "leaderboard": summary["leaderboard"][:5]}
+    season = get_json(get, "/api/leaderboard?season=current")
+    assert season["season"] == summary["summary"]["current_season_key"]
+    active = get_json(get, "/api/active-runs")["active_runs"]
+    assert active == summary["active_runs"]
+
+
+@pytest.mark.parametrize(
+    "path, status",
+    [
+        ("/api/players/999999", 404),
+        ("/api/players/999999/runs", 404),
+        ("/api/players?sort=bogus", 400),
+        ("/api/players?page=0", 400),
+        ("/api/players/1/runs?limit=x", 400),
+        ("/api/players/999999999999999999999", 400),
+        ("/api/players/-999999999999999999999/runs", 400),
+        ("/api/players/1/runs?before=99999999999999999999", 400),
+        ("/api/players?page=99999999999999999999", 400),
+        ("/api/players/9223372036854775807", 404),
+        ("/api/leaderboard?season=nope", 404),
+        ("/api/nope", 404),
+    ],
+)
+def test_api_errors(path, status, game_db, serve):
+    got, headers, body = serve(game_db)(path)
+    assert got == status
+    assert headers["cache-control"] == "no-store"
+    assert json.loads(body)["error"]
@@ -0,0 +1,122 @@
+import shutil
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import read_output
+
+# Sections and fields of the single stats.json the dashboard was first built
+# on; the split summary.json must keep serving them.
+BASELINE_FIELDS = {
+    "summary": {
+        "total_users_all",
+        "total_users_season",
+        "total_runs_season",
+        "active_runs",
+        "avg_max_floor_season",
+        "total_xp_season",
+        "current_season_key",
+        "tutorial_completion_rate",
+        "total_deaths",
+        "total_kills",
+        "total_treasures",
+        "total_chests",
+        "avg_run_minutes",
+        "runs_today",
+        "runs_last_7_days",
+        "avg_floor_today",
+        "avg_floor_last_7_days",
+    },
+    "distributions": {
+        "deaths_by_floor",
+        "kills_by_type",
+        "hero_runs",
+        "unlocked_heroes",
+        "run_max_floor",
+    },
+    "timeseries": {"runs_per_day"},
+    "monetization": {
+        "purchase_count",
+        "stars_bought",
+        "levels_bought",
+        "xp_from_purchases",
+        "stars_spent",
+        "actions_by_type",
+    },
+}
+LEADERBOARD_FIELDS = {"id", "username", "max_floor", "xp"}
+
+
+def test_full_build_keeps_baseline_fields(game_db, run_build):
+    summary = read_output(run_build(game_db))["summary.json"]
+    for section, fields in BASELINE_FIELDS.items():
+        assert fields <= set(summary[section]), section
+    assert summary["leaderboard"]
+    for entry in summary["leaderboard"]:
+        assert LEADERBOARD_FIELDS <= set(entry)
+    assert summary["summary"]["total_users_all"] == 200
+
+
+@pytest.mark.parametrize("mode", ["stream", "parallel", "incremental"])
+def test_build_modes_match_full(mode, game_db, run_build):
+    expected = read_output(run_build(game_db))
+    output = read_output(run_build(game_db, mode))
+    if mode == "stream":
+        # Stream builds leave analytics out to keep memory bounded.
+        assert output["summary.json"].pop("analytics") is None
+        expected["summary.json"].pop("analytics")
+    assert output == expected
+
+
+def test_days_season_bounds_are_inclusive_days(game_db, run_build):
+    # Seasons start at midnight on the 1st, so a season's last day is the
+    # day before the next one starts and the two never share a day.
+    seasons = read_output(run_build(game_db))["days.json"]["seasons"]
+    assert len(seasons) > 1
+    for season, following in zip(seasons, seasons[1:]):
+        assert season["first_day"] == season["season_key"] + "-01"
+        assert season["last_day"] < following["first_day"]
+        last = date.fromisoformat(season["last_day"])
+        assert (last + timedelta(days=1)).isoformat() == following["first_day"]
+    assert seasons[-1]["last_day"] is None
+
+
+def test_python_and_sql_engines_match(tmp_path, game_db, run_build):
+    db_path = str(tmp_path / "ruins.db")
+    shutil.copy(game_db, db_path)
+    conn = sqlite3.connect(db_path)
+    unlocked = [
+        '["knight", {"name": "mage"}, ["rogue"], null, true, 3, 2.5, "knight"]',
+        "not json",
+        '{"knight": 1}',
+        "[]",
+        None,
+    ]
+    for user_id, value in enumerate(unlocked, 1):
+        conn.execute(
+            "update users set unlocked_heroes_json = ? where id = ?", (value, user_id)
+        )
+    conn.execute(
+        "update user_stats set deaths_by_floor = '[1, 2]', "
+        "kills_json = '{\"orc\": \"3\", \"rat\": true}', "
+        "hero_runs_json = '{\"knight\": \" 2\", \"mage\": 1.5}' "
+        "where user_id in (1, 2)"
+    )
+    conn.commit()
+    conn.close()
+
+    outputs = [
+        read_output(
+            run_build(
+                db_path,
+                out_dir=str(tmp_path / engine),
+                STATS_AGGREGATE_ENGINE=engine,
+            )
+        )
+        for engine in ("python", "sql")
+    ]
+    assert outputs[0] == outputs[1]
+    heroes = dict(outputs[1]["summary.json"]["distributions"]["unlocked_heroes"])
+    assert heroes["None"] == heroes["True"] == heroes["3"] == heroes["2.5"] == 1
+    assert not any(key.startswith(("{", "[")) for key in heroes)
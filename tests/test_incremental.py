@@ -0,0 +1,22 @@
+import shutil
+import sqlite3
+
+from conftest import read_output
+
+
+def test_incremental_picks_up_rows_changed_without_activity(tmp_path, game_db, run_build):
+    db_path = str(tmp_path / "ruins.db")
+    shutil.copy(game_db, db_path)
+    run_build(db_path, "incremental", out_dir=str(tmp_path / "first"))
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("update users set username = 'renamed' where id = 11")
+    conn.execute("update user_stats set deaths = deaths + 5 where user_id = 12")
+    conn.commit()
+    conn.close()
+
+    incremental = read_output(
+        run_build(db_path, "incremental", out_dir=str(tmp_path / "second"))
+    )
+    assert incremental["players/11.json"]["username"] == "renamed"
+    assert incremental == read_output(run_build(db_path, "full"))
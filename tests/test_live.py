@@ -0,0 +1,61 @@
+import json
+import shutil
+import sqlite3
+
+import build_stats
+import live
+
+
+def test_feed_diffs_only_changed_runs(tmp_path, game_db, monkeypatch):
+    db_path = str(tmp_path / "ruins.db")
+    shutil.copy(game_db, db_path)
+    conn = sqlite3.connect(db_path)
+    # The game's own schema has no index on is_active.
+    conn.execute("drop index runs_active")
+    assert live.scans_all_runs(conn)
+    conn.execute(live.ACTIVE_INDEX)
+    conn.commit()
+    assert not live.scans_all_runs(conn)
+    monkeypatch.setenv("DB_PATH", db_path)
+
+    feed = live.ActiveRunFeed(interval=3600)
+    subscription, snapshot = feed.subscribe()
+    reader = build_stats.connect_readonly(db_path)
+    expected = [
+        build_stats.active_run_details(row)
+        for row in build_stats.read_active_runs(reader)
+    ]
+    assert snapshot == expected and len(snapshot) > 3
+
+    moved, ended, renamed = (run["run_id"] for run in snapshot[:3])
+    (state_json,) = conn.execute(
+        "select state_json from runs where id = ?", (moved,)
+    ).fetchone()
+    state = json.loads(state_json)
+    state["floor"] = 99
+    conn.execute(
+        "update runs set state_json = ? where id = ?", (json.dumps(state), moved)
+    )
+    conn.execute("update runs set is_active = 0 where id = ?", (ended,))
+    conn.execute(
+        "update users set username = 'renamed' "
+        "where id = (select user_id from runs where id = ?)",
+        (renamed,),
+    )
+    conn.commit()
+    conn.close()
+
+    feed.poll()
+    message = subscription.get_nowait().decode("utf-8")
+    diff = json.loads(message.split("data: ", 1)[1])
+    assert diff == {
+        "started": [],
+        "updated": [
+            {"run_id": moved, "changes": {"floor": 99}},
+            {"run_id": renamed, "changes": {"username": "renamed"}},
+        ],
+        "ended": [ended],
+    }
+    feed.poll()
+    assert subscription.empty()
+    reader.close()
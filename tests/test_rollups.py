@@ -0,0 +1,97 @@
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+import synthetic_db
+from conftest import read_output
+from synthetic_db import fmt
+
+
+def play(db_path):
+    """End one active run and add a finished and an active run today."""
+    now = datetime.now().replace(microsecond=0)
+    conn = sqlite3.connect(db_path)
+    (run_id,) = conn.execute(
+        "select id from runs where is_active order by id limit 1"
+    ).fetchone()
+    conn.execute(
+        "update runs set is_active = 0, ended_at = ?, max_floor = max_floor + 1 "
+        "where id = ?",
+        (fmt(now), run_id),
+    )
+    conn.executemany(
+        "insert into runs (user_id, started_at, ended_at, max_floor, is_active, "
+        "is_tutorial, state_json) values (?, ?, ?, ?, ?, 0, '{}')",
+        [
+            (3, fmt(now - timedelta(minutes=20)), fmt(now), 7, 0),
+            (4, fmt(now - timedelta(minutes=5)), None, 2, 1),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def rollup_meta(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("select key, value from meta"))
+    finally:
+        conn.close()
+
+
+def test_rollups_are_reused_across_snapshot_builds(tmp_path, game_db, run_build):
+    db_path = str(tmp_path / "ruins.db")
+    shutil.copy(game_db, db_path)
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    rollups = str(tmp_path / "rollups.db")
+    settings = dict(STATS_ROLLUP_PATH=rollups, STATS_SNAPSHOT_DIR=str(snapshots))
+
+    first = read_output(run_build(db_path, "full", str(tmp_path / "first"), **settings))
+    assert first == read_output(run_build(db_path, "full", str(tmp_path / "plain")))
+    built_at = rollup_meta(rollups)["built_at"]
+
+    play(db_path)
+    second_dir = str(tmp_path / "second")
+    second = read_output(run_build(db_path, "full", second_dir, **settings))
+    assert second != first
+    assert second == read_output(run_build(db_path))
+    # The store was folded forward, not rebuilt, and the snapshot released.
+    meta = rollup_meta(rollups)
+    assert meta["built_at"] == built_at
+    conn = sqlite3.connect(db_path)
+    assert meta["hwm"] == conn.execute("select max(id) from runs").fetchone()[0]
+    conn.close()
+    assert os.listdir(snapshots) == []
+
+
+def test_shard_rollups_are_reused(tmp_path, run_build):
+    paths = []
+    for seed, name in enumerate(["eu", "us"], 1):
+        path = str(tmp_path / f"{name}.db")
+        synthetic_db.generate(
+            path, users=40, runs_per_user=5, seed=seed, active_ratio=0.2
+        )
+        paths.append(path)
+    db_path = ",".join(paths)
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    settings = dict(
+        STATS_ROLLUP_PATH=str(tmp_path / "rollups.db"),
+        STATS_SNAPSHOT_DIR=str(snapshots),
+    )
+
+    run_build(db_path, "full", str(tmp_path / "first"), **settings)
+    built_at = {
+        name: rollup_meta(str(tmp_path / f"rollups-{name}.db"))["built_at"]
+        for name in ("eu", "us")
+    }
+    for path in paths:
+        play(path)
+    second_dir = str(tmp_path / "second")
+    second = read_output(run_build(db_path, "full", second_dir, **settings))
+    assert second == read_output(run_build(db_path))
+    for name, stamp in built_at.items():
+        assert rollup_meta(str(tmp_path / f"rollups-{name}.db"))["built_at"] == stamp
+    assert os.listdir(snapshots) == []
@@ -0,0 +1,58 @@
+import gzip
+import json
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/data/summary.json", "/data/players/1.json"])
+def test_conditional_get(path, game_db, serve):
+    get = serve(game_db)
+    status, headers, body = get(path)
+    assert status == 200
+    etag = headers["etag"]
+    modified = headers["last-modified"]
+    assert json.loads(body)
+
+    status, headers, body = get(path, {"If-None-Match": etag})
+    assert (status, body) == (304, b"")
+    assert headers["etag"] == etag
+    assert get(path, {"If-None-Match": f'"other", W/{etag}'})[0] == 304
+    assert get(path, {"If-None-Match": "*"})[0] == 304
+    assert get(path, {"If-None-Match": '"other"'})[0] == 200
+    assert get(path, {"If-Modified-Since": modified})[0] == 304
+    epoch = "Thu, 01 Jan 1970 00:00:00 GMT"
+    assert get(path, {"If-Modified-Since": epoch})[0] == 200
+    # If-None-Match wins over If-Modified-Since.
+    request = {"If-None-Match": '"other"', "If-Modified-Since": modified}
+    assert get(path, request)[0] == 200
+
+
+def test_compressed_variant_has_its_own_etag(game_db, serve):
+    get = serve(game_db)
+    _, plain, body = get("/data/summary.json")
+    status, headers, compressed = get(
+        "/data/summary.json", {"Accept-Encoding": "gzip"}
+    )
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert headers["etag"] != plain["etag"]
+    for etag, status in ((plain["etag"], 200), (headers["etag"], 304)):
+        request = {"If-None-Match": etag, "Accept-Encoding": "gzip"}
+        assert get("/data/summary.json", request)[0] == status
+
+
+def test_missing_data_file(game_db, serve):
+    get = serve(game_db)
+    assert get("/data/players/999999.json")[0] == 404
+    assert get("/data/../../scripts/server.json")[0] == 404
+
+
+def test_watcher_does_not_create_a_missing_database(tmp_path):
+    import server
+
+    path = str(tmp_path / "not-mounted" / "ruins.db")
+    os.makedirs(os.path.dirname(path))
+    assert server.StatsCache()._db_signature(path) == ((path, None, None, None),)
+    assert not os.path.exists(path)
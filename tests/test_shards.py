@@ -0,0 +1,39 @@
+import json
+import re
+import urllib.parse
+
+import synthetic_db
+
+# The id pattern public/player.js accepts in ?id=.
+PLAYER_ID = re.compile(r"([\w.-]+:)?\d+")
+
+
+def test_shard_ids_round_trip(tmp_path, serve):
+    paths = []
+    for seed, name in enumerate(["eu", "us.west"], 1):
+        path = str(tmp_path / f"{name}.db")
+        synthetic_db.generate(path, users=30, runs_per_user=4, seed=seed)
+        paths.append(path)
+    get = serve(",".join(paths))
+
+    def get_json(path):
+        status, _, body = get(path)
+        assert status == 200, path
+        return json.loads(body)
+
+    index = get_json("/data/users/1.json")
+    ids = [entry["id"] for entry in index["users"]]
+    assert len(ids) == 60
+    assert {player_id.split(":")[0] for player_id in ids} == {"eu", "us.west"}
+    summary = get_json("/data/summary.json")
+    ids += [entry["id"] for entry in summary["leaderboard"]]
+    ids += [run["user_id"] for run in summary["active_runs"]]
+    for player_id in ids:
+        assert PLAYER_ID.fullmatch(player_id)
+        # The same encoding player.js uses for its fetch.
+        quoted = urllib.parse.quote(player_id, safe="")
+        assert get_json(f"/data/players/{quoted}.json")["id"] == player_id
+
+    status, _, body = get("/api/players/1")
+    assert status == 501
+    assert json.loads(body)["error"]
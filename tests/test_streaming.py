@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+import pytest
+
+import synthetic_db
+from conftest import SCRIPTS
+
+# ru_maxrss keeps the high-water mark of the forked parent across exec;
+# VmHWM belongs to the build's own address space.
+PEAK_RSS = """
+import build_stats
+build_stats.main()
+for line in open("/proc/self/status"):
+    if line.startswith("VmHWM:"):
+        print(line.split()[1])
+"""
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="reads /proc/self/status")
+def test_stream_peak_memory_does_not_grow_with_history(tmp_path, build_env):
+    peaks = []
+    for runs_per_user in (10, 80):
+        db_path = str(tmp_path / f"runs-{runs_per_user}.db")
+        synthetic_db.generate(db_path, users=1000, runs_per_user=runs_per_user)
+        process = subprocess.run(
+            [sys.executable, "-c", PEAK_RSS],
+            cwd=SCRIPTS,
+            env=build_env(
+                db_path, "stream", out_dir=str(tmp_path / f"out-{runs_per_user}")
+            ),
+            capture_output=True,
+            text=True,
+        )
+        assert process.returncode == 0, process.stderr
+        peaks.append(int(process.stdout.split()[-1]))
+    # Eight times the runs is about 50 MB more database; a stream build may
+    # only pay for it in fixed-size batches.
+    assert peaks[1] - peaks[0] < 4 * 1024, peaks